@@ -121,6 +121,14 @@ class VaspCalculation(VaspCalcBase):
         spec.output('hessian', valid_type=get_data_class('array'), required=False, help='The output Hessian matrix.')
         spec.output('dynmat', valid_type=get_data_class('array'), required=False, help='The output dynamical matrix.')
         spec.output('site_magnetization', valid_type=get_data_class('dict'), required=False, help='The output of the site magnetization')
+        spec.output('performance_profile',
+                    valid_type=get_data_class('dict'),
+                    required=False,
+                    help='The timings of the electronic and ionic steps and the parallel setup of the VASP run.')
+        spec.output('parser_profile',
+                    valid_type=get_data_class('dict'),
+                    required=False,
+                    help='The timing and memory profile of the parser.')
         spec.exit_code(0, 'NO_ERROR', message='the sun is shining')
         spec.exit_code(350, 'ERROR_NO_RETRIEVED_FOLDER', message='the retrieved folder data node could not be accessed.')
         spec.exit_code(351,
@@ -138,6 +146,13 @@ class VaspCalculation(VaspCalcBase):
             message=
             'the vasprun.xml was truncated and recovery parsing failed to parse at least one of the requested quantities: {quantities}, '
             'very likely the VASP calculation did not run properly')
+        spec.exit_code(1004,
+                       'ERROR_QUANTITY_EXCEEDS_MEMORY_BUDGET',
+                       message='the estimated size of the {quantity} quantity ({size} MB) exceeds max_parse_memory ({limit} MB)')
+        spec.exit_code(1005,
+                       'ERROR_VASP_OUTPUT_TRUNCATED',
+                       message='the output files {files} are truncated, very likely VASP did not finish')
+        spec.exit_code(1006, 'ERROR_VASP_CRASHED', message='VASP stopped with the unrecoverable errors: {errors}')
 
     def prepare_for_submission(self, tempfolder):
         """
@@ -0,0 +1,76 @@
+"""
+Compressed array data.
+
+----------------------
+Array data node that stores each array as a .npz file in the repository, compressed and optionally
+as the indices and values of its nonzero elements only. The arrays are read back dense with get_array,
+so the node can be used in place of ArrayData.
+"""
+# pylint: disable=abstract-method
+# explanation: pylint wrongly complains about (aiida) Node not implementing query
+import io
+import re
+
+import numpy as np
+from aiida.orm import ArrayData
+
+
+class CompressedArrayData(ArrayData):
+    """ArrayData storing the arrays in compressed .npz files, sparse arrays as their nonzero elements."""
+
+    def set_array(self, name, array, compress=True, sparse=False):  # pylint: disable=arguments-differ
+        """
+        Store an array.
+
+        :param compress: store the .npz file compressed.
+        :param sparse: store only the nonzero elements, if that takes less space than the full array.
+        """
+        if not isinstance(array, np.ndarray):
+            raise TypeError('ArrayData can only store numpy arrays. Convert the object to an array first')
+        if not name or re.sub('[0-9a-zA-Z_]', '', name):
+            raise ValueError('The name assigned to the array ({}) is not valid, '
+                             'it can only contain digits, letters and underscores'.format(name))
+
+        contents = {'array': array}
+        if sparse:
+            indices = np.flatnonzero(array)
+            index_dtype = np.min_scalar_type(max(array.size - 1, 0))
+            if indices.size * (index_dtype.itemsize + array.itemsize) < array.nbytes:
+                contents = {'shape': np.asarray(array.shape), 'indices': indices.astype(index_dtype), 'values': array.ravel()[indices]}
+        handle = io.BytesIO()
+        if compress:
+            np.savez_compressed(handle, **contents)
+        else:
+            np.savez(handle, **contents)
+        handle.seek(0)
+        self.put_object_from_filelike(handle, '{}.npz'.format(name), mode='wb', encoding=None, force=True)
+        self.set_attribute('{}{}'.format(self.array_prefix, name), list(array.shape))
+
+    def get_array(self, name):
+        """Return an array, dense and of the shape it was stored with."""
+        if self.is_stored and name in self._cached_arrays:
+            return self._cached_arrays[name]
+        filename = '{}.npz'.format(name)
+        if filename not in self.list_object_names():
+            raise KeyError('Array with name `{}` not found in node<{}>'.format(name, self.pk))
+        with self.open(filename, mode='rb') as handle:
+            with np.load(io.BytesIO(handle.read()), allow_pickle=False) as contents:
+                if 'array' in contents:
+                    array = contents['array']
+                else:
+                    array = np.zeros(tuple(contents['shape']), dtype=contents['values'].dtype)
+                    array.flat[contents['indices']] = contents['values']
+        if self.is_stored:
+            self._cached_arrays[name] = array
+        return array
+
+    def delete_array(self, name):
+        filename = '{}.npz'.format(name)
+        if filename not in self.list_object_names():
+            raise KeyError('Array with name `{}` not found in node<{}>'.format(name, self.pk))
+        self.delete_attribute('{}{}'.format(self.array_prefix, name))
+        self.delete_object(filename)
+
+    def _arraynames_from_files(self):
+        """Return the names of the arrays stored in the repository, which ArrayData validates against the attributes."""
+        return [name[:-len('.npz')] for name in self.list_object_names() if name.endswith('.npz')]
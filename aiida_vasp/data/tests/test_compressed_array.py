@@ -0,0 +1,49 @@
+"""Unit test the compressed array data node."""
+# pylint: disable=unused-import,unused-argument,redefined-outer-name
+import numpy as np
+
+from aiida_vasp.utils.aiida_utils import get_data_class
+from aiida_vasp.utils.fixtures.environment import fresh_aiida_env
+from aiida_vasp.parsers.node_composer import NodeComposer, StoragePolicy
+
+
+def test_round_trip(fresh_aiida_env):
+    """Dense and sparse arrays are read back as stored, also after storing the node."""
+    dense = np.arange(24, dtype=float).reshape(2, 3, 4)
+    sparse = np.zeros((10, 20))
+    sparse[3, 7] = 1.5
+    node = get_data_class('vasp.compressed_array')()
+    node.set_array('dense', dense, sparse=True)
+    node.set_array('sparse', sparse, sparse=True)
+    node.set_array('plain', dense, compress=False)
+    assert set(node.get_arraynames()) == {'dense', 'sparse', 'plain'}
+    node.store()
+    for name, array in [('dense', dense), ('sparse', sparse), ('plain', dense)]:
+        assert np.array_equal(node.get_array(name), array)
+        assert node.get_shape(name) == array.shape
+
+
+def test_compose_with_policy(fresh_aiida_env):
+    """The storage policy downcasts and sparsifies the float arrays of an array node."""
+    projectors = np.array([[0.5, 1e-6], [0.0, 0.25]])
+    inputs = {'projectors': {'projectors': projectors, 'counts': np.array([1, 2])}}
+    node = NodeComposer.compose('array', inputs, storage_policy=StoragePolicy(dtype='float32', sparse_threshold=1e-4, compress=True))
+    assert isinstance(node, get_data_class('vasp.compressed_array'))
+    assert node.get_array('projectors').dtype == np.float32
+    assert np.array_equal(node.get_array('projectors'), [[0.5, 0.0], [0.0, 0.25]])
+    assert np.array_equal(node.get_array('counts'), [1, 2])
+    node = NodeComposer.compose('array', inputs, storage_policy=StoragePolicy(dtype='float16'))
+    assert isinstance(node, get_data_class('array')) and node.get_array('projectors').dtype == np.float16
+
+
+def test_store_composed_with_policy(fresh_aiida_env):
+    """A node composed with a storage policy passes the validation of ArrayData when stored."""
+    projectors = np.zeros((4, 6))
+    projectors[1, 2] = 0.75
+    inputs = {'projectors': {'projectors': projectors}}
+    storage_policy = StoragePolicy(sparse_threshold=1e-4, compress=True)
+    node = NodeComposer._compose_array_with_policy(inputs, storage_policy)  # pylint: disable=protected-access
+    node.store()
+    assert node.is_stored
+    assert node.get_arraynames() == ['projectors']
+    assert np.array_equal(node.get_array('projectors'), projectors)
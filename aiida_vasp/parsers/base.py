@@ -7,6 +7,7 @@ import os
 
 from aiida.parsers.parser import Parser
 from aiida.common.exceptions import NotExistent
+from aiida_vasp.parsers.file_access import RetrievedFiles
 
 
 class BaseParser(Parser):
@@ -16,6 +17,7 @@ class BaseParser(Parser):
         super(BaseParser, self).__init__(node)
         self._retrieved_content = None
         self._retrieved_temporary = None
+        self._files = None
 
     def parse(self, **kwargs):
         """Check the folders and set the retrieved_content for use in extending parsers."""
@@ -61,6 +63,8 @@ class BaseParser(Parser):
 
         # Store the retrieved content
         self._retrieved_content = retrieved
+        self._close_files()
+        self._files = RetrievedFiles(self.retrieved if exit_code_permanent is None else None, retrieved, self.logger)
         # OK if a least one of the folders are present
         if exit_code_permanent is None or exit_code_temporary is None:
             return None
@@ -86,28 +90,28 @@ class BaseParser(Parser):
         """
         Convenient access to retrieved and retrieved_temporary files.
 
+        Files that are not stored on the file system by the repository are copied once to a temporary
+        folder, which is valid until ``_close_files`` is called.
+
         :param fname: name of the file
         :return: absolute path to the retrieved file
         """
+        if self._files is None:
+            return None
+        return self._files.get_path(fname)
 
-        try:
-            if self._retrieved_content[fname]['status'] == 'permanent':
-                try:
-                    with self.retrieved.open(fname) as file_obj:
-                        ofname = file_obj.name
-                    return ofname
-                except OSError:
-                    self.logger.warning(fname + ' not found in retrieved')
-                    return None
-            else:
-                path = self._retrieved_content[fname]['path']
-                file_path = os.path.join(path, fname)
-                try:
-                    with open(file_path, 'r') as file_obj:
-                        ofname = file_path
-                    return ofname
-                except OSError:
-                    self.logger.warning(fname + ' not found in retrieved_temporary')
-                    return None
-        except KeyError:
+    def _get_file_source(self, fname):
+        """
+        Access to retrieved files without copying them.
+
+        :param fname: name of the file
+        :return: absolute path to the retrieved file or, if it is not stored on the file system, a readable binary handle
+        """
+        if self._files is None:
             return None
+        return self._files.get_source(fname)
+
+    def _close_files(self):
+        """Release the handles and temporary copies of the retrieved files."""
+        if self._files is not None:
+            self._files.close()
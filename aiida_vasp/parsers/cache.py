@@ -0,0 +1,198 @@
+"""
+Parse result cache.
+
+-------------------
+An optional on-disk cache of parsed quantities. Entries are addressed by the content
+hash of the parsed file, the file parser class and its format version, the versions of
+aiida-vasp and parsevasp, the quantity key and the parser settings that influence the
+parsed values. Re-parsing unchanged files, e.g. when
+re-running the parser, importing the same folder twice or only changing which nodes are
+added, can then skip the construction of the file parser entirely.
+"""
+import os
+import json
+import pickle
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+import parsevasp
+
+from aiida_vasp import __version__
+from aiida_vasp.parsers.file_access import open_source
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'aiida-vasp', 'parser')
+DEFAULT_MAX_SIZE = 1024  # in MB
+# Parser settings that do not influence the value of a parsed quantity.
+NON_PARSING_SETTINGS = ('parse_cache', 'parallel_files', 'parser_profile')
+CHUNK_SIZE = 1024 * 1024
+SUFFIX = '.pkl'
+# Minimum time in seconds between two evictions of a cache directory by the same process.
+EVICTION_INTERVAL = 60
+# Cache directory -> time of its last eviction by this process.
+_LAST_EVICTIONS = {}
+
+
+def get_parse_cache(settings):
+    """
+    Return a ParseCache if enabled in the parser settings, otherwise None.
+
+    The `parse_cache` entry can either be True, using the defaults, or a dict with the
+    optional keys `directory` and `max_size` (in MB).
+    """
+    cache_settings = settings.get('parse_cache', False)
+    if not cache_settings:
+        return None
+    if not isinstance(cache_settings, dict):
+        cache_settings = {}
+    return ParseCache(directory=cache_settings.get('directory', DEFAULT_CACHE_DIRECTORY),
+                      max_size=cache_settings.get('max_size', DEFAULT_MAX_SIZE))
+
+
+def hash_file(source):
+    """Return the sha256 hex digest of the content of a file, given as a path or a binary handle."""
+    sha = hashlib.sha256()
+    with open_source(source) as file_obj:
+        for chunk in iter(lambda: file_obj.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def is_cacheable(value):
+    """Check that a parsed value only consists of plain python and numpy types."""
+    if value is None or isinstance(value, (bool, int, float, str, np.ndarray, np.generic)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(is_cacheable(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, (str, int)) and is_cacheable(item) for key, item in value.items())
+    return False
+
+
+class ParseCache(object):  # pylint: disable=useless-object-inheritance
+    """
+    Size bounded on-disk cache of parsed quantities.
+
+    Every entry is a pickle of the parsed quantity together with the exit code the file
+    parser set while parsing it. When the total size of the cache exceeds `max_size` (in MB),
+    the least recently used entries are evicted. As this lists the whole cache directory, it is
+    only done after new entries have been written, at most every EVICTION_INTERVAL seconds, such
+    that the cache can exceed its size for a while.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_size=DEFAULT_MAX_SIZE):
+        self._directory = directory
+        self._max_size = int(max_size * 1024 * 1024)
+        self._num_written = 0
+        os.makedirs(self._directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @staticmethod
+    def get_key(file_hash, file_parser_cls, quantity_key, settings):
+        """Compose the key of a cache entry."""
+        relevant_settings = {
+            key: value for key, value in settings.items() if not key.startswith('add_') and key not in NON_PARSING_SETTINGS
+        }
+        identifier = json.dumps(
+            {
+                'file_hash': file_hash,
+                'file_parser': '{}.{}'.format(file_parser_cls.__module__, file_parser_cls.__name__),
+                'format_version': file_parser_cls.FORMAT_VERSION,
+                'version': __version__,
+                'parsevasp_version': parsevasp.__version__,
+                'quantity_key': quantity_key,
+                'settings': relevant_settings
+            },
+            sort_keys=True,
+            default=str)
+        return hashlib.sha256(identifier.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + SUFFIX)
+
+    def get(self, key):
+        """
+        Fetch an entry.
+
+        :return: tuple (hit, payload), where payload is None if there was no hit.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as handle:
+                payload = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return False, None
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return True, payload
+
+    def put(self, key, payload):
+        """Store an entry, ignoring payloads that can not be pickled."""
+        try:
+            data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        # Write to a temporary file first, so that concurrent readers never see partial entries.
+        handle, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self._num_written += 1
+        return True
+
+    def size(self):
+        """Return the total size of the cache entries in bytes."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict_if_due(self):
+        """
+        Evict if entries have been written and the cache directory was not evicted in the last EVICTION_INTERVAL seconds.
+
+        :return: whether the cache was evicted.
+        """
+        if not self._num_written:
+            return False
+        now = time.monotonic()
+        last_eviction = _LAST_EVICTIONS.get(self._directory)
+        if last_eviction is not None and now - last_eviction < EVICTION_INTERVAL:
+            return False
+        _LAST_EVICTIONS[self._directory] = now
+        self._num_written = 0
+        self.evict()
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits within its maximum size."""
+        entries = []
+        for entry in self._entries():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(item[1] for item in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self._directory) if entry.is_file() and entry.name.endswith(SUFFIX)]
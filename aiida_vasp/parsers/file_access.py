@@ -0,0 +1,132 @@
+"""
+Access to retrieved files.
+
+--------------------------
+The parsers access a file either through its path or through a readable binary handle, which
+are both called the source of the file here. Files in the retrieved_temporary folder and permanent
+files in a repository that stores them on the file system are given as paths. Otherwise the
+repository is read through a handle, such that the file is not copied. Only if a path is
+required, a single temporary copy of the file is made, which is shared for the rest of the parse.
+"""
+import io
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def open_source(source, mode='rb'):
+    """
+    Open a source for reading from its start.
+
+    A path is opened and closed again, while a handle is rewound and left open for its owner.
+    Text mode wraps the binary handle, which is detached again on exit.
+    """
+    if isinstance(source, str):
+        with open(source, mode) as file_obj:
+            yield file_obj
+        return
+    source.seek(0)
+    if 'b' in mode:
+        yield source
+        return
+    wrapper = io.TextIOWrapper(source, encoding='utf8')
+    try:
+        yield wrapper
+    finally:
+        wrapper.detach()
+
+
+def get_source_size(source):
+    """Return the size in bytes of a source or None if it can not be determined."""
+    if source is None:
+        return None
+    if isinstance(source, str):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return None
+    try:
+        source.seek(0, os.SEEK_END)
+        size = source.tell()
+        source.seek(0)
+        return size
+    except (OSError, AttributeError):
+        return None
+
+
+class RetrievedFiles(object):  # pylint: disable=useless-object-inheritance
+    """
+    The retrieved files of one parse.
+
+    :param retrieved: the retrieved FolderData or None if it is not present.
+    :param retrieved_content: dict of file name -> {'path', 'status'}, see BaseParser._compose_retrieved_content.
+
+    Handles and temporary copies are released by ``close``.
+    """
+
+    def __init__(self, retrieved, retrieved_content, logger):
+        self._retrieved = retrieved
+        self._retrieved_content = retrieved_content
+        self._logger = logger
+        self._sources = {}
+        self._copies = {}
+        self._copy_dir = None
+        self._handles = ExitStack()
+
+    def get_source(self, file_name):
+        """Return the path or an open binary handle of a retrieved file or None if it is not present."""
+        if file_name not in self._sources:
+            self._sources[file_name] = self._resolve(file_name)
+        return self._sources[file_name]
+
+    def get_path(self, file_name):
+        """Return a path to a retrieved file, copying it once to a temporary folder if it is only available as a handle."""
+        source = self.get_source(file_name)
+        if source is None or isinstance(source, str):
+            return source
+        if file_name not in self._copies:
+            if self._copy_dir is None:
+                self._copy_dir = tempfile.mkdtemp(prefix='aiida-vasp-')
+            path = os.path.join(self._copy_dir, file_name)
+            with open_source(source) as handle, open(path, 'wb') as copy:
+                shutil.copyfileobj(handle, copy, CHUNK_SIZE)
+            self._copies[file_name] = path
+        return self._copies[file_name]
+
+    def close(self):
+        """Close the handles and remove the temporary copies."""
+        self._handles.close()
+        self._sources = {}
+        self._copies = {}
+        if self._copy_dir is not None:
+            shutil.rmtree(self._copy_dir, ignore_errors=True)
+            self._copy_dir = None
+
+    def _resolve(self, file_name):
+        """Find the source of a file, preferring a path on the file system."""
+        try:
+            content = self._retrieved_content[file_name]
+        except KeyError:
+            return None
+
+        if content['status'] != 'permanent':
+            file_path = os.path.join(content['path'], file_name)
+            if not os.path.isfile(file_path):
+                self._logger.warning(file_name + ' not found in retrieved_temporary')
+                return None
+            return file_path
+
+        try:
+            handle = self._handles.enter_context(self._retrieved.open(file_name, mode='rb'))
+        except OSError:
+            self._logger.warning(file_name + ' not found in retrieved')
+            return None
+        file_path = getattr(handle, 'name', None)
+        if isinstance(file_path, str) and os.path.isfile(file_path):
+            # The repository stores the file on the file system, so it can be accessed directly.
+            return file_path
+        return handle
@@ -20,6 +20,9 @@ class ChgcarParser(BaseFileParser):
         },
     }
 
+    # The quantity is the path or handle of the retrieved file, which is only valid for the current parse.
+    CACHEABLE = False
+
     def __init__(self, *args, **kwargs):
         super(ChgcarParser, self).__init__(*args, **kwargs)
         self._chgcar = None
@@ -31,6 +34,9 @@ class ChgcarParser(BaseFileParser):
         result = {}
 
         chgcar = self._data_obj.path
+        if chgcar is None:
+            # The node can also be created from the handle of a file that is not on the file system.
+            chgcar = self._data_obj.handler
         if chgcar is None:
             return {'chgcar': None}
 
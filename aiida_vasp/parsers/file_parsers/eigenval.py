@@ -53,7 +53,7 @@ class EigParser(BaseFileParser):
     def _read_eigenval(self):
         """Parse a VASP EIGENVAL file and extract metadata and a band structure data array."""
 
-        with open(self._data_obj.path) as eig:
+        with self._data_obj.open(mapped=True) as eig:
             line_0 = self.line(eig, int)  # read header
             line_1 = self.line(eig, float)  # "
             line_2 = self.line(eig, float)  # "
@@ -62,7 +62,8 @@ class EigParser(BaseFileParser):
             param_0, num_kp, num_bands = self.line(eig, int)  # read: ? #kp #bands
             data = eig.read()  # rest is data
         num_ions, num_atoms, p00, num_spins = line_0
-        data = re.split(self.empty_line, data)  # list of data blocks
+        empty_line = self.empty_line_bytes if isinstance(data, bytes) else self.empty_line
+        data = re.split(empty_line, data)  # list of data blocks
         data = [[line.split() for line in block.splitlines()] for block in data]
         kpoints = np.zeros((num_kp, 4))
         bands = np.zeros((num_spins, num_kp, num_bands))
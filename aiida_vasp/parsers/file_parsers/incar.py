@@ -70,7 +70,8 @@ class IncarParser(BaseFileParser):
             return {'incar': self._data_obj}
 
         try:
-            incar = Incar(file_path=self._data_obj.path, logger=self._logger)
+            with self._data_obj.parsevasp_source() as source:
+                incar = Incar(logger=self._logger, **source)
         except SystemExit:
             self._logger.warning('Parsevasp exitited abnormally. Returning None.')
             return {'incar': None}
@@ -6,22 +6,29 @@ The file parser that handles the parsing of OUTCAR files.
 """
 import re
 
-from parsevasp.outcar import Outcar
+import numpy as np
+
 from aiida_vasp.parsers.file_parsers.parser import BaseFileParser, SingleFile
+from aiida_vasp.parsers.file_parsers.scanner import LineScanner, TailScanner
+from aiida_vasp.parsers.file_parsers.vasprun_arrays import STEP_FIELDS, StepSelection
 from aiida_vasp.parsers.node_composer import NodeComposer, get_node_composer_inputs_from_file_parser
 
 DEFAULT_OPTIONS = {'quantities_to_parse': ['elastic_moduli', 'symmetries']}
+# Size of the end of OUTCAR in bytes, in which the timing and memory blocks of the run statistics are searched.
+RUN_STATS_TAIL_SIZE = 16 * 1024
 
 
 class OutcarParser(BaseFileParser):
     """
-    Interface to parsevasp's OUTCAR parser.
+    Parser for the quantities of OUTCAR, which are all collected in a single pass over the file.
 
     The quantities listed here are not yet ejected in the xml file:
     - symmetries
     - elastic moduli
 
-    And we can thus not fully rely on the xml parser.
+    And we can thus not fully rely on the xml parser. The trajectory of the ionic steps is read from OUTCAR
+    as a fallback, if it can not be read from vasprun.xml. The performance profile collects the timings of
+    each electronic and ionic step and the parallel setup of the run.
 
     No possibilities to write OUTCAR files have been implemented.
 
@@ -57,27 +64,98 @@ class OutcarParser(BaseFileParser):
             'inputs': [],
             'name': 'run_stats',
             'prerequisites': [],
+        },
+        'outcar-trajectory': {
+            'inputs': [],
+            'name': 'trajectory',
+            'prerequisites': [],
+            'fallback': True
+        },
+        'performance_profile': {
+            'inputs': [],
+            'name': 'performance_profile',
+            'prerequisites': [],
         }
     }
 
+    # The scans of the quantities that are not read in the scan from the start of OUTCAR. The final state of
+    # the run is read from the end of the file.
+    QUANTITY_SCANS = {
+        'run_stats': 'final_state',
+        'magnetization': 'final_state',
+        'site_magnetization': 'final_state',
+    }
+    # The quantities of each step, which are only collected in the scan from the start if they are requested.
+    STEP_QUANTITIES = ('outcar-trajectory', 'performance_profile')
+
     def __init__(self, *args, **kwargs):
         super(OutcarParser, self).__init__(*args, **kwargs)
         self._outcar = None
+        self._scanned = set()
         self.init_with_kwargs(**kwargs)
 
     def _init_with_file_path(self, path):
         """Init with a filepath."""
+        self._init_outcar(SingleFile(path=path))
+
+    def _init_with_file_handler(self, handler):
+        """Init with a readable binary file handler."""
+        self._init_outcar(SingleFile(handler=handler))
+
+    def _init_outcar(self, data_obj):
+        """Prepare the scans of the file."""
         self._parsed_data = {}
         self._parsable_items = self.__class__.PARSABLE_ITEMS
-        self._data_obj = SingleFile(path=path)
+        self._data_obj = data_obj
+        self._outcar = OutcarQuantities()
+        self._scanned = set()
 
-        # Since OUTCAR can be fairly large, we will parse it only
-        # once and store the parsevasp Outcar object.
-        try:
-            self._outcar = Outcar(file_path=path, logger=self._logger)
-        except SystemExit:
-            self._logger.warning('Parsevasp exited abruptly. Returning None.')
-            self._outcar = None
+    def _scan(self, quantity_key):
+        """
+        Scan the file for a quantity, from its end for the 'final_state', or from its start for the other quantities.
+
+        Since OUTCAR can be fairly large, each scan is done only once, collecting all quantities of its kind. The
+        scan from the start also collects the requested STEP_QUANTITIES, such that the file is only scanned again
+        for one that was not requested.
+        Returns whether the file contains an electronic step, otherwise there is nothing to parse.
+        """
+        scan = self.QUANTITY_SCANS.get(quantity_key, 'forward')
+        scans = {scan}
+        if scan == 'forward':
+            scans.update(self._get_requested_step_quantities(quantity_key))
+        scans.difference_update(self._scanned)
+        if scans:
+            self._scanned.update(scans)
+            if scan == 'final_state':
+                scanner = TailScanner()
+                self._outcar.register_final_state(scanner)
+                with self._data_obj.open('rb', mapped=True) as outcar_file_object:
+                    scanner.scan(outcar_file_object)
+            else:
+                scanner = LineScanner()
+                if 'forward' in scans:
+                    self._outcar.register(scanner)
+                if 'outcar-trajectory' in scans:
+                    self._outcar.register_trajectory(scanner, self._get_step_selection())
+                if 'performance_profile' in scans:
+                    self._outcar.register_performance_profile(scanner)
+                with self._data_obj.open(mapped=True) as outcar_file_object:
+                    scanner.scan(outcar_file_object)
+            if not self._outcar.has_electronic_steps:
+                self._logger.warning('A crash detected before the first SCF step in OUTCAR. Returning None.')
+        return self._outcar.has_electronic_steps
+
+    def _get_requested_step_quantities(self, quantity_key):
+        """
+        Return the STEP_QUANTITIES to collect in the scan from the start: the quantity key and those required for the nodes.
+
+        A quantity marked as a fallback is only collected for its own quantity key, as it is parsed in a later round otherwise.
+        """
+        names_to_parse = self._settings.quantity_names_to_parse if self._settings is not None else []
+        return [
+            key for key in self.STEP_QUANTITIES if key == quantity_key or
+            (self.PARSABLE_ITEMS[key]['name'] in names_to_parse and not self.PARSABLE_ITEMS[key].get('fallback', False))
+        ]
 
     def _init_with_data(self, data):
         """Init with SingleFileData."""
@@ -96,29 +174,41 @@ class OutcarParser(BaseFileParser):
             quantities_to_parse = self._settings.quantity_names_to_parse
 
         result = {}
-
-        if self._outcar is None:
-            # parsevasp threw an exception, which means OUTCAR could not be parsed.
-            for quantity in quantities_to_parse:
-                if quantity in self.parsable_items:
-                    result[quantity] = None
-            return result
-
         for quantity in quantities_to_parse:
             if quantity in self.parsable_items:
-                result[quantity] = getattr(self, quantity)
+                result[quantity] = self.get_quantity(quantity)
 
         return result
 
+    def _get_step_selection(self):
+        """Return the ionic steps and fields of the trajectory to read from the `trajectory_*` settings, None for all."""
+        try:
+            return StepSelection.from_settings(self._settings)
+        except ValueError as error:
+            self._logger.warning('Ignoring the trajectory selection, reading all ionic steps: {}'.format(error))
+            return None
+
+    def _parse_quantity(self, quantity_key, inputs):  # pylint: disable=unused-argument
+        """Evaluate only the requested quantity."""
+        if not self._scan(quantity_key):
+            # OUTCAR ended before the first electronic step, there is nothing to parse.
+            return {quantity_key: None}
+        if quantity_key in self._outcar.unparsable:
+            self._logger.warning('OUTCAR is truncated or garbled, the {} could not be read. Returning None.'.format(quantity_key))
+            if self._exit_codes is not None:
+                self._exit_code = self._exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.format(quantity=quantity_key)
+            return {quantity_key: None}
+        return {quantity_key: getattr(self, quantity_key.replace('-', '_'))}
+
     @property
     def run_stats(self):
         """Fetch the run statistics"""
-        return self._outcar.get_run_stats()
+        return self._outcar.run_stats
 
     @property
     def symmetries(self):
         """Fetch the symmetries, but only the point group (if it exists)."""
-        extended = self.symmetries_extended
+        extended = self.get_quantity('symmetries_extended')
         sym = {
             'point_group': extended['point_group'],
             'primitive_translations': extended['primitive_translations'],
@@ -130,7 +220,7 @@ class OutcarParser(BaseFileParser):
     @property
     def symmetries_extended(self):
         """Fetch the symmetries, including operations etc."""
-        sym = self._outcar.get_symmetry()
+        sym = self._outcar.symmetry
         # We do not want to store the site symmetry at origin
         sym = {key: value for key, value in sym.items() if key != 'site_symmetry_at_origin'}
         return sym
@@ -138,17 +228,427 @@ class OutcarParser(BaseFileParser):
     @property
     def elastic_moduli(self):
         """Fetch the elastic moduli."""
-        return self._outcar.get_elastic_moduli()
+        return self._outcar.elastic_moduli
 
     @property
     def magnetization(self):
         """Fetch the full cell magnetization."""
-        return self._outcar.get_magnetization()['full_cell']
+        return self._outcar.magnetization['full_cell']
 
     @property
     def site_magnetization(self):
         """Fetch the site dependent magnetization."""
-        return self._outcar.get_magnetization()
+        return self._outcar.magnetization
+
+    @property
+    def outcar_trajectory(self):
+        """Fetch the unitcells, positions, symbols, forces and stress of the ionic steps."""
+        return self._outcar.trajectory.get_trajectory()
+
+    @property
+    def performance_profile(self):
+        """Fetch the timings of the electronic and ionic steps, the memory usage and the parallel setup."""
+        return self._outcar.performance_profile
+
+
+class OutcarQuantities(object):  # pylint: disable=useless-object-inheritance
+    """
+    The quantities of OUTCAR read by OutcarParser, collected by the handlers registered on a LineScanner.
+
+    The dictionaries follow the layout of the parsevasp Outcar parser. The quantities of the final state of the
+    run, the magnetization and the run statistics, are read from the end of the file with a TailScanner.
+    A line that a handler can not convert, as OUTCAR is truncated or garbled, does not stop the scan, instead
+    the quantities read by the handler are added to `unparsable`.
+    """
+
+    ORBITALS = ('s', 'p', 'd', 'f')
+    TIMING_PATTERN = re.compile(r'\((sec|kb)\)')
+    MEMORY_PATTERN = re.compile(r':.*kBytes$')
+    DISTRIBUTION_PATTERN = re.compile(r'(\d+) cores, +(\d+) groups')
+    # The errors of converting a truncated or garbled line.
+    CONVERSION_ERRORS = (ValueError, IndexError, AttributeError)
+
+    def __init__(self):
+        super(OutcarQuantities, self).__init__()
+        self.has_electronic_steps = False
+        self.unparsable = set()
+        self.symmetry = {
+            'num_space_group_operations': {
+                'static': [],
+                'dynamic': []
+            },
+            'original_cell_type': {
+                'static': [],
+                'dynamic': []
+            },
+            'symmetrized_cell_type': {
+                'static': [],
+                'dynamic': []
+            },
+            'point_group': {
+                'static': [],
+                'dynamic': []
+            },
+            'primitive_translations': []
+        }
+        self.elastic_moduli = {'non_symmetrized': None, 'symmetrized': None, 'total': None}
+        self.magnetization = {
+            'sphere': {projection: {
+                'site_moment': {},
+                'total_magnetization': {}
+            } for projection in ('x', 'y', 'z')},
+            'full_cell': {}
+        }
+        self.run_stats = {}
+        self.trajectory = None
+        self.performance_profile = {
+            'mpi_ranks': None,
+            'threads_per_rank': None,
+            'cores_per_kpoint': None,
+            'kpoint_groups': None,
+            'cores_per_band': None,
+            'band_groups': None,
+            'electronic_cpu_time': [],
+            'electronic_wall_time': [],
+            'ionic_cpu_time': [],
+            'ionic_wall_time': [],
+            'electronic_steps_per_ionic_step': [],
+            'maximum_memory_used': None,
+            'average_memory_used': None
+        }
+        self._config = None
+        self._electronic_steps_since_ionic_step = 0
+
+    def register(self, scanner):
+        """Register the handlers of all quantities, except the final state, on a LineScanner."""
+        symmetries = ('symmetries', 'symmetries_extended')
+        scanner.register(r'Iteration *\d+\( *\d+\)', self._electronic_step)
+        scanner.register(r'Analysis of symmetry for initial positions \(statically\)', self._static_symmetry)
+        scanner.register(r'Analysis of symmetry for dynamics', self._dynamic_symmetry)
+        scanner.register(r'Subroutine PRICEL returns', self._guard(self._original_cell_type, *symmetries))
+        scanner.register(r'primitive cells build up your supercell', self._guard(self._supercell, *symmetries))
+        scanner.register(r'Routine SETGRP: Setting up the symmetry group for a', self._guard(self._symmetrized_cell_type, *symmetries))
+        scanner.register(r'Subroutine GETGRP returns', self._guard(self._num_space_group_operations, *symmetries))
+        scanner.register(r'The point group associated with its full space group is', self._guard(self._point_group, *symmetries))
+        scanner.register(r"found\s+\d+ 'primitive' translations", self._guard(self._primitive_translations, *symmetries))
+        scanner.register(r'(?:ELASTIC MODULI  \(kBar\)|SYMMETRIZED ELASTIC MODULI|TOTAL ELASTIC MODULI)',
+                         self._guard(self._elastic_moduli, 'elastic_moduli'))
+
+    def register_final_state(self, scanner):
+        """Register the handlers of the quantities of the final state on a TailScanner."""
+        iteration = r'Iteration *\d+\( *\d+\)'
+        scanner.register(iteration, self._electronic_step)
+        # Written in each electronic step, but not in the ones of the linear response.
+        scanner.register(r'^ *number of electron', self._guard(self._full_cell_magnetization, 'magnetization'))
+        # Written in each ionic step, after its last electronic step if at all.
+        scanner.register(r'^ *magnetization \(x\)', self._guard(self._site_magnetization, 'site_magnetization'), since=iteration)
+        # Written at the end of the run.
+        scanner.register(r'total amount of memory used by VASP', self._guard(self._memory, 'run_stats'), within=RUN_STATS_TAIL_SIZE)
+        scanner.register(r'General timing and accounting', self._guard(self._timing, 'run_stats'), within=RUN_STATS_TAIL_SIZE)
+
+    def register_trajectory(self, scanner, selection=None):
+        """Register the handlers of the trajectory of the ionic steps on a LineScanner, reading the ones in selection."""
+        self.trajectory = OutcarTrajectory(selection)
+        self.trajectory.register(scanner, guard=lambda handler: self._guard(handler, 'outcar-trajectory'))
+
+    def register_performance_profile(self, scanner):
+        """Register the handlers of the performance profile on a LineScanner."""
+        handlers = [
+            (r'running +(?:on +)?\d+ (?:total cores|mpi-ranks)', self._ranks),
+            (r'distrk: ', self._kpoint_distribution),
+            (r'distr: ', self._band_distribution),
+            (r'LOOP: ', self._electronic_step_timing),
+            (r'LOOP\+: ', self._ionic_step_timing),
+            (r'(?:Maximum|Average) memory used \(kb\)', self._memory_used),
+        ]
+        for trigger, handler in handlers:
+            scanner.register(trigger, self._guard(handler, 'performance_profile'))
+
+    def _guard(self, handler, *quantity_keys):
+        """Wrap a handler, such that a line it can not convert marks the quantity keys as unparsable instead of raising."""
+
+        def guarded_handler(line, lines):
+            try:
+                handler(line, lines)
+            except self.CONVERSION_ERRORS:
+                self.unparsable.update(quantity_keys)
+
+        return guarded_handler
+
+    def _electronic_step(self, line, lines):  # pylint: disable=unused-argument
+        self.has_electronic_steps = True
+
+    def _static_symmetry(self, line, lines):  # pylint: disable=unused-argument
+        self._config = 'static'
+
+    def _dynamic_symmetry(self, line, lines):  # pylint: disable=unused-argument
+        self._config = 'dynamic'
+
+    def _original_cell_type(self, line, lines):  # pylint: disable=unused-argument
+        if self._config is None:
+            return
+        if next(lines, '').strip():
+            self.symmetry['original_cell_type'][self._config].append('primitive cell')
+
+    def _supercell(self, line, lines):  # pylint: disable=unused-argument
+        if self._config is not None:
+            self.symmetry['original_cell_type'][self._config].append('{} primitive cells'.format(line.split()[0]))
+
+    def _symmetrized_cell_type(self, line, lines):  # pylint: disable=unused-argument
+        if self._config is not None:
+            self.symmetry['symmetrized_cell_type'][self._config].append(next(lines, '').strip().lower())
+
+    def _num_space_group_operations(self, line, lines):  # pylint: disable=unused-argument
+        if self._config is not None:
+            self.symmetry['num_space_group_operations'][self._config].append(int(line.split()[4]))
+
+    def _point_group(self, line, lines):  # pylint: disable=unused-argument
+        if self._config is not None:
+            self.symmetry['point_group'][self._config].append(line.split('space group is')[1].split()[0])
+
+    def _primitive_translations(self, line, lines):  # pylint: disable=unused-argument
+        self.symmetry['primitive_translations'].append(int(line.split('found')[1].split()[0]))
+
+    def _elastic_moduli(self, line, lines):
+        """Read the table of the elastic moduli in kBar, following a header and a separator."""
+        key = {'elastic': 'non_symmetrized', 'symmetrized': 'symmetrized', 'total': 'total'}.get(line.split()[0].lower())
+        if key is None:
+            return
+        next(lines, '')
+        next(lines, '')
+        moduli = [[float(item) for item in next(lines, '').split()[1:]] for _ in range(6)]
+        if any(len(row) != 6 for row in moduli):
+            raise ValueError('The table of the elastic moduli is incomplete.')
+        self.elastic_moduli[key] = np.array(moduli)
+
+    def _site_magnetization(self, line, lines):
+        """Read the tables of the magnetization projected on the sites, starting with the x projection."""
+        while line.lstrip().startswith('magnetization ('):
+            self._read_site_magnetization(line.strip()[len('magnetization (')], lines)
+            line = next(lines, '')
+            while line and not line.strip():
+                line = next(lines, '')
+
+    def _read_site_magnetization(self, projection, lines):
+        """Read the table of the magnetization of one projection, following a header."""
+        sphere = self.magnetization['sphere'][projection]
+        for _ in range(3):
+            next(lines, '')
+        for row in lines:
+            items = row.split()
+            if not items:
+                # With a single site, VASP does not print the total.
+                if sphere['site_moment']:
+                    sphere['total_magnetization'] = dict(next(iter(sphere['site_moment'].values())))
+                break
+            if items[0] == 'tot':
+                sphere['total_magnetization'] = self._get_orbital_moments(items[1:])
+                break
+            if not items[0].startswith('-'):
+                sphere['site_moment'][int(items[0])] = self._get_orbital_moments(items[1:])
+
+    def _full_cell_magnetization(self, line, lines):  # pylint: disable=unused-argument
+        self.magnetization['full_cell'] = [float(value) for value in line.split()[5:]]
+
+    def _ranks(self, line, lines):  # pylint: disable=unused-argument
+        # E.g. running on   16 total cores (VASP5) or running    4 mpi-ranks, with    2 threads/rank (VASP6)
+        self.performance_profile['mpi_ranks'] = int(re.search(r'(\d+) (?:total cores|mpi-ranks)', line).group(1))
+        threads = re.search(r'(\d+) threads/rank', line)
+        if threads is not None:
+            self.performance_profile['threads_per_rank'] = int(threads.group(1))
+
+    def _kpoint_distribution(self, line, lines):  # pylint: disable=unused-argument
+        # E.g. distrk:  each k-point on   16 cores,    1 groups
+        cores, groups = self.DISTRIBUTION_PATTERN.search(line).groups()
+        self.performance_profile['cores_per_kpoint'] = int(cores)
+        self.performance_profile['kpoint_groups'] = int(groups)
+
+    def _band_distribution(self, line, lines):  # pylint: disable=unused-argument
+        # E.g. distr:  one band on NCORES_PER_BAND=   1 cores,   16 groups
+        cores, groups = self.DISTRIBUTION_PATTERN.search(line).groups()
+        self.performance_profile['cores_per_band'] = int(cores)
+        self.performance_profile['band_groups'] = int(groups)
+
+    def _electronic_step_timing(self, line, lines):  # pylint: disable=unused-argument
+        cpu_time, wall_time = self._get_loop_times(line)
+        self.performance_profile['electronic_cpu_time'].append(cpu_time)
+        self.performance_profile['electronic_wall_time'].append(wall_time)
+        self._electronic_steps_since_ionic_step += 1
+
+    def _ionic_step_timing(self, line, lines):  # pylint: disable=unused-argument
+        cpu_time, wall_time = self._get_loop_times(line)
+        self.performance_profile['ionic_cpu_time'].append(cpu_time)
+        self.performance_profile['ionic_wall_time'].append(wall_time)
+        self.performance_profile['electronic_steps_per_ionic_step'].append(self._electronic_steps_since_ionic_step)
+        self._electronic_steps_since_ionic_step = 0
+
+    def _memory_used(self, line, lines):  # pylint: disable=unused-argument
+        # E.g. Maximum memory used (kb):       95344.
+        key = line.split()[0].lower() + '_memory_used'
+        try:
+            self.performance_profile[key] = float(line.split(':')[1])
+        except ValueError:
+            self.performance_profile[key] = None
+
+    @staticmethod
+    def _get_loop_times(line):
+        """Return the cpu and wall time of a line like LOOP:  cpu time    0.1920: real time    0.1932, None if not readable."""
+        times = []
+        for item in line.split(':')[1:3]:
+            try:
+                times.append(float(item.split()[-1]))
+            except (IndexError, ValueError):
+                times.append(None)
+        return times + [None] * (2 - len(times))
+
+    def _timing(self, line, lines):  # pylint: disable=unused-argument
+        """Read the timing block at the end of the run."""
+        for row in lines:
+            if self.TIMING_PATTERN.search(row):
+                tokens = row.strip().split(':')
+                name = '_'.join(token.lower() for token in tokens[0].strip().split()[:-1])
+                # The entry can be empty (VASP6)
+                try:
+                    self.run_stats[name] = float(tokens[1].strip())
+                except ValueError:
+                    self.run_stats[name] = None
+
+    def _memory(self, line, lines):  # pylint: disable=unused-argument
+        """Read the memory usage block, which is followed by the timing block for a finished run."""
+        for row in lines:
+            if 'General timing and accounting' in row:
+                break
+            if self.MEMORY_PATTERN.search(row):
+                tokens = re.split(r'[: ]+', row.strip())
+                try:
+                    self.run_stats['mem_usage_' + tokens[0]] = float(tokens[-2])
+                except ValueError:
+                    self.run_stats['mem_usage_' + tokens[0]] = None
+
+    @classmethod
+    def _get_orbital_moments(cls, items):
+        moments = {orbital: float(item) for orbital, item in zip(cls.ORBITALS, items[:-1])}
+        moments['tot'] = float(items[-1])
+        return moments
+
+
+class OutcarTrajectory(object):  # pylint: disable=useless-object-inheritance
+    """
+    The trajectory of the ionic steps of OUTCAR, streamed into preallocated arrays by the handlers registered on a LineScanner.
+
+    Each ionic step ends with its stress, its lattice vectors and the table of the positions and total forces. While
+    scanning, only the current lattice vectors and stress are kept. When the table of an ionic step is read, the
+    positions are converted to direct coordinates and the step is stored, such that besides the result only
+    O(number of ions) memory is used. The arrays are allocated for the NSW ionic steps, and grown if there are more.
+    Like for vasprun.xml, a StepSelection restricts the ionic steps and fields that are stored.
+    """
+
+    def __init__(self, selection=None):
+        super(OutcarTrajectory, self).__init__()
+        self.selection = selection
+        self.fields = STEP_FIELDS if selection is None else selection.fields
+        self.num_ions = None
+        self.num_steps = 0
+        self.arrays = None
+        self._size = 0
+        self._capacity = 1
+        self._elements = []
+        self._ions_per_type = []
+        self._cell = None
+        self._stress = None
+
+    def register(self, scanner, guard=None):
+        """
+        Register the handlers of the header and the ionic steps on a LineScanner.
+
+        :param guard: a function wrapping each handler, see OutcarQuantities._guard.
+        """
+        handlers = [
+            (r'TITEL  =', self._potential),
+            (r'ions per type =', self._ions_per_type_counts),
+            (r'NIONS =', self._num_ions),
+            (r'NSW    =', self._num_steps),
+            (r'^  in kB ', self._step_stress),
+            (r'direct lattice vectors', self._step_cell),
+            (r'TOTAL-FORCE \(eV/Angst\)', self._step_positions_forces),
+        ]
+        for trigger, handler in handlers:
+            scanner.register(trigger, handler if guard is None else guard(handler))
+
+    def get_trajectory(self):
+        """Return the arrays of the stored ionic steps in the layout of the vasprun.xml trajectory, None if there are none."""
+        symbols = [element for element, count in zip(self._elements, self._ions_per_type) for _ in range(count)]
+        if not self._size or len(symbols) != self.num_ions:
+            return None
+        trajectory = {field: self.arrays[field][:self._size] for field in self.fields}
+        trajectory['symbols'] = np.asarray(symbols)
+        trajectory['steps'] = self.arrays['steps'][:self._size]
+        return trajectory
+
+    def _potential(self, line, lines):  # pylint: disable=unused-argument
+        # E.g. TITEL  = PAW_PBE Si_sv 05Jan2001
+        self._elements.append(line.split()[3].split('_')[0])
+
+    def _ions_per_type_counts(self, line, lines):  # pylint: disable=unused-argument
+        self._ions_per_type = [int(item) for item in line.split('=')[1].split()]
+
+    def _num_ions(self, line, lines):  # pylint: disable=unused-argument
+        self.num_ions = int(line.split('NIONS =')[1].split()[0])
+
+    def _num_steps(self, line, lines):  # pylint: disable=unused-argument
+        num_steps = max(int(line.split('=')[1].split()[0]), 1)
+        if self.selection is not None:
+            num_steps = max(len(self.selection.select(num_steps)), 1)
+        self._capacity = num_steps
+
+    def _step_stress(self, line, lines):  # pylint: disable=unused-argument
+        # The order of the components is XX YY ZZ XY YZ ZX.
+        xx, yy, zz, xy, yz, zx = [float(item) for item in line.split()[2:8]]
+        self._stress = np.array([[xx, xy, zx], [xy, yy, yz], [zx, yz, zz]])
+
+    def _step_cell(self, line, lines):  # pylint: disable=unused-argument
+        cell = [[float(item) for item in next(lines, '').split()[:3]] for _ in range(3)]
+        if any(len(row) != 3 for row in cell):
+            raise ValueError('The lattice vectors are incomplete.')
+        self._cell = np.array(cell)
+
+    def _step_positions_forces(self, line, lines):  # pylint: disable=unused-argument
+        """Read the table of the cartesian positions and total forces following a separator, which ends an ionic step."""
+        if self.num_ions is None or self._cell is None:
+            return
+        next(lines, '')
+        values = np.fromstring(' '.join([next(lines, '') for _ in range(self.num_ions)]), sep=' ')
+        if values.size != 6 * self.num_ions or not next(lines, '').lstrip().startswith('-'):
+            # The table is incomplete, OUTCAR was truncated.
+            return
+        step = self.num_steps
+        self.num_steps += 1
+        if self.selection is not None and step not in self.selection:
+            return
+        values = values.reshape(self.num_ions, 6)
+        step_values = {
+            'cells': self._cell,
+            'positions': np.linalg.solve(self._cell.T, values[:, :3].T).T,
+            'forces': values[:, 3:],
+            'stress': self._stress if self._stress is not None else np.full((3, 3), np.nan),
+        }
+        self._reserve()
+        for field in self.fields:
+            self.arrays[field][self._size] = step_values[field]
+        self.arrays['steps'][self._size] = step
+        self._size += 1
+
+    def _reserve(self):
+        """Allocate the arrays for the next ionic step, doubling their capacity if they are full."""
+        if self.arrays is None:
+            shapes = {'cells': (3, 3), 'positions': (self.num_ions, 3), 'forces': (self.num_ions, 3), 'stress': (3, 3)}
+            self.arrays = {field: np.empty((self._capacity,) + shapes[field]) for field in self.fields}
+            self.arrays['steps'] = np.empty(self._capacity, dtype=int)
+        elif self._size == len(self.arrays['steps']):
+            for name, array in self.arrays.items():
+                grown = np.empty((2 * len(array),) + array.shape[1:], dtype=array.dtype)
+                grown[:len(array)] = array
+                self.arrays[name] = grown
 
 
 class LegacyOutcarParser(BaseFileParser):
@@ -198,52 +698,66 @@ class LegacyOutcarParser(BaseFileParser):
         result = self._read_outcar(inputs)
         return result
 
-    @staticmethod
-    def _parse_line_regex_once(line, regex, res_dict, key, convert=None):
-        """
-        Parse ``line`` with regular expression ``regex`` optionally converts the result and stores int in ``res_dict[key]``.
+    def _parse_quantity(self, quantity_key, inputs):
+        """Read the Fermi level from the end of the file, all other quantities in one read of the whole file."""
+        if quantity_key == 'outcar-efermi':
+            return {quantity_key: self._read_final_fermi_level()}
+        return self._parse_file(inputs)
 
-        Does not overwrite ``res_dict[key]`` if it already exists and is not None.
-        """
-        if res_dict.get(key, None) is None:
-            regex_result = re.findall(regex, line)
-            if not regex_result:
-                res_dict[key] = None
-            else:
-                result = regex_result[0]
-                if convert:
-                    result = convert(result)
-                res_dict[key] = result
-
-    def _read_outcar(self, inputs):
-        """Parse the OUTCAR file into a dictionary."""
-        result = inputs.get('settings', {})
+    def _read_final_fermi_level(self):
+        """Read the last Fermi level from the end of the file."""
+        result = {}
+
+        def fermi_level(line, lines):  # pylint: disable=unused-argument
+            result['efermi'] = float(line.split()[2])
+
+        scanner = TailScanner()
+        scanner.register(r'E-fermi', fermi_level)
+        with self._data_obj.open('rb', mapped=True) as outcar_file_object:
+            scanner.scan(outcar_file_object)
+        return result.get('efermi')
+
+    def _read_outcar(self, inputs):  # pylint: disable=unused-argument
+        """Parse the OUTCAR file into a dictionary, reading it once."""
         result = {}
         energy_free = []
         energy_zero = []
-        symmetries = {}
-        with open(self._data_obj.path, 'r') as outcar_file_object:
-            for line in outcar_file_object:
-                # volume
-                if line.rfind('volume of cell :') > -1:
-                    result['outcar-volume'] = float(line.split()[-1])
-                # Free energy
-                if line.lower().startswith('  free  energy   toten'):
-                    energy_free.append(float(line.split()[-2]))
-                # Extrapolated zero point energy
-                if line.startswith('  energy  without entropy'):
-                    energy_zero.append(float(line.split()[-1]))
-                # Fermi energy
-                if line.rfind('E-fermi') > -1:
-                    result['outcar-efermi'] = float(line.split()[2])
-                # space group operations
-                self._parse_line_regex_once(line, self.SPACE_GROUP_OP_PATTERN, symmetries, 'num_space_group_operations', int)
-                # point group operations
-                self._parse_line_regex_once(line, self.POINT_GROUP_OP_PATTERN, symmetries, 'num_point_group_operations', int)
-                # point symmetry
-                self._parse_line_regex_once(line, self.POINT_SYMMETRY_PATTERN, symmetries, 'point_symmetry')
-                # space group
-                self._parse_line_regex_once(line, self.SPACE_GROUP_PATTERN, symmetries, 'space_group')
+        symmetries = dict.fromkeys(('num_space_group_operations', 'num_point_group_operations', 'point_symmetry', 'space_group'))
+
+        def volume(line, lines):  # pylint: disable=unused-argument
+            result['outcar-volume'] = float(line.split()[-1])
+
+        def free_energy(line, lines):  # pylint: disable=unused-argument
+            energy_free.append(float(line.split()[-2]))
+
+        def energy_without_entropy(line, lines):  # pylint: disable=unused-argument
+            energy_zero.append(float(line.split()[-1]))
+
+        def fermi_level(line, lines):  # pylint: disable=unused-argument
+            result['outcar-efermi'] = float(line.split()[2])
+
+        def symmetry_once(regex, key, convert=None):
+            """Return a handler storing the first match of ``regex``, optionally converted, in ``symmetries[key]``."""
+
+            def handler(line, lines):  # pylint: disable=unused-argument
+                if symmetries[key] is None:
+                    value = regex.search(line).group(1)
+                    symmetries[key] = convert(value) if convert else value
+
+            return handler
+
+        scanner = LineScanner()
+        scanner.register(r'volume of cell :', volume)
+        scanner.register(r'^  (?i:free  energy   toten)', free_energy)
+        scanner.register(r'^  energy  without entropy', energy_without_entropy)
+        scanner.register(r'E-fermi', fermi_level)
+        scanner.register(self.SPACE_GROUP_OP_PATTERN.pattern, symmetry_once(self.SPACE_GROUP_OP_PATTERN, 'num_space_group_operations', int))
+        scanner.register(self.POINT_GROUP_OP_PATTERN.pattern, symmetry_once(self.POINT_GROUP_OP_PATTERN, 'num_point_group_operations', int))
+        scanner.register(self.POINT_SYMMETRY_PATTERN.pattern, symmetry_once(self.POINT_SYMMETRY_PATTERN, 'point_symmetry'))
+        scanner.register(self.SPACE_GROUP_PATTERN.pattern, symmetry_once(self.SPACE_GROUP_PATTERN, 'space_group'))
+        with self._data_obj.open(mapped=True) as outcar_file_object:
+            scanner.scan(outcar_file_object)
+
         result['outcar-energies'] = {}
         result['outcar-energies']['free_energy'] = energy_free[-1]
         result['outcar-energies']['energy_without_entropy'] = energy_zero[-1]
@@ -5,22 +5,34 @@ Base classes for the VASP file parsers.
 Contains the base classes for the VASP file parsers.
 """
 # pylint: disable=import-outside-toplevel
+import mmap
 import re
+from contextlib import contextmanager
+
 from aiida.common import AIIDA_LOGGER as aiidalogger
 from aiida_vasp.utils.delegates import delegate_method_kwargs
+from aiida_vasp.parsers.profiling import timed
+from aiida_vasp.parsers.file_access import open_source
 
 
 class BaseParser(object):  # pylint: disable=useless-object-inheritance
     """Common codebase for all parser utilities."""
     empty_line = re.compile(r'[\r\n]\s*[\r\n]')
+    empty_line_bytes = re.compile(br'[\r\n]\s*[\r\n]')
 
     @classmethod
     def line(cls, fobj_or_str, d_type=str):
-        """Grab a line from a file object or string and convert it to d_type (default: str)."""
-        if isinstance(fobj_or_str, str):
+        """
+        Grab a line from a file object or string and convert it to d_type (default: str).
+
+        The line can also be bytes, e.g. read from a MappedFile, which are only decoded if d_type is str.
+        """
+        if isinstance(fobj_or_str, (str, bytes)):
             line = fobj_or_str
         else:
             line = fobj_or_str.readline()
+        if d_type is str and isinstance(line, bytes):
+            line = line.decode('utf8')
         # previously this was map instead of list comprehension
         res = [d_type(item) for item in line.split()]
         if len(res) == 1:
@@ -32,6 +44,8 @@ class BaseParser(object):  # pylint: disable=useless-object-inheritance
         """Split a chunk of text into a list of lines and convert each line to d_type (default: float)."""
         if isinstance(fobj_or_str, str):
             lines = fobj_or_str.split('\n')
+        elif isinstance(fobj_or_str, bytes):
+            lines = fobj_or_str.split(b'\n')
         else:
             lines = fobj_or_str.readlines()
         return [cls.line(line, d_type) for line in lines]
@@ -47,19 +61,24 @@ class BaseFileParser(BaseParser):
           as the required information on how to extract those.
         - _parsed_data: a dictionary containing all the parsed data from this file.
         - get_quantity(): Method to be called by the VaspParser
-          which will either fill the _parsed_data in case that it is empty by calling _parse_file
-          or return the requested data from the _parsed_data. If another quantity is required as
-          prerequisite it will be requested from the VaspParser.
+          which will either fill the _parsed_data in case the requested quantity has not yet been
+          evaluated by calling _parse_quantity or return the requested data from the _parsed_data.
+          Quantities that could not be parsed are stored as None and are not evaluated again.
+          If another quantity is required as prerequisite it will be requested from the VaspParser.
 
           This method will be subscribed to the VaspParsers get_quantity delegate during initialisation.
           When the VaspParser calls his delegate this method will be called and return the requested
           quantity.
         _ _parse_file: an abstract method to be implemented by the actual file parser, which will
           parse the file and fill the _parsed_data dictionary.
+        - _parse_quantity: evaluate a single quantity. Defaults to parsing the whole file, but file parsers
+          that are able to evaluate each quantity on its own should override it.
 
         :param calc_parser_cls: Python class, optional, class of the calling CalculationParser instance
 
         :keyword file_path: Initialise with a path to a file. The file will be parsed by the FileParser
+        :keyword file_handler: Initialise with a readable binary handle of a file, e.g. opened from the repository.
+            The handle is not closed by the FileParser.
         :keyword data: Initialise with an aiida data object. This may be SingleFileData, KpointsData or StructureData.
 
     Additional keyword arguments might be defined by the inheriting classes.
@@ -71,6 +90,12 @@ class BaseFileParser(BaseParser):
     """
 
     PARSABLE_ITEMS = {}
+    # Whether the parsed quantities can be stored in the parse cache.
+    CACHEABLE = True
+    # Relative cost per byte of parsing the file, used to choose between alternative quantities.
+    PARSE_COST = 1.0
+    # Version of the parsed quantities, increase it when a change of the file parser changes them to invalidate the parse cache.
+    FORMAT_VERSION = 1
 
     def __init__(self, **kwargs):  # pylint: disable=unused-argument
         super(BaseFileParser, self).__init__()
@@ -80,6 +105,7 @@ class BaseFileParser(BaseParser):
         self._exit_code = None
         self._parsable_items = self.PARSABLE_ITEMS
         self._parsed_data = {}
+        self._quantity_times = {}
         self._data_obj = None
 
     @delegate_method_kwargs(prefix='_init_with_')
@@ -106,6 +132,10 @@ class BaseFileParser(BaseParser):
         """Init with a file path."""
         self._data_obj = SingleFile(path=path)
 
+    def _init_with_file_handler(self, handler):
+        """Init with a readable binary file handler."""
+        self._data_obj = SingleFile(handler=handler)
+
     def _init_with_data(self, data):
         """
         Init with aiida-data.
@@ -124,21 +154,41 @@ class BaseFileParser(BaseParser):
     def exit_code(self):
         return self._exit_code
 
-    def get_quantity(self, quantity_key):
+    @property
+    def quantity_times(self):
+        """Wall time in seconds spent evaluating each of the parsed quantities."""
+        return self._quantity_times
+
+    def get_quantity(self, quantity_key, inputs=None):
         """
         Public method to get the required quantity from the _parsed_data dictionary if that exists.
 
-        Otherwise parse the file. This method will be registered to the VaspParsers get_quantities
-        delegate during __init__.
+        Otherwise parse the quantity. The result is stored in _parsed_data, also if the quantity could not
+        be parsed (None), such that every quantity is evaluated at most once. This method will be registered
+        to the VaspParsers get_quantities delegate during __init__.
+
+        :param inputs: dict of already parsed quantities listed in the 'inputs' of the quantity.
         """
 
         if quantity_key not in self._parsable_items:
             return None
 
-        if self._parsed_data.get(quantity_key) is None:
-            self._parsed_data = self._parse_file({})
+        if quantity_key not in self._parsed_data:
+            with timed(self._quantity_times, quantity_key):
+                self._parsed_data.update(self._parse_quantity(quantity_key, inputs if inputs is not None else {}))
+            # Remember quantities that could not be parsed, so that we do not try again.
+            self._parsed_data.setdefault(quantity_key, None)
 
-        return self._parsed_data.get(quantity_key)
+        return self._parsed_data[quantity_key]
+
+    def _parse_quantity(self, quantity_key, inputs):  # pylint: disable=unused-argument
+        """
+        Parse a quantity and return a dictionary containing it.
+
+        By default the whole file is parsed. File parsers exposing their quantities as properties
+        override this in order to only evaluate the requested quantity.
+        """
+        return self._parse_file(inputs)
 
     def get_quantity_from_inputs(self, quantity_name, inputs, vasp_parser):
         """Method to handle inputs (to be removed)"""
@@ -203,6 +253,7 @@ class SingleFile(object):  # pylint: disable=useless-object-inheritance
     def __init__(self, **kwargs):
         super(SingleFile, self).__init__()
         self._path = None
+        self._handler = None
         self._data = None
         self.init_with_kwargs(**kwargs)
 
@@ -213,6 +264,10 @@ class SingleFile(object):  # pylint: disable=useless-object-inheritance
     def _init_with_path(self, path):
         self._path = path
 
+    def _init_with_handler(self, handler):
+        """Initialise with a readable binary file handler."""
+        self._handler = handler
+
     def _init_with_data(self, data):
         """Initialise with SingleFileData."""
         self._data = data
@@ -221,6 +276,34 @@ class SingleFile(object):  # pylint: disable=useless-object-inheritance
     def path(self):
         return self._path
 
+    @property
+    def handler(self):
+        return self._handler
+
+    @contextmanager
+    def open(self, mode='r', mapped=False):
+        """
+        Open the file for reading from its start, either from the path or from the handler.
+
+        With `mapped`, a file given by its path is opened as a MappedFile instead, while a handler, which is
+        not necessarily backed by a single file on the file system, is still opened in `mode`.
+        """
+        if mapped and self._path is not None:
+            with MappedFile(self._path) as mapped_file:
+                yield mapped_file
+            return
+        with open_source(self._path if self._path is not None else self._handler, mode) as file_obj:
+            yield file_obj
+
+    @contextmanager
+    def parsevasp_source(self, mode='r'):
+        """Yield the keyword argument for reading the file with parsevasp, either `file_path` or an open `file_handler`."""
+        if self._path is not None:
+            yield {'file_path': self._path}
+            return
+        with open_source(self._handler, mode) as file_handler:
+            yield {'file_handler': file_handler}
+
     def write(self, dst):
         """Copy file to destination."""
         if self._path is not None:
@@ -228,12 +311,96 @@ class SingleFile(object):  # pylint: disable=useless-object-inheritance
             shutil.copyfile(self._path, dst)
             return
 
+        if self._handler is not None:
+            import shutil
+            with self.open('rb') as input_obj, open(dst, 'wb') as output_obj:
+                shutil.copyfileobj(input_obj, output_obj)
+            return
+
         if self._data is not None:
             with self._data.open() as input_obj, open(dst) as output_obj:
                 lines = input_obj.readlines()
                 output_obj.writelines(lines)
 
 
+class MappedFile(object):  # pylint: disable=useless-object-inheritance
+    """
+    A file on the file system, mapped read-only into memory.
+
+    The content, `data`, is searched directly with compiled bytes regexes and `find`, and lines are returned as
+    bytes, without decoding. As the map is backed by the page cache, several processes parsing the same file
+    share its pages instead of each reading a copy. The `read`, `readline` and `readlines` methods of a binary
+    file object are provided as well, such that e.g. BaseParser.line and BaseParser.splitlines accept it.
+    """
+
+    def __init__(self, path):
+        super(MappedFile, self).__init__()
+        self._file_obj = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self._file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can not be mapped.
+            self.data = b''
+        if hasattr(self.data, 'madvise'):
+            self.data.madvise(mmap.MADV_SEQUENTIAL)
+        self._pos = 0
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file_obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        """Move to a position, relative to the start, the current position or the end."""
+        self._pos = min(max([0, self._pos, len(self.data)][whence] + pos, 0), len(self.data))
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else min(self._pos + size, len(self.data))
+        chunk = self.data[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def readline(self):
+        end = self.data.find(b'\n', self._pos) + 1 or len(self.data)
+        return self.read(end - self._pos)
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+    def find(self, sub, start=0, end=None):
+        return self.data.find(sub, start, len(self.data) if end is None else end)
+
+    def rfind(self, sub, start=0, end=None):
+        return self.data.rfind(sub, start, len(self.data) if end is None else end)
+
+    def search(self, regex, pos=0, endpos=None):
+        """Search a compiled bytes regex from pos."""
+        return regex.search(self.data, pos, len(self.data) if endpos is None else endpos)
+
+    def finditer(self, regex, pos=0, endpos=None):
+        """Iterate over the matches of a compiled bytes regex from pos."""
+        return regex.finditer(self.data, pos, len(self.data) if endpos is None else endpos)
+
+    def line_at(self, pos):
+        """Return the line containing the position pos, including its line break."""
+        start = self.data.rfind(b'\n', 0, pos) + 1
+        end = self.data.find(b'\n', pos) + 1 or len(self.data)
+        return self.data[start:end]
+
+
 class KeyValueParser(BaseParser):
     """
     Key and value parser.
@@ -93,7 +93,8 @@ class PoscarParser(BaseFileParser):
 
         # pass file path to parsevasp and try to load file
         try:
-            poscar = Poscar(file_path=self._data_obj.path, prec=self.precision, conserve_order=True, logger=self._logger)
+            with self._data_obj.parsevasp_source() as source:
+                poscar = Poscar(prec=self.precision, conserve_order=True, logger=self._logger, **source)
         except SystemExit:
             self._logger.warning('Parsevasp exited abnormally. ' 'Returning None.')
             return {'poscar-structure': None}
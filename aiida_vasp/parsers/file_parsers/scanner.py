@@ -0,0 +1,232 @@
+"""
+Line scanner.
+
+-------------
+A single pass scanning engine for large text files like OUTCAR. The file is read once, in blocks of lines.
+The triggers of the registered handlers are searched in each block, and the handlers are only called on the
+lines matching a trigger. All other lines are never split off or touched by Python code. Quantities of the
+final state of a run are read with the TailScanner instead, which reads the file backwards from its end.
+Both also scan a MappedFile, directly on the memory map.
+"""
+import io
+import os
+import re
+
+from aiida_vasp.parsers.file_parsers.parser import MappedFile
+
+# Approximate size in characters of the blocks of lines that are searched at once.
+BLOCK_SIZE = 4 * 1024 * 1024
+# Size of the blocks of the lines following a match of the TailScanner, typically a short table.
+FOLLOWING_BLOCK_SIZE = 64 * 1024
+
+
+class LineScanner(object):  # pylint: disable=useless-object-inheritance
+    """
+    Scan the lines of a file once and dispatch the matching lines to the handlers of their trigger.
+
+    A trigger is a regular expression searched in each line, anchor it with `^` to match a prefix. Triggers
+    starting with a literal, e.g. `E-fermi` instead of `^\\s*E-fermi`, are searched fastest. A handler is
+    called as `handler(line, lines)`, where `lines` is the iterator over the lines following the matching
+    line. Handlers reading a block, e.g. a table, consume its lines with `next(lines, '')`, such that these
+    lines are not scanned for triggers.
+
+    A line fires the handlers of a single trigger, the one matching leftmost, or the one registered first
+    if several match at the same position. Triggers should thus be specific enough not to share lines.
+
+    Each trigger is searched in a block of lines with its own regex, which is considerably faster than a
+    single alternation of all triggers, as the search of a regex starting with a literal skips ahead to the
+    occurrences of the literal.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        super(LineScanner, self).__init__()
+        self._block_size = block_size
+        self._handlers = {}
+
+    def register(self, trigger, handler):
+        """Register a handler for the lines matching the regular expression trigger."""
+        self._handlers.setdefault(trigger, []).append(handler)
+
+    @property
+    def triggers(self):
+        return list(self._handlers)
+
+    def scan(self, file_obj):
+        """
+        Scan a file object opened in text mode or a MappedFile.
+
+        A MappedFile is searched as a single block, with the triggers compiled to bytes regexes, and only
+        the lines passed to the handlers are decoded.
+        """
+        if not self._handlers:
+            return
+        if isinstance(file_obj, MappedFile):
+            triggers = [(re.compile(trigger.encode(), re.MULTILINE), handlers) for trigger, handlers in self._handlers.items()]
+            lines = MappedLineCursor(file_obj)
+        else:
+            triggers = [(re.compile(trigger, re.MULTILINE), handlers) for trigger, handlers in self._handlers.items()]
+            lines = LineCursor(file_obj, self._block_size)
+        while lines.read_block():
+            self._scan_block(triggers, lines)
+
+    @staticmethod
+    def _scan_block(triggers, lines):
+        """Dispatch the matches in the current block of lines, in the order of the lines."""
+        block = lines.block
+        matches = sorted((match.start(), index) for index, (regex, _) in enumerate(triggers) for match in regex.finditer(block, lines.pos))
+        for start, index in matches:
+            if start < lines.pos:
+                # The line was already dispatched or consumed by a handler.
+                continue
+            line = lines.seek_line(start)
+            for handler in triggers[index][1]:
+                handler(line, lines)
+            if lines.block is not block:
+                # A handler consumed lines of the next block, which is scanned from there on.
+                return
+        lines.pos = len(block)
+
+
+class LineCursor(object):  # pylint: disable=useless-object-inheritance
+    """Iterator over the lines of a file, that is read in blocks of complete lines."""
+
+    def __init__(self, file_obj, block_size=BLOCK_SIZE):
+        super(LineCursor, self).__init__()
+        self._file_obj = file_obj
+        self._block_size = block_size
+        self.block = ''
+        self.pos = 0
+
+    def read_block(self):
+        """Read the next block of lines, if the current one is exhausted, and return whether there are lines left."""
+        if self.pos < len(self.block):
+            return True
+        self.block = ''.join(self._file_obj.readlines(self._block_size))
+        self.pos = 0
+        return bool(self.block)
+
+    def seek_line(self, pos):
+        """Return the line containing the position pos of the current block and move past it."""
+        self.pos = self.block.rfind('\n', 0, pos) + 1
+        return next(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.read_block():
+            raise StopIteration
+        end = self.block.find('\n', self.pos) + 1 or len(self.block)
+        line = self.block[self.pos:end]
+        self.pos = end
+        return line
+
+
+class MappedLineCursor(LineCursor):
+    """Iterator over the lines of a MappedFile, which is a single block, decoding the lines it returns."""
+
+    def __init__(self, mapped_file, pos=0):
+        super(MappedLineCursor, self).__init__(mapped_file)
+        self.block = mapped_file.data
+        self.pos = pos
+
+    def read_block(self):
+        return self.pos < len(self.block)
+
+    def seek_line(self, pos):
+        self.pos = self.block.rfind(b'\n', 0, pos) + 1
+        return next(self)
+
+    def __next__(self):
+        if not self.read_block():
+            raise StopIteration
+        end = self.block.find(b'\n', self.pos) + 1 or len(self.block)
+        line = self.block[self.pos:end]
+        self.pos = end
+        return line.decode('utf8')
+
+
+class TailScanner(object):  # pylint: disable=useless-object-inheritance
+    """
+    Scan a file backwards from its end for the last line matching each trigger.
+
+    The file is read in blocks from its end, until the last match of every trigger has been found, such
+    that the cost of reading the final state of a run does not depend on the length of the run. The handler
+    of a trigger is called once, as `handler(line, lines)` on its last matching line, `lines` iterating
+    forward over the lines following it, e.g. to read the table following a header.
+
+    As a missing trigger causes the whole file to be read, the search of a trigger can be limited: to the
+    last `within` bytes of the file, e.g. for a block only written at the end of a finished run, or to the
+    lines following the last match of the trigger `since`, e.g. for a table written in each ionic step.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        super(TailScanner, self).__init__()
+        self._block_size = block_size
+        self._triggers = []
+
+    def register(self, trigger, handler, within=None, since=None):
+        """Register a handler for the last line matching the regular expression trigger."""
+        self._triggers.append((trigger, handler, within, since))
+
+    def scan(self, file_obj):
+        """Scan a seekable file object opened in binary mode or a MappedFile."""
+        pending = [(self._compile(trigger), handler, within, self._compile(since)) for trigger, handler, within, since in self._triggers]
+        file_obj.seek(0, os.SEEK_END)
+        size = end = file_obj.tell()
+        head = b''
+        while pending and end > 0:
+            start = max(end - self._block_size, 0)
+            file_obj.seek(start)
+            block = file_obj.read(end - start) + head
+            end = start
+            # Keep the possibly incomplete first line for the next block.
+            cut = block.find(b'\n') + 1 if start > 0 else 0
+            if start > 0 and not cut:
+                head = block
+                continue
+            head, block = block[:cut], block[cut:]
+            found = []
+            for trigger in pending:
+                regex, _, within, since = trigger
+                since_pos = self._find_last(since, block, 0) if since is not None else None
+                pos = max(since_pos or 0, size - within - start - cut if within is not None else 0)
+                match = self._find_last(regex, block, pos)
+                if match is not None:
+                    found.append((start + cut + block.rfind(b'\n', 0, match) + 1, trigger))
+                elif since_pos is not None or (within is not None and size - end >= within):
+                    # The trigger does not occur where it is searched.
+                    found.append((None, trigger))
+            for offset, trigger in found:
+                pending.remove(trigger)
+                if offset is not None:
+                    self._dispatch(file_obj, offset, trigger[1])
+
+    @staticmethod
+    def _compile(trigger):
+        if trigger is None:
+            return None
+        return re.compile(trigger.encode(), re.MULTILINE)
+
+    @staticmethod
+    def _find_last(regex, block, pos):
+        """Return the start of the last match of regex in block from pos, or None."""
+        last = None
+        for last in regex.finditer(block, pos):
+            pass
+        return last.start() if last is not None else None
+
+    @staticmethod
+    def _dispatch(file_obj, offset, handler):
+        """Call the handler on the line starting at offset, with the lines following it."""
+        if isinstance(file_obj, MappedFile):
+            lines = MappedLineCursor(file_obj, offset)
+            handler(next(lines), lines)
+            return
+        file_obj.seek(offset)
+        wrapper = io.TextIOWrapper(file_obj, encoding='utf8')
+        try:
+            lines = LineCursor(wrapper, FOLLOWING_BLOCK_SIZE)
+            handler(next(lines), lines)
+        finally:
+            wrapper.detach()
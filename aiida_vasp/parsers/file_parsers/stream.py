@@ -31,9 +31,17 @@ class StreamParser(BaseFileParser):
 
     def _init_with_file_path(self, path):
         """Init with a file path."""
+        self._init_stream(SingleFile(path=path))
+
+    def _init_with_file_handler(self, handler):
+        """Init with a readable binary file handler."""
+        self._init_stream(SingleFile(handler=handler))
+
+    def _init_stream(self, data_obj):
+        """Parse the standard stream with parsevasp."""
         self._parsed_data = {}
         self._parsable_items = self.__class__.PARSABLE_ITEMS
-        self._data_obj = SingleFile(path=path)
+        self._data_obj = data_obj
 
         # Since the VASP output can be fairly large, we will parse it only
         # once and store the parsevasp Stream object.
@@ -44,7 +52,8 @@ class StreamParser(BaseFileParser):
             stream_config = self._settings.get('stream_config', None)
             history = self._settings.get('stream_history', False)
         try:
-            self._stream = Stream(file_path=path, logger=self._logger, history=history, config=stream_config)
+            with self._data_obj.parsevasp_source() as source:
+                self._stream = Stream(logger=self._logger, history=history, config=stream_config, **source)
         except SystemExit:
             self._logger.warning('Parsevasp exited abruptly when parsing the standard stream. Returning None.')
             self._stream = None
@@ -67,20 +76,19 @@ class StreamParser(BaseFileParser):
             quantities_to_parse = self._settings.quantity_names_to_parse
 
         result = {}
-
-        if self._stream is None:
-            # parsevasp threw an exception, which means the standard stream could not be parsed.
-            for quantity in quantities_to_parse:
-                if quantity in self._parsable_items:
-                    result[quantity] = None
-            return result
-
         for quantity in quantities_to_parse:
             if quantity in self._parsable_items:
-                result[quantity] = getattr(self, quantity)
+                result[quantity] = self.get_quantity(quantity)
 
         return result
 
+    def _parse_quantity(self, quantity_key, inputs):  # pylint: disable=unused-argument
+        """Evaluate only the requested quantity."""
+        if self._stream is None:
+            # parsevasp threw an exception, which means the standard stream could not be parsed.
+            return {quantity_key: None}
+        return {quantity_key: getattr(self, quantity_key)}
+
     @property
     def notifications(self):
         """Fetch the notifications from parsevasp."""
@@ -1,9 +1,11 @@
 """Test the BaseFileParser."""
 # pylint: disable=unused-import,redefined-outer-name,unused-argument,unused-wildcard-import,wildcard-import,protected-access
 
+import re
+
 import pytest
 
-from aiida_vasp.parsers.file_parsers.parser import BaseFileParser
+from aiida_vasp.parsers.file_parsers.parser import BaseFileParser, MappedFile
 
 
 def test_base_file_parser():
@@ -14,3 +16,20 @@ def test_base_file_parser():
     assert parser._parsed_data == {}
     with pytest.raises(Exception):
         parser._parse_file(inputs)
+
+
+def test_mapped_file(tmpdir):
+    """Test reading and searching a memory mapped file."""
+    path = tmpdir.join('DOSCAR')
+    path.write('   4 4 1 0\n name\n  1.0 2.0\n  3.0 4.0\n')
+    with MappedFile(str(path)) as mapped_file:
+        assert BaseFileParser.line(mapped_file, int) == [4, 4, 1, 0]
+        assert BaseFileParser.line(mapped_file) == 'name'
+        assert BaseFileParser.splitlines(mapped_file) == [[1.0, 2.0], [3.0, 4.0]]
+        assert mapped_file.find(b'name') == 12
+        assert mapped_file.line_at(mapped_file.search(re.compile(br'4\.0')).start()) == b'  3.0 4.0\n'
+
+    path = tmpdir.join('empty')
+    path.write('')
+    with MappedFile(str(path)) as mapped_file:
+        assert mapped_file.readline() == b''
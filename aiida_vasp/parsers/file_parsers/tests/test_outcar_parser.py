@@ -98,3 +98,114 @@ def test_parameter_results(fresh_aiida_env, outcar_parser):
     assert data_dict['run_stats']
     assert data_dict['run_stats']['total_cpu_time_used'] == 89.795
     assert data_dict['run_stats']['average_memory_used'] == 0.0
+
+
+@pytest.mark.parametrize('outcar_parser', ['disp_details'], indirect=True)
+@pytest.mark.parametrize('vasprun_parser', [('disp_details', {})], indirect=True)
+def test_trajectory(fresh_aiida_env, outcar_parser, vasprun_parser):
+    """Test that the trajectory read from OUTCAR matches the one of vasprun.xml."""
+    trajectory = outcar_parser.get_quantity('outcar-trajectory')
+    reference = vasprun_parser.get_quantity('trajectory')
+    assert list(trajectory['symbols']) == list(reference['symbols'])
+    np.testing.assert_array_equal(trajectory['steps'], np.arange(15))
+    np.testing.assert_allclose(trajectory['cells'], reference['cells'])
+    np.testing.assert_allclose(trajectory['positions'], reference['positions'], atol=1e-6)
+    np.testing.assert_allclose(trajectory['forces'], reference['forces'], atol=1e-6)
+    # The stress is printed with fewer digits in OUTCAR.
+    np.testing.assert_allclose(trajectory['stress'][1:], reference['stress'][1:], atol=1e-3)
+    # The other quantities are collected in the same scan from the start of OUTCAR.
+    assert outcar_parser._scanned == {'forward', 'outcar-trajectory'}  # pylint: disable=protected-access
+    assert outcar_parser.get_quantity('symmetries')['point_group']['static'][0] == 'O_h'
+    assert outcar_parser._scanned == {'forward', 'outcar-trajectory'}  # pylint: disable=protected-access
+
+
+def test_trajectory_truncated(fresh_aiida_env, tmpdir):
+    """Test that the incomplete last ionic step of a truncated OUTCAR and the unselected ones are skipped."""
+    from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    with open(data_path('disp_details', 'OUTCAR'), 'rb') as handler:
+        content = handler.read()
+    path = tmpdir.join('OUTCAR')
+    path.write_binary(content[:content.rfind(b'TOTAL-FORCE') + 200])
+    trajectory = OutcarParser(file_path=str(path), settings=ParserSettings({})).get_quantity('outcar-trajectory')
+    np.testing.assert_array_equal(trajectory['steps'], np.arange(14))
+
+    settings = ParserSettings({'trajectory_start': 1, 'trajectory_stride': 5, 'trajectory_fields': ['positions']})
+    trajectory = OutcarParser(file_path=str(path), settings=settings).get_quantity('outcar-trajectory')
+    assert set(trajectory) == {'positions', 'symbols', 'steps'}
+    np.testing.assert_array_equal(trajectory['steps'], [1, 6, 11])
+
+
+def test_truncated_quantity(fresh_aiida_env, tmpdir):
+    """Test that a quantity cut off in a truncated OUTCAR is reported as unparsable, while the others are still read."""
+    from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    from aiida_vasp.calcs.vasp import VaspCalculation
+    with open(data_path('disp_details', 'OUTCAR'), 'rb') as handler:
+        content = handler.read()
+    path = tmpdir.join('OUTCAR')
+    # Cut the file in the middle of a row of the first table of the elastic moduli.
+    path.write_binary(content[:content.find(b' XY    ', content.find(b'ELASTIC MODULI  (kBar)')) + 20])
+    parser = OutcarParser(file_path=str(path), settings=ParserSettings({}), exit_codes=VaspCalculation.exit_codes)
+    assert parser.get_quantity('elastic_moduli') is None
+    assert parser.exit_code.status == VaspCalculation.exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.status
+    assert 'elastic_moduli' in parser.exit_code.message
+    assert parser.get_quantity('symmetries')['point_group']['static'][0] == 'O_h'
+
+
+@pytest.mark.parametrize('outcar_parser', ['disp_details'], indirect=True)
+def test_performance_profile(fresh_aiida_env, outcar_parser):
+    """Test the timings of the electronic and ionic steps and the parallel setup."""
+    profile = outcar_parser.get_quantity('performance_profile')
+    assert profile['mpi_ranks'] == 16
+    assert profile['threads_per_rank'] is None
+    assert (profile['cores_per_kpoint'], profile['kpoint_groups']) == (16, 1)
+    assert (profile['cores_per_band'], profile['band_groups']) == (1, 16)
+    assert len(profile['electronic_cpu_time']) == len(profile['electronic_wall_time']) == 84
+    assert profile['electronic_cpu_time'][:2] == [0.192, 0.178]
+    assert profile['electronic_wall_time'][:2] == [0.1932, 0.1792]
+    assert len(profile['ionic_cpu_time']) == len(profile['ionic_wall_time']) == 15
+    assert (profile['ionic_cpu_time'][0], profile['ionic_wall_time'][0]) == (0.7769, 0.8296)
+    assert profile['electronic_steps_per_ionic_step'][:3] == [2, 5, 6]
+    assert sum(profile['electronic_steps_per_ionic_step']) == 84
+    assert profile['maximum_memory_used'] == 81612.0
+
+
+def test_single_scan(fresh_aiida_env):
+    """Test that the requested quantities of the steps are collected in the scan from the start of OUTCAR."""
+    from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    settings = ParserSettings({'add_misc': {'type': 'dict', 'quantities': ['symmetries', 'performance_profile'], 'link_name': 'misc'}})
+    parser = OutcarParser(file_path=data_path('disp_details', 'OUTCAR'), settings=settings)
+    assert parser.get_quantity('symmetries')['point_group']['static'][0] == 'O_h'
+    assert parser._scanned == {'forward', 'performance_profile'}  # pylint: disable=protected-access
+    assert parser.get_quantity('performance_profile')['mpi_ranks'] == 16
+    assert parser._scanned == {'forward', 'performance_profile'}  # pylint: disable=protected-access
+
+
+def test_performance_profile_vasp6(fresh_aiida_env, tmpdir):
+    """Test the parallel setup of a hybrid MPI/OpenMP run of VASP6 and an unfinished ionic step."""
+    from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    path = tmpdir.join('OUTCAR')
+    path.write('\n'.join([
+        ' vasp.6.2.1 16May21 (build Jun 14 2021 12:00:00) complex',
+        ' running    8 mpi-ranks, with    2 threads/rank',
+        ' distrk:  each k-point on    4 cores,    2 groups',
+        ' distr:  one band on NCORE=   2 cores,    2 groups',
+        '--------------------------------------- Iteration      1(   1)  ---------------------------------------',
+        '      LOOP:  cpu time      1.2500: real time      1.3000',
+        '     LOOP+:  cpu time      2.0000: real time      2.1000',
+        '--------------------------------------- Iteration      2(   1)  ---------------------------------------',
+        '      LOOP:  cpu time      1.5000: real time   *********',
+        '',
+    ]))
+    profile = OutcarParser(file_path=str(path), settings=ParserSettings({})).get_quantity('performance_profile')
+    assert (profile['mpi_ranks'], profile['threads_per_rank']) == (8, 2)
+    assert (profile['cores_per_kpoint'], profile['kpoint_groups']) == (4, 2)
+    assert (profile['cores_per_band'], profile['band_groups']) == (2, 2)
+    assert profile['electronic_cpu_time'] == [1.25, 1.5]
+    assert profile['electronic_wall_time'] == [1.3, None]
+    assert profile['ionic_wall_time'] == [2.1]
+    assert profile['electronic_steps_per_ionic_step'] == [1]
+    assert profile['maximum_memory_used'] is None
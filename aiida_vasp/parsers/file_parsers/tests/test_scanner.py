@@ -0,0 +1,90 @@
+"""Test the single pass line scanner."""
+import io
+
+import pytest
+
+from aiida_vasp.parsers.file_parsers.parser import MappedFile
+from aiida_vasp.parsers.file_parsers.scanner import LineScanner, TailScanner
+
+TEXT = """header
+ E-fermi :   5.1234
+ TABLE
+   1.0 2.0
+   E-fermi inside the table is not scanned
+ END
+ E-fermi :   6.5432     TOTEN
+"""
+
+
+@pytest.mark.parametrize('block_size', [1, 20, 1024])
+def test_scanner(block_size):
+    """Test that the handlers see the matching lines only and can consume the lines of a block."""
+    found = {'fermi': [], 'table': [], 'toten': []}
+
+    def fermi(line, lines):  # pylint: disable=unused-argument
+        found['fermi'].append(float(line.split()[2]))
+
+    def table(line, lines):  # pylint: disable=unused-argument
+        for row in lines:
+            if row.strip() == 'END':
+                break
+            found['table'].append(row.strip())
+
+    def toten(line, lines):  # pylint: disable=unused-argument
+        found['toten'].append(line)
+
+    scanner = LineScanner(block_size=block_size)
+    scanner.register(r'E-fermi', fermi)
+    scanner.register(r'^ TABLE', table)
+    scanner.register(r'TOTEN', toten)
+    scanner.scan(io.StringIO(TEXT))
+    assert found['fermi'] == [5.1234, 6.5432]
+    assert found['table'] == ['1.0 2.0', 'E-fermi inside the table is not scanned']
+    # The line was dispatched to the leftmost trigger.
+    assert found['toten'] == []
+
+
+@pytest.mark.parametrize('block_size', [1, 20, 1024])
+def test_tail_scanner(block_size):
+    """Test that the handlers see the last matching line and the lines following it."""
+    found = {}
+
+    def fermi(line, lines):  # pylint: disable=unused-argument
+        found['fermi'] = float(line.split()[2])
+
+    def table(line, lines):  # pylint: disable=unused-argument
+        found['table'] = next(lines).strip()
+
+    def missing(line, lines):  # pylint: disable=unused-argument
+        found['missing'] = line
+
+    scanner = TailScanner(block_size=block_size)
+    scanner.register(r'E-fermi', fermi)
+    scanner.register(r'^ TABLE', table)
+    scanner.register(r'^header', missing, within=20)
+    scanner.register(r'^ TABLE', missing, since=r'END')
+    scanner.scan(io.BytesIO(TEXT.encode()))
+    assert found == {'fermi': 6.5432, 'table': '1.0 2.0'}
+
+
+def test_scanners_mapped(tmpdir):
+    """Test scanning a memory mapped file, on which the lines are only decoded for the handlers."""
+    path = tmpdir.join('OUTCAR')
+    path.write(TEXT)
+    found = {'fermi': [], 'last': []}
+
+    def fermi(line, lines):  # pylint: disable=unused-argument
+        found['fermi'].append(float(line.split()[2]))
+
+    def last(line, lines):
+        found['last'].extend([line.strip(), next(lines).strip()])
+
+    with MappedFile(str(path)) as mapped_file:
+        scanner = LineScanner()
+        scanner.register(r'E-fermi :', fermi)
+        scanner.scan(mapped_file)
+        scanner = TailScanner()
+        scanner.register(r'E-fermi inside', last)
+        scanner.scan(mapped_file)
+    assert found['fermi'] == [5.1234, 6.5432]
+    assert found['last'] == ['E-fermi inside the table is not scanned', 'END']
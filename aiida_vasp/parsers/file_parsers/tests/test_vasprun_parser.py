@@ -1,11 +1,13 @@
 """Test the vasprun.xml parser."""
-# pylint: disable=unused-import,redefined-outer-name,unused-argument,unused-wildcard-import,wildcard-import
+# pylint: disable=unused-import,redefined-outer-name,unused-argument,unused-wildcard-import,wildcard-import,protected-access
 
 import pytest
 import numpy as np
 
 from aiida_vasp.utils.fixtures import *
 from aiida_vasp.utils.aiida_utils import get_data_class
+from aiida_vasp.utils.energies import get_electronic_step_energies, get_offsets, iter_electronic_step_energies
+from aiida_vasp.utils.fixtures.testdata import data_path
 from aiida_vasp.parsers.node_composer import NodeComposer, get_node_composer_inputs_from_file_parser
 
 
@@ -15,6 +17,34 @@ def test_version(fresh_aiida_env, vasprun_parser):
     assert quantity == '5.4.4'
 
 
+@pytest.mark.parametrize('vasprun_parser', [('basic', {})], indirect=True)
+def test_lazy_quantities(fresh_aiida_env, vasprun_parser):
+    """Check that only the requested quantities are evaluated and that the results are cached."""
+    assert vasprun_parser.get_quantity('version') == '5.4.4'
+    assert list(vasprun_parser._parsed_data.keys()) == ['version']
+    # Quantities that are not present are cached as None
+    assert vasprun_parser.get_quantity('dielectrics') is None
+    assert 'dielectrics' in vasprun_parser._parsed_data
+    assert 'trajectory' not in vasprun_parser._parsed_data
+    # Cached quantities do not touch the xml again
+    vasprun_parser._xml = None
+    assert vasprun_parser.get_quantity('version') == '5.4.4'
+    assert vasprun_parser.get_quantity('dielectrics') is None
+
+
+def test_estimate_quantity_sizes():
+    """Check the array sizes estimated from the header of vasprun.xml."""
+    from aiida_vasp.parsers.file_parsers.vasprun import read_header, estimate_quantity_sizes
+    from aiida_vasp.parsers.file_parsers.vasprun_arrays import StepSelection
+    header = read_header(data_path('relax', 'vasprun.xml'))
+    assert header == {'nbands': 21, 'nedos': 1000, 'ispin': 1, 'nsw': 80, 'nions': 8, 'nkpoints': 64}
+    sizes = estimate_quantity_sizes(header)
+    assert sizes['eigenvalues'] == 64 * 21 * 8
+    assert sizes['trajectory'] == 80 * (18 + 6 * 8) * 8
+    sizes = estimate_quantity_sizes(header, StepSelection(stride=10, fields=['positions']))
+    assert sizes['trajectory'] == 8 * 3 * 8 * 8
+
+
 def test_parse_vasprun(fresh_aiida_env, vasprun_parser):
     """Parse a reference vasprun.xml file with the VasprunParser and compare the result to a reference string."""
 
@@ -68,6 +98,11 @@ def test_kpoints(fresh_aiida_env, vasprun_parser):
     assert isinstance(data_obj, ref_class)
     assert np.all(data_obj.get_kpoints()[0] == np.array([0.0, 0.0, 0.0]))
     assert np.all(data_obj.get_kpoints()[-1] == np.array([0.42857143, -0.42857143, 0.42857143]))
+    # The k-points are handed to the composer as arrays.
+    assert isinstance(inputs['kpoints']['points'], np.ndarray)
+    points, weights = data_obj.get_kpoints(also_weights=True)
+    assert points.shape == (len(weights), 3)
+    assert np.allclose(weights, vasprun_parser._xml.get_kpointsw())
 
 
 @pytest.mark.parametrize('vasprun_parser', [('basic', {})], indirect=True)
@@ -92,6 +127,9 @@ def test_structure(fresh_aiida_env, vasprun_parser):
     # check first and last position
     assert np.all(data_obj.sites[0].position == np.array([0.0, 0.0, 0.0]))
     assert np.all(data_obj.sites[7].position == np.array([4.09877343, 4.09877343, 1.36625781]))
+    # check that one kind is created for the species
+    assert data_obj.get_kind_names() == ['Si']
+    assert all(site.kind_name == 'Si' for site in data_obj.sites)
     # check volume
     assert data_obj.get_cell_volume() == np.float(163.22171870360754)
 
@@ -490,6 +528,19 @@ def test_run_status_result(fresh_aiida_env, vasprun_parser):
         assert data['ionic_converged'] is False
 
 
+@pytest.mark.parametrize('vasprun_parser', [('relax-truncated', {'salvage_ionic_steps': True})], indirect=True)
+def test_salvage_ionic_steps(fresh_aiida_env, vasprun_parser):
+    """Check that the closed ionic steps of a truncated file are kept."""
+    from aiida_vasp.parsers.file_parsers.vasprun_iterparse import IterparseXml
+    assert isinstance(vasprun_parser._xml, IterparseXml)
+    trajectory = vasprun_parser.get_quantity('trajectory')
+    assert trajectory['positions'].shape == (18, 8, 3)
+    assert len(vasprun_parser.get_quantity('energies')['energy_extrapolated']) == 18
+    structure = vasprun_parser.get_quantity('structure')
+    assert np.allclose(structure['positions'][0], np.dot(trajectory['positions'][-1, 0], trajectory['cells'][-1]))
+    assert vasprun_parser.get_quantity('run_status')['recovered_ionic_steps'] == 18
+
+
 @pytest.mark.parametrize('vasprun_parser', [('spin', {})], indirect=True)
 def test_eigenocc_spin_result(fresh_aiida_env, vasprun_parser):
     """
@@ -699,6 +750,28 @@ def test_toten_relax_electronic(fresh_aiida_env, vasprun_parser):
     assert np.allclose(test_array_energies, data_obj.get_array('energy_extrapolated_final'))
 
 
+@pytest.mark.parametrize('vasprun_parser', [('relax', {
+    'electronic_step_energies': True,
+    'electronic_step_energies_layout': 'ragged',
+    'vasprun_backend': backend
+}) for backend in ['parsevasp', 'iterparse', 'indexed']],
+                         indirect=True)
+def test_toten_relax_ragged(fresh_aiida_env, vasprun_parser):
+    """Check the ragged layout of the electronic step energies and reading single ionic steps from the node."""
+    inputs = get_node_composer_inputs_from_file_parser(vasprun_parser, quantity_keys=['energies'])
+    data_obj = NodeComposer.compose('array', inputs)
+    assert set(data_obj.get_arraynames()) == set(['energy_extrapolated', 'energy_extrapolated_offsets', 'energy_extrapolated_final'])
+    test_array_steps = np.array([18, 6, 7, 4, 4, 2, 4, 2, 2, 4, 4, 2, 3, 2, 3, 2, 2, 2, 3])
+    assert np.array_equal(np.diff(get_offsets(data_obj)), test_array_steps)
+    assert np.allclose(get_electronic_step_energies(data_obj, 1),
+                       [-43.34236449, -43.31102002, -43.27768275, -43.27791002, -43.27761357, -43.27757545])
+    assert np.allclose(get_electronic_step_energies(data_obj, -1), [-43.39084354, -43.39088709, -43.39087657])
+    with pytest.raises(IndexError):
+        get_electronic_step_energies(data_obj, len(test_array_steps))
+    assert [len(energies) for energies in iter_electronic_step_energies(data_obj)] == test_array_steps.tolist()
+    assert np.isclose(data_obj.get_array('energy_extrapolated_final')[0], -0.00236637)
+
+
 @pytest.mark.parametrize('vasprun_parser', [('disp', {})], indirect=True)
 def test_hessian(fresh_aiida_env, vasprun_parser):
     """
@@ -762,3 +835,139 @@ def test_dynmat(fresh_aiida_env, vasprun_parser):
     ]))
     assert dyneig[0] == -1.36621537e+00
     assert dyneig[4] == -8.48939361e-01
+
+
+@pytest.mark.parametrize('vasprun_parser', [('relax', {'vasprun_backend': 'iterparse', 'electronic_step_energies': True})], indirect=True)
+def test_iterparse_backend(fresh_aiida_env, vasprun_parser):
+    """Check that the streaming backend gives the same quantities as parsevasp."""
+    from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+    from aiida_vasp.parsers.file_parsers.vasprun_iterparse import IterparseXml
+    from aiida_vasp.parsers.settings import ParserSettings
+    from aiida_vasp.calcs.vasp import VaspCalculation
+    assert isinstance(vasprun_parser._xml, IterparseXml)
+    reference = VasprunParser(file_path=data_path('relax', 'vasprun.xml'),
+                              settings=ParserSettings({'electronic_step_energies': True}),
+                              exit_codes=VaspCalculation.exit_codes)
+
+    for quantity in ['trajectory', 'energies']:
+        parsed = vasprun_parser.get_quantity(quantity)
+        expected = reference.get_quantity(quantity)
+        assert parsed.keys() == expected.keys()
+        for key, value in expected.items():
+            if key == 'symbols':
+                assert np.all(parsed[key] == value)
+            else:
+                assert np.allclose(parsed[key], value)
+    for quantity in ['structure', 'kpoints', 'eigenvalues', 'run_status']:
+        assert repr(vasprun_parser.get_quantity(quantity)) == repr(reference.get_quantity(quantity))
+
+
+@pytest.mark.parametrize('vasprun_parser', [('relax-truncated', {'vasprun_backend': backend}) for backend in ['iterparse', 'indexed']],
+                         indirect=True)
+def test_truncated_backend(fresh_aiida_env, vasprun_parser):
+    """Check that without salvaging the ionic steps, the backends give the energies and run status of parsevasp for a truncated file."""
+    from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    from aiida_vasp.calcs.vasp import VaspCalculation
+    reference = VasprunParser(file_path=data_path('relax-truncated', 'vasprun.xml'),
+                              settings=ParserSettings({}),
+                              exit_codes=VaspCalculation.exit_codes)
+    assert reference.get_quantity('energies') is None
+    assert vasprun_parser.get_quantity('energies') is None
+    assert vasprun_parser.get_quantity('run_status') == reference.get_quantity('run_status')
+    assert vasprun_parser.get_quantity('run_status')['recovered_ionic_steps'] == 0
+    trajectory = vasprun_parser.get_quantity('trajectory')
+    for key, value in reference.get_quantity('trajectory').items():
+        assert np.all(trajectory[key] == value)
+
+
+@pytest.mark.parametrize('folder', ['spin', 'partial'])
+def test_vectorized_decoding(folder):
+    """Check that the vectorized decoding of the arrays gives the same result as parsevasp."""
+    from parsevasp.vasprun import Xml
+    from aiida_vasp.parsers.file_parsers.vasprun_arrays import VectorizedXml
+    file_path = data_path(folder, 'vasprun.xml')
+    xml = VectorizedXml(file_path=file_path, k_before_band=True)
+    reference = Xml(file_path=file_path, k_before_band=True)
+    for key in ['eigenvalues', 'occupancies', 'projectors']:
+        parsed = xml._data[key]
+        expected = reference._data[key]
+        assert (parsed is None) == (expected is None)
+        if expected is not None:
+            assert parsed.keys() == expected.keys()
+            for spin, value in expected.items():
+                assert parsed[spin].shape == value.shape
+                assert np.array_equal(parsed[spin], value)
+    assert np.array_equal(xml.get_dos()['total']['energy'], reference.get_dos()['total']['energy'])
+
+
+def test_decode_array():
+    """Check the shape inferred from the headers of an <array>."""
+    from lxml import etree
+    from aiida_vasp.parsers.file_parsers.vasprun_arrays import decode_array, decode_rows, get_array_shape
+    array = etree.fromstring('<array><dimension>band</dimension><dimension>spin</dimension>'
+                             '<field>eig</field><field>occ</field>'
+                             '<set><set><r>1.0 2.0</r><r>3.0 4.0</r><r>5.0 6.0</r></set>'
+                             '<set><r>7.0 8.0</r><r>9.0 10.0</r><r>11.0 12.0</r></set></set></array>')
+    assert get_array_shape(array) == (2, 3, 2)
+    assert np.array_equal(decode_array(array), np.arange(1.0, 13.0).reshape(2, 3, 2))
+    with pytest.raises(ValueError):
+        decode_rows(etree.fromstring('<set><r>1.0 2.0</r><r>3.0</r></set>').findall('r'), 2)
+    with pytest.raises(ValueError):
+        decode_rows(etree.fromstring('<set><r>1.0 *******</r></set>').findall('r'), 2)
+
+
+@pytest.mark.parametrize('vasprun_parser', [('relax', {'vasprun_backend': 'indexed'})], indirect=True)
+def test_indexed_backend(fresh_aiida_env, vasprun_parser):
+    """Check that the indexed backend only parses the sections needed and gives the same quantities as parsevasp."""
+    from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+    from aiida_vasp.parsers.file_parsers.vasprun_index import IndexedXml
+    from aiida_vasp.parsers.settings import ParserSettings
+    from aiida_vasp.calcs.vasp import VaspCalculation
+    xml = vasprun_parser._xml
+    assert isinstance(xml, IndexedXml)
+    assert xml.index.num_calculations == 19
+    reference = VasprunParser(file_path=data_path('relax', 'vasprun.xml'),
+                              settings=ParserSettings({}),
+                              exit_codes=VaspCalculation.exit_codes)
+
+    for quantity in ['total_energies', 'maximum_force', 'maximum_stress', 'run_status', 'version']:
+        assert vasprun_parser.get_quantity(quantity) == reference.get_quantity(quantity)
+    assert xml._loaded == {'header', 'steps'}
+    # Only the last ionic step has been read for the total energies.
+    assert list(xml._data['totens'].keys()) == [19]
+
+    for quantity in ['trajectory', 'energies']:
+        parsed = vasprun_parser.get_quantity(quantity)
+        expected = reference.get_quantity(quantity)
+        for key, value in expected.items():
+            assert np.all(parsed[key] == value)
+    assert repr(vasprun_parser.get_quantity('eigenvalues')) == repr(reference.get_quantity('eigenvalues'))
+
+
+@pytest.mark.parametrize('vasprun_parser', [('relax', {
+    'vasprun_backend': backend,
+    'trajectory_start': 1,
+    'trajectory_stop': 15,
+    'trajectory_stride': 4,
+    'trajectory_fields': ['positions', 'forces']
+}) for backend in ['parsevasp', 'iterparse', 'indexed']],
+                         indirect=True)
+def test_trajectory_selection(fresh_aiida_env, vasprun_parser):
+    """Check that only the selected ionic steps and fields of the trajectory are extracted."""
+    from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+    from aiida_vasp.parsers.settings import ParserSettings
+    from aiida_vasp.calcs.vasp import VaspCalculation
+    reference = VasprunParser(file_path=data_path('relax', 'vasprun.xml'),
+                              settings=ParserSettings({}),
+                              exit_codes=VaspCalculation.exit_codes)
+    expected = reference.get_quantity('trajectory')
+    trajectory = vasprun_parser.get_quantity('trajectory')
+    assert set(trajectory) == {'symbols', 'steps', 'positions', 'forces'}
+    assert np.all(trajectory['steps'] == [1, 5, 9, 13])
+    assert np.all(trajectory['symbols'] == expected['symbols'])
+    for key in ['positions', 'forces']:
+        assert np.all(trajectory[key] == expected[key][1:15:4])
+    # The final quantities are not affected by the selection.
+    for quantity in ['structure', 'maximum_force', 'maximum_stress']:
+        assert repr(vasprun_parser.get_quantity(quantity)) == repr(reference.get_quantity(quantity))
@@ -5,13 +5,17 @@ vasprun parser.
 The file parser that handles the parsing of vasprun.xml files.
 """
 # pylint: disable=too-many-public-methods, protected-access
+import re
 import sys
 import numpy as np
 
-from parsevasp.vasprun import Xml
-from parsevasp.kpoints import Kpoint
 from parsevasp import constants as parsevaspct
 from aiida_vasp.parsers.file_parsers.parser import BaseFileParser, SingleFile
+from aiida_vasp.parsers.file_parsers.vasprun_arrays import STEP_FIELDS, StepSelection, VectorizedXml
+from aiida_vasp.parsers.file_parsers.vasprun_iterparse import IterparseXml
+from aiida_vasp.parsers.file_parsers.vasprun_index import IndexedXml
+from aiida_vasp.parsers.file_access import open_source
+from aiida_vasp.parsers.triage import is_vasprun_closed
 from aiida_vasp.utils.compare_bands import get_band_properties
 
 DEFAULT_OPTIONS = {
@@ -40,7 +44,29 @@ DEFAULT_OPTIONS = {
         'version',
     ],
     'energy_type': ['energy_extrapolated'],
-    'electronic_step_energies': False
+    'electronic_step_energies': False,
+    'electronic_step_energies_layout': 'counts',
+    'vasprun_backend': 'parsevasp',
+    'salvage_ionic_steps': False
+}
+
+# parsevasp's table of element -> atomic number, inverted once to look up the symbols of the species.
+ELEMENT_SYMBOLS = {number: element.title() for element, number in parsevaspct.elements.items()}
+
+# The readers of vasprun.xml that can be selected with the `vasprun_backend` setting. All decode the
+# arrays with the vectorized functions in vasprun_arrays.py.
+XML_BACKENDS = {'parsevasp': VectorizedXml, 'iterparse': IterparseXml, 'indexed': IndexedXml}
+
+# Number of projected orbitals assumed when estimating the size of the projectors and the partial dos
+# (s, p and d, the f states would add another seven).
+ORBITALS = 9
+FLOAT_SIZE = np.dtype(np.float64).itemsize
+HEADER_PATTERNS = {
+    'nbands': re.compile(r'<i type="int" name="NBANDS">\s*(\d+)'),
+    'nedos': re.compile(r'<i type="int" name="NEDOS">\s*(\d+)'),
+    'ispin': re.compile(r'<i type="int" name="ISPIN">\s*(\d+)'),
+    'nsw': re.compile(r'<i type="int" name="NSW">\s*(\d+)'),
+    'nions': re.compile(r'<atoms>\s*(\d+)\s*</atoms>'),
 }
 
 
@@ -81,6 +107,7 @@ class VasprunParser(BaseFileParser):
             'inputs': [],
             'name': 'trajectory',
             'prerequisites': [],
+            'alternatives': ['outcar-trajectory']
         },
         'energies': {
             'inputs': [],
@@ -159,20 +186,55 @@ class VasprunParser(BaseFileParser):
         }
     }
 
+    # Building the full xml tree is considerably more expensive than reading the plain text files.
+    PARSE_COST = 4.0
+
     def __init__(self, *args, **kwargs):
         super(VasprunParser, self).__init__(*args, **kwargs)
         self._xml = None
         self._xml_truncated = False
+        self._over_budget = {}
+        self._step_selection = None
         self.init_with_kwargs(**kwargs)
 
     def _init_with_file_path(self, path):
         """Init with a filepath."""
         self._data_obj = SingleFile(path=path)
+        self._init_xml(path)
+
+    def _init_with_file_handler(self, handler):
+        """Init with a readable binary file handler."""
+        self._data_obj = SingleFile(handler=handler)
+        self._init_xml(handler)
+
+    def _init_xml(self, source):
+        """Parse the file with parsevasp."""
+        self._step_selection = self._get_step_selection()
+        self._over_budget = self._get_quantities_over_budget(source)
 
         # Since vasprun.xml can be fairly large, we will parse it only
-        # once and store the parsevasp Xml object.
+        # once and store the parsevasp Xml object. If the trajectory exceeds the memory budget,
+        # only the last ionic step is extracted, which bounds the memory used by parsevasp.
+        extract_all = 'trajectory' not in self._over_budget
+        backend = DEFAULT_OPTIONS['vasprun_backend']
+        if self._settings is not None:
+            backend = self._settings.get('vasprun_backend', backend)
+        if backend not in XML_BACKENDS:
+            self._logger.warning('Unknown vasprun_backend {}, using {}.'.format(backend, DEFAULT_OPTIONS['vasprun_backend']))
+            backend = DEFAULT_OPTIONS['vasprun_backend']
+        xml_cls = XML_BACKENDS[backend]
+        xml_kwargs = {}
+        if self._is_salvaged(source):
+            # Stream the file, keeping the closed ionic steps instead of relying on the recovery of lxml.
+            xml_cls = IterparseXml
+            xml_kwargs['salvage'] = True
         try:
-            self._xml = Xml(file_path=path, k_before_band=True, logger=self._logger)
+            with self._data_obj.parsevasp_source('rb') as parsevasp_source:
+                self._xml = xml_cls(k_before_band=True,
+                                    extract_all=extract_all,
+                                    logger=self._logger,
+                                    step_selection=self._step_selection,
+                                    **dict(parsevasp_source, **xml_kwargs))
             # Let us also check if the xml was truncated as the parser uses lxml and its
             # recovery mode in case we can use some of the results.
             self._xml_truncated = self._xml.truncated
@@ -180,10 +242,50 @@ class VasprunParser(BaseFileParser):
             self._logger.warning('Parsevasp exited abruptly. Returning None.')
             self._xml = None
 
+    def _is_salvaged(self, source):
+        """Check whether the completed ionic steps of a truncated file are salvaged, see the `salvage_ionic_steps` setting."""
+        if self._settings is None or not self._settings.get('salvage_ionic_steps', DEFAULT_OPTIONS['salvage_ionic_steps']):
+            return False
+        try:
+            return not is_vasprun_closed(source)
+        except OSError:
+            return False
+
     def _init_with_data(self, data):
         """Init with SingleFileData."""
         self._init_with_file_path(data.get_file_abs_path())
 
+    def _get_step_selection(self):
+        """Return the ionic steps and fields of the trajectory to extract from the `trajectory_*` settings, None for all."""
+        try:
+            return StepSelection.from_settings(self._settings)
+        except ValueError as error:
+            self._logger.warning('Ignoring the trajectory selection, extracting all ionic steps: {}'.format(error))
+            return None
+
+    def _get_quantities_over_budget(self, source):
+        """
+        Return the estimated sizes in MB of the requested quantities that exceed `max_parse_memory`.
+
+        The sizes are estimated from the header of vasprun.xml, before the file is parsed.
+        """
+        max_parse_memory = self._settings.get('max_parse_memory') if self._settings is not None else None
+        if not max_parse_memory:
+            return {}
+        quantities_to_parse = DEFAULT_OPTIONS.get('quantities_to_parse')
+        if getattr(self._settings, 'quantity_names_to_parse', None):
+            quantities_to_parse = self._settings.quantity_names_to_parse
+        try:
+            header = read_header(source)
+        except OSError:
+            return {}
+        over_budget = {}
+        for quantity, size in estimate_quantity_sizes(header, self._step_selection).items():
+            size = size / 1024**2
+            if quantity in quantities_to_parse and size > max_parse_memory:
+                over_budget[quantity] = size
+        return over_budget
+
     def _parse_file(self, inputs):
         """Parse the quantities related to this file parser."""
         # Since all quantities will be returned by properties, we can't pass
@@ -196,17 +298,28 @@ class VasprunParser(BaseFileParser):
             quantities_to_parse = self._settings.quantity_names_to_parse
 
         result = {}
+        for quantity in quantities_to_parse:
+            if quantity in self._parsable_items:
+                result[quantity] = self.get_quantity(quantity)
+
+        return result
 
+    def _parse_quantity(self, quantity_key, inputs):  # pylint: disable=unused-argument
+        """Evaluate only the requested quantity."""
         if self._xml is None:
             # parsevasp threw an exception, which means vasprun.xml could not be parsed.
-            for quantity in quantities_to_parse:
-                if quantity in self._parsable_items:
-                    result[quantity] = None
-            return result
+            return {quantity_key: None}
 
-        for quantity in quantities_to_parse:
-            if quantity in self._parsable_items:
-                result[quantity] = getattr(self, quantity)
+        if quantity_key in self._over_budget:
+            size, limit = self._over_budget[quantity_key], self._settings.get('max_parse_memory')
+            self._logger.warning('Skipping the quantity {quantity}, as its estimated size of {size:.1f} MB exceeds '
+                                 'max_parse_memory of {limit} MB.'.format(quantity=quantity_key, size=size, limit=limit))
+            self._exit_code = self._exit_codes.ERROR_QUANTITY_EXCEEDS_MEMORY_BUDGET.format(quantity=quantity_key,
+                                                                                          size='{:.1f}'.format(size),
+                                                                                          limit=limit)
+            return {quantity_key: None}
+
+        result = {quantity_key: getattr(self, quantity_key)}
 
         # Now we make sure that if some of the requested quantities sets an error during parsing and
         # the xml file is in recover mode, the calculation is simply garbage. Also, exit_code is not always set, or
@@ -215,7 +328,8 @@ class VasprunParser(BaseFileParser):
             self._exit_code = self._exit_codes.NO_ERROR
         if self._exit_code.status:
             if (self._xml_truncated and self._exit_code.status == self._exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.status):
-                self._exit_code = self._exit_codes.ERROR_RECOVERY_PARSING_OF_XML_FAILED.format(quantities=list(result.keys()))
+                quantities = [key for key in self._parsed_data if key in self._parsable_items] + [quantity_key]
+                self._exit_code = self._exit_codes.ERROR_RECOVERY_PARSING_OF_XML_FAILED.format(quantities=quantities)
 
         return result
 
@@ -289,18 +403,22 @@ class VasprunParser(BaseFileParser):
 
     @property
     def kpoints(self):
-        """Fetch the kpoints from parsevasp an store in KpointsData."""
+        """
+        Fetch the kpoints from parsevasp.
+
+        The points and weights are returned as arrays, which the NodeComposer sets on the KpointsData
+        at once, instead of a list of parsevasp Kpoint objects. The points are in direct coordinates.
+        """
 
         kpts = self._xml.get_kpoints()
         kptsw = self._xml.get_kpointsw()
         kpoints_data = None
         if (kpts is not None) and (kptsw is not None):
-            # create a KpointsData object and store k-points
             kpoints_data = {}
             kpoints_data['mode'] = 'explicit'
-            kpoints_data['points'] = []
-            for kpt, kptw in zip(kpts, kptsw):
-                kpoints_data['points'].append(Kpoint(kpt, weight=kptw))
+            kpoints_data['points'] = np.asarray(kpts, dtype=float)
+            kpoints_data['weights'] = np.asarray(kptsw, dtype=float)
+            kpoints_data['cartesian'] = False
 
         return kpoints_data
 
@@ -456,25 +574,15 @@ class VasprunParser(BaseFileParser):
 
         """
 
-        unitcell = self._xml.get_unitcell('all')
-        positions = self._xml.get_positions('all')
+        if self._step_selection is not None:
+            return self._selected_trajectory()
+
+        unitcell = _stack_steps(self._xml.get_unitcell('all'))
+        positions = _stack_steps(self._xml.get_positions('all'))
         species = self._xml.get_species()
-        forces = self._xml.get_forces('all')
-        stress = self._xml.get_stress('all')
-        # make sure all are sorted, first to last calculation
-        # (species is constant)
-        unitcell = sorted(unitcell.items())
-        positions = sorted(positions.items())
-        forces = sorted(forces.items())
-        stress = sorted(stress.items())
-        # convert to numpy
-        unitcell = np.asarray([item[1] for item in unitcell])
-        positions = np.asarray([item[1] for item in positions])
-        forces = np.asarray([item[1] for item in forces])
-        stress = np.asarray([item[1] for item in stress])
-        # Aiida wants the species as symbols, so invert
-        elements = _invert_dict(parsevaspct.elements)
-        symbols = np.asarray([elements[item].title() for item in species.tolist()])
+        forces = _stack_steps(self._xml.get_forces('all'))
+        stress = _stack_steps(self._xml.get_stress('all'))
+        symbols = _get_symbols(species)
 
         if (unitcell is not None) and (positions is not None) and \
            (species is not None) and (forces is not None) and \
@@ -492,16 +600,44 @@ class VasprunParser(BaseFileParser):
 
         return None
 
+    def _selected_trajectory(self):
+        """
+        Fetch the fields and ionic steps of the trajectory given by the `trajectory_*` settings.
+
+        The backends only convert the selected ionic steps, together with the first and the last, and return
+        them as dicts of ionic step, counted from 1, -> array. The `steps` array holds the selected ionic steps.
+        """
+        values = {
+            'cells': self._xml.get_unitcell('all'),
+            'positions': self._xml.get_positions('all'),
+            'forces': self._xml.get_forces('all'),
+            'stress': self._xml.get_stress('all'),
+        }
+        species = self._xml.get_species()
+        if species is not None and all(values[field] is not None for field in STEP_FIELDS):
+            # The last ionic step is always extracted.
+            stepids = self._step_selection.select(max(values['cells']))
+            trajectory_data = {'symbols': _get_symbols(species), 'steps': stepids}
+            for field in self._step_selection.fields:
+                shape = values[field][max(values[field])].shape
+                trajectory_data[field] = np.asarray([values[field][step + 1] for step in stepids]).reshape((len(stepids),) + shape)
+            return trajectory_data
+
+        self._exit_code = self._exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.format(quantity='trajectory')
+        return None
+
     @property
     def total_energies(self):
         """Fetch the total energies after the last ionic run."""
-        energies = self.energies
+        etype = self._settings.get('energy_type', DEFAULT_OPTIONS['energy_type'])
+        # Only the last ionic step is needed, which the indexed backend reads without touching the others.
+        energies = self._xml.get_energies(status='last', etype=etype, nosc=True)
         if energies is None:
             self._exit_code = self._exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.format(quantity=sys._getframe().f_code.co_name)
             return None
         energies_dict = {}
-        for etype in self._settings.get('energy_type', DEFAULT_OPTIONS['energy_type']):
-            energies_dict[etype] = energies[etype][-1]
+        for item in etype:
+            energies_dict[item] = energies[item][-1]
 
         return energies_dict
 
@@ -510,6 +646,9 @@ class VasprunParser(BaseFileParser):
         """Fetch the total energies."""
         # Check if we want total energy entries for each electronic step.
         electronic_step_energies = self._settings.get('electronic_step_energies', DEFAULT_OPTIONS['electronic_step_energies'])
+        layout = self._settings.get('electronic_step_energies_layout', DEFAULT_OPTIONS['electronic_step_energies_layout'])
+        if electronic_step_energies and layout == 'ragged':
+            return self._ragged_energies()
 
         return self._energies(nosc=not electronic_step_energies)
 
@@ -531,6 +670,23 @@ class VasprunParser(BaseFileParser):
 
         return energies
 
+    def _ragged_energies(self):
+        """
+        Fetch the total energies of all electronic steps in the ragged layout.
+
+        For each energy type, the energies of all electronic steps are stored in one flat array, next to
+        `<etype>_offsets` such that the electronic steps of ionic step i are [offsets[i]:offsets[i + 1]] and
+        `<etype>_final`, the energy after each ionic step. See aiida_vasp.utils.energies for the accessors.
+
+        """
+        etype = self._settings.get('energy_type', DEFAULT_OPTIONS['energy_type'])
+        energies = self._xml.get_ragged_energies(etype)
+        if energies is None:
+            self._exit_code = self._exit_codes.ERROR_NOT_ABLE_TO_PARSE_QUANTITY.format(quantity='energies')
+            return None
+
+        return energies
+
     @property
     def projectors(self):
         """Fetch the projectors."""
@@ -660,8 +816,8 @@ class VasprunParser(BaseFileParser):
     def band_properties(self):
         """Fetch miscellaneous electronic structure data"""
 
-        eigenvalues = self.eigenvalues
-        occupations = self.occupancies
+        eigenvalues = self.get_quantity('eigenvalues')
+        occupations = self.get_quantity('occupancies')
         if eigenvalues is None:
             return None
 
@@ -686,39 +842,121 @@ class VasprunParser(BaseFileParser):
         else:
             info['electronic_converged'] = False
 
-        all_energies = self._xml.get_energies('all', nosc=False)
-        if all_energies is None:
-            info['ionic_converged'] = False
+        num_ionic_steps = self._get_num_ionic_steps()
+        if num_ionic_steps is not None and num_ionic_steps <= parameters['nsw'] and not self._xml_truncated:
+            info['ionic_converged'] = True
         else:
-            sc_steps = all_energies.get('electronic_steps')
-            if len(sc_steps) <= parameters['nsw'] and not self._xml_truncated:
-                info['ionic_converged'] = True
-            else:
-                info['ionic_converged'] = False
+            info['ionic_converged'] = False
         # Override if nsw is 0 - no ionic steps are performed
         if parameters['nsw'] < 1:
             info['ionic_converged'] = None
+        if self._xml_truncated:
+            info['recovered_ionic_steps'] = num_ionic_steps or 0
 
         return info
 
+    def _get_num_ionic_steps(self):
+        """Return the number of ionic steps with total energies, or None if they are not present."""
+        if isinstance(self._xml, IndexedXml):
+            # The index knows the ionic steps, so they do not all have to be parsed.
+            return self._xml.get_num_ionic_steps() or None
+        all_energies = self._xml.get_energies('all', nosc=False)
+        if all_energies is None:
+            return None
+        return len(all_energies.get('electronic_steps'))
+
+
+def read_header(source):
+    """
+    Read the dimensions of the calculation from the header of vasprun.xml, given as a path or a binary handle.
+
+    Only the part of the file before the first ionic step is read. The number of ionic steps is bounded by
+    NSW, as the actual number is only known after reading the whole file.
+
+    :return: dict with `nbands`, `nedos`, `ispin`, `nsw`, `nions` and `nkpoints`, values that are not found are 0.
+    """
+    header = {key: 0 for key in HEADER_PATTERNS}
+    header['nkpoints'] = 0
+    in_kpointlist = False
+    with open_source(source, 'r') as handler:
+        for line in handler:
+            if '<calculation>' in line:
+                break
+            if in_kpointlist:
+                if '</varray>' in line:
+                    in_kpointlist = False
+                elif '<v>' in line:
+                    header['nkpoints'] += 1
+                continue
+            if '<varray name="kpointlist"' in line:
+                in_kpointlist = True
+                continue
+            for key, pattern in HEADER_PATTERNS.items():
+                match = pattern.search(line)
+                if match:
+                    header[key] = int(match.group(1))
+    return header
+
+
+def estimate_quantity_sizes(header, step_selection=None):
+    """
+    Estimate the size in bytes of the largest arrays of each quantity once converted to numpy.
+
+    :param step_selection: a StepSelection, restricting the ionic steps and fields of the trajectory.
+    """
+    ispin = max(header['ispin'], 1)
+    nions = header['nions']
+    bands = ispin * header['nkpoints'] * header['nbands']
+    nsteps = max(header['nsw'], 1)
+    step_sizes = {'cells': 9, 'positions': 3 * nions, 'forces': 3 * nions, 'stress': 9}
+    if step_selection is None:
+        trajectory = nsteps * sum(step_sizes.values())
+    else:
+        trajectory = len(step_selection.select(nsteps)) * sum(step_sizes[field] for field in step_selection.fields)
+    return {
+        'eigenvalues': bands * FLOAT_SIZE,
+        'occupancies': bands * FLOAT_SIZE,
+        'projectors': bands * nions * ORBITALS * FLOAT_SIZE,
+        'dos': ispin * header['nedos'] * (1 + nions * ORBITALS) * FLOAT_SIZE,
+        # cells, positions, forces and stress of every (selected) ionic step
+        'trajectory': trajectory * FLOAT_SIZE,
+        'hessian': (3 * nions)**2 * FLOAT_SIZE,
+        'dynmat': 2 * (3 * nions)**2 * FLOAT_SIZE,
+    }
+
 
 def _build_structure(lattice):
-    """Builds a structure according to AiiDA spec."""
+    """
+    Builds a structure according to AiiDA spec.
+
+    The sites are given as arrays of the cartesian positions, symbols and kind names, which the
+    NodeComposer adds to the StructureData at once.
+    """
+    symbols = _get_symbols(lattice['species'])
     structure_dict = {}
     structure_dict['unitcell'] = lattice['unitcell']
-    structure_dict['sites'] = []
-
-    # AiiDA wants the species as symbols, so invert
-    elements = _invert_dict(parsevaspct.elements)
-    for pos, specie in zip(lattice['positions'], lattice['species']):
-        site = {}
-        site['position'] = np.dot(pos, lattice['unitcell'])
-        site['symbol'] = elements[specie].title()
-        site['kind_name'] = elements[specie].title()
-        structure_dict['sites'].append(site)
+    structure_dict['positions'] = np.dot(lattice['positions'], lattice['unitcell'])
+    structure_dict['symbols'] = symbols
+    structure_dict['kind_names'] = symbols
 
     return structure_dict
 
 
-def _invert_dict(dct):
-    return dct.__class__(map(reversed, dct.items()))
+def _get_symbols(species):
+    """Convert the atomic numbers of the species to an array of element symbols, as AiiDA wants them."""
+    if species is None:
+        return None
+    numbers, inverse = np.unique(species, return_inverse=True)
+    return np.asarray([ELEMENT_SYMBOLS[number] for number in numbers.tolist()])[inverse.ravel()]
+
+
+def _stack_steps(steps):
+    """
+    Convert the quantity of all ionic steps to an array with the ionic steps as the first index.
+
+    parsevasp returns a dict of step -> array, which is sorted from the first to the last step, while
+    the iterparse backend already returns an array.
+    """
+    if steps is None or isinstance(steps, np.ndarray):
+        return steps
+    return np.asarray([item[1] for item in sorted(steps.items())])
@@ -0,0 +1,283 @@
+"""
+Vectorized decoding of vasprun.xml arrays.
+
+------------------------------------------
+vasprun.xml stores its arrays as many small text nodes, the <v> rows of a <varray> and the <r>
+rows of the nested <set> elements of an <array>. Instead of converting the rows one at a time,
+the text of a whole block is joined and converted in a single call. The shape of an <array> is
+inferred from its <set> nesting and its <field> headers. Here is also the selection of the ionic steps
+that are extracted for the trajectory, which is shared by the readers of vasprun.xml.
+"""
+import sys
+
+import numpy as np
+from parsevasp.vasprun import Xml, _SUPPORTED_TOTAL_ENERGIES
+
+# The quantities of each ionic step and their location in a <calculation> element.
+STEP_PATHS = {
+    'cells': 'structure/crystal/varray[@name="basis"]',
+    'positions': 'structure/varray[@name="positions"]',
+    'forces': 'varray[@name="forces"]',
+    'stress': 'varray[@name="stress"]',
+}
+STEP_FIELDS = tuple(STEP_PATHS)
+
+
+def decode_rows(rows, num_columns=None):
+    """
+    Convert a list of <v> or <r> elements to a 2D array with one row per element.
+
+    :param num_columns: the expected number of values in each row, inferred from the first row if not given.
+    :raises ValueError: if a value overflowed (is printed as stars) or the rows are not of equal length.
+    """
+    text = ' '.join([row.text for row in rows])
+    if '*' in text:
+        raise ValueError('Overflow detected in the XML file.')
+    if num_columns is None:
+        num_columns = len(rows[0].text.split()) if rows else 0
+    values = np.fromstring(text, sep=' ')
+    if values.size != len(rows) * num_columns:
+        raise ValueError('Expected {} rows of {} values, found {} values.'.format(len(rows), num_columns, values.size))
+    return values.reshape(len(rows), num_columns)
+
+
+def decode_varray(varray):
+    """Convert a <varray> to a 2D array."""
+    return decode_rows(varray.findall('v'))
+
+
+def get_array_shape(array):
+    """
+    Infer the shape of an <array> from its headers.
+
+    The outer dimensions are given by the nested <set> elements, which are assumed to be regular,
+    followed by the number of <r> rows in the innermost <set> and the number of <field> entries.
+    The order is the reverse of the <dimension> headers, e.g. spin, kpoint, band, field for the eigenvalues.
+    """
+    shape = []
+    current = array.find('set')
+    while current is not None:
+        children = current.findall('set')
+        if not children:
+            shape.append(len(current.findall('r')))
+            break
+        shape.append(len(children))
+        current = children[0]
+    num_dimensions = len(array.findall('dimension'))
+    if len(shape) != num_dimensions:
+        raise ValueError('The <set> nesting of the array {} does not match its {} dimensions.'.format(
+            array.get('name'), num_dimensions))
+    shape.append(len(array.findall('field')))
+    return tuple(shape)
+
+
+def decode_array(array):
+    """Convert an <array> with nested <set> elements to an array of the shape given by get_array_shape."""
+    shape = get_array_shape(array)
+    return decode_rows(list(array.iter('r')), shape[-1]).reshape(shape)
+
+
+class StepSelection(object):  # pylint: disable=useless-object-inheritance
+    """
+    The ionic steps and fields of the trajectory to extract, see the `trajectory_*` parser settings.
+
+    The ionic steps are counted from 0 and selected as range(start, stop, stride). The first and the last
+    ionic step are always extracted with all fields, as they also give the initial and final structure,
+    forces and stress.
+    """
+
+    def __init__(self, start=None, stop=None, stride=None, fields=None):
+        self.start = 0 if start is None else start
+        self.stop = stop
+        self.stride = 1 if stride is None else stride
+        self.fields = STEP_FIELDS if fields is None else tuple(fields)
+        if self.start < 0 or (self.stop is not None and self.stop < 0):
+            raise ValueError('trajectory_start and trajectory_stop can not be negative.')
+        if self.stride < 1:
+            raise ValueError('trajectory_stride has to be at least 1.')
+        unknown = [field for field in self.fields if field not in STEP_FIELDS]
+        if unknown or not self.fields:
+            raise ValueError('trajectory_fields has to be a list of {}, got {}.'.format(', '.join(STEP_FIELDS), fields))
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Return the selection given by the `trajectory_*` parser settings, None to extract all ionic steps.
+
+        :raises ValueError: if the settings do not give a valid selection.
+        """
+        if settings is None:
+            return None
+        options = {key: settings.get('trajectory_' + key) for key in ('start', 'stop', 'stride', 'fields')}
+        if all(value is None for value in options.values()):
+            return None
+        try:
+            return cls(**options)
+        except TypeError as error:
+            raise ValueError(str(error))
+
+    def __contains__(self, step):
+        return step >= self.start and (self.stop is None or step < self.stop) and (step - self.start) % self.stride == 0
+
+    def select(self, num_steps):
+        """Return the selected ionic steps out of num_steps."""
+        return np.arange(num_steps)[self.start:self.stop:self.stride]
+
+    def get_steps(self, num_steps):
+        """Return the ionic steps to extract, the selected ones together with the first and the last."""
+        if not num_steps:
+            return []
+        return sorted(set(self.select(num_steps).tolist()) | {0, num_steps - 1})
+
+    def get_fields(self, step, num_steps=None):
+        """Return the fields to extract for an ionic step, num_steps is None if the last step is not yet known."""
+        if step == 0 or (num_steps is not None and step == num_steps - 1):
+            return STEP_FIELDS
+        if step in self:
+            return self.fields
+        return ()
+
+
+class ArrayDecodingMixin(object):  # pylint: disable=useless-object-inheritance
+    """
+    Use the vectorized decoding in parsevasp's Xml.
+
+    Replaces the row by row conversions and the extraction of the eigenvalues and projectors, keeping the
+    format of the results of parsevasp. If an array is not as expected, parsevasp's own extraction is used,
+    such that also its error handling is kept. The optional `step_selection` argument is a StepSelection,
+    with which only the selected ionic steps of the trajectory are converted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._step_selection = kwargs.pop('step_selection', None)
+        super(ArrayDecodingMixin, self).__init__(*args, **kwargs)
+
+    def _convert_array1D_f(self, entry):  # pylint: disable=invalid-name
+        if entry is None:
+            return None
+        return self._decode_rows(entry, 1)[:, 0]
+
+    def _convert_array2D_f(self, entry, dim):  # pylint: disable=invalid-name
+        if entry is None:
+            return None
+        return self._decode_rows(entry, dim)
+
+    def _decode_rows(self, entry, num_columns):
+        try:
+            return decode_rows(entry, num_columns)
+        except ValueError:
+            self._logger.error(self.ERROR_MESSAGES[self.ERROR_OVERFLOW])
+            sys.exit(self.ERROR_OVERFLOW)
+
+    def _fetch_eigenvaluesw(self, xml):
+        """Fetch the eigenvalues and occupancies, decoding the whole array at once."""
+        data = self._decode_single_array(xml, './/calculation/eigenvalues/array')
+        if data is None or data.shape[1:3] != self._get_dimensions('kpoints', 'nbands'):
+            return super(ArrayDecodingMixin, self)._fetch_eigenvaluesw(xml)
+
+        # data is indexed by spin, kpoint, band and field (eigenvalue, occupancy)
+        if not self._k_before_band:
+            data = np.swapaxes(data, 1, 2)
+        spins = ['total'] if data.shape[0] == 1 else ['up', 'down']
+        eigenvalues = {spin: np.ascontiguousarray(data[index, :, :, 0]) for index, spin in enumerate(spins)}
+        if data.shape[-1] < 2:
+            return eigenvalues, None
+        occupancies = {spin: np.ascontiguousarray(data[index, :, :, 1]) for index, spin in enumerate(spins)}
+        return eigenvalues, occupancies
+
+    def _fetch_projectorsw(self, xml):
+        """Fetch the projectors, decoding the whole array at once."""
+        data = self._decode_single_array(xml, './/calculation/projected/array')
+        if data is None or data.shape[1:4] != self._get_dimensions('kpoints', 'nbands', 'nions'):
+            return super(ArrayDecodingMixin, self)._fetch_projectorsw(xml)
+
+        # data is indexed by spin, kpoint, band, ion and orbital, while parsevasp puts the ion first
+        data = np.moveaxis(data, 3, 0)
+        if not self._k_before_band:
+            data = np.swapaxes(data, 2, 3)
+        if data.shape[1] == 1:
+            return {'total': np.ascontiguousarray(data[:, 0])}
+        return {'up': np.ascontiguousarray(data[:, 0]), 'down': np.ascontiguousarray(data[:, 1])}
+
+    def _get_dimensions(self, *names):
+        """Return the number of kpoints, bands and ions that have already been parsed, None if one is missing."""
+        sizes = {
+            'kpoints': self._lattice['kpoints'],
+            'nbands': self._parameters['nbands'],
+            'nions': self._lattice['species'],
+        }
+        dimensions = []
+        for name in names:
+            if sizes[name] is None:
+                return None
+            dimensions.append(sizes[name] if name == 'nbands' else len(sizes[name]))
+        return tuple(dimensions)
+
+    def _fetch_selected_steps(self, calculations, num_steps):
+        """
+        Fetch the unit cells, positions, forces and stress of the ionic steps given by the step selection.
+
+        :param calculations: dict of ionic step, counted from 0, -> <calculation>, holding at least the steps to extract.
+        :param num_steps: the total number of ionic steps.
+        :return: for the unit cells, positions, forces and stress, dicts of ionic step, counted from 1 as in
+            parsevasp, -> array, or None if there are no ionic steps.
+        """
+        values = {field: {} for field in STEP_FIELDS}
+        for step in self._step_selection.get_steps(num_steps):
+            for field in self._step_selection.get_fields(step, num_steps):
+                varray = calculations[step].find(STEP_PATHS[field])
+                values[field][step + 1] = None if varray is None else self._decode_rows(varray.findall('v'), 3)
+        return tuple(values[field] or None for field in STEP_FIELDS)
+
+    def get_ragged_energies(self, etype):
+        """
+        Return the total energies of all ionic and electronic steps in a ragged layout.
+
+        :param etype: list of energy types, see parsevasp's Xml.get_energies.
+        :return: dict with, for each energy type, the energies of all electronic steps concatenated, `<etype>_offsets`,
+            such that the electronic steps of ionic step i are [offsets[i]:offsets[i + 1]], and the energies after
+            each ionic step in `<etype>_final`. None if the energies are not present.
+        """
+        _check_energy_types(etype)
+        totens = self._data['totens']
+        if not totens:
+            return None
+        steps = [totens[key] for key in sorted(totens)]
+        energies = {}
+        for item in etype:
+            energies[item] = np.concatenate([step[item] for step in steps])
+            energies[item + '_offsets'] = np.zeros(len(steps) + 1, dtype=int)
+            np.cumsum([step[item].shape[0] for step in steps], out=energies[item + '_offsets'][1:])
+            energies[item + '_final'] = np.fromiter((step[item + '_final'] for step in steps), dtype=float, count=len(steps))
+        return energies
+
+    def _decode_single_array(self, xml, path):
+        """Decode the array at the path, or return None if there is not exactly one that can be decoded."""
+        arrays = xml.findall(path)
+        if len(arrays) != 1:
+            return None
+        try:
+            return decode_array(arrays[0])
+        except ValueError:
+            return None
+
+
+class VectorizedXml(ArrayDecodingMixin, Xml):
+    """parsevasp's Xml, building the full tree, with the vectorized decoding of the arrays."""
+
+    def _fetch_upfsw(self, xml, extract_all=False):
+        """Fetch the unit cells, positions, forces and stress, of only the selected ionic steps if there is a step selection."""
+        if not extract_all or self._step_selection is None:
+            return super(VectorizedXml, self)._fetch_upfsw(xml, extract_all=extract_all)
+        # The last <calculation> of a truncated file can be incomplete.
+        calculations = [
+            calculation for calculation in xml.findall('.//calculation')
+            if all(calculation.find(path) is not None for path in STEP_PATHS.values())
+        ]
+        return self._fetch_selected_steps(dict(enumerate(calculations)), len(calculations))
+
+
+def _check_energy_types(etype):
+    for item in etype:
+        if item not in _SUPPORTED_TOTAL_ENERGIES:
+            raise ValueError('The supplied total energy type: {} is not supported.'.format(item))
@@ -0,0 +1,403 @@
+"""
+Indexed vasprun.xml reader.
+
+---------------------------
+An alternative to building the full lxml tree of vasprun.xml with parsevasp, for when only a few
+quantities are needed from a large file. A single pass over the raw bytes records where the top
+level sections and each <calculation> begin and end, without parsing any XML. Each getter then
+seeks to the sections it needs and parses only those, e.g. the total energies of the last ionic
+step only touch the last <calculation>. Quantities that are not covered by the index fall back to
+parsing the whole file. Select it with the `vasprun_backend` parser setting.
+"""
+import re
+
+from lxml import etree
+
+from parsevasp.vasprun import Xml
+from aiida_vasp.parsers.file_access import CHUNK_SIZE, open_source
+from aiida_vasp.parsers.file_parsers.vasprun_arrays import ArrayDecodingMixin
+
+# Sections that are indexed when they are children of the root element.
+TOP_LEVEL_SECTIONS = ('generator', 'parameters', 'atominfo', 'kpoints', 'structure')
+# Sections that are indexed when they are children of a <calculation>.
+CALCULATION_SECTIONS = ('eigenvalues', 'dos', 'projected')
+# The sections needed for the dimensions of the arrays, which are parsed together with any other section.
+HEADER_SECTIONS = ('generator', 'parameters', 'atominfo', 'kpoints')
+
+TAG_PATTERN = re.compile(rb'<(/?)(' + b'|'.join(name.encode() for name in ('calculation',) + TOP_LEVEL_SECTIONS + CALCULATION_SECTIONS) +
+                         rb')(?=[\s/>])[^>]*>')
+DECLARATION_PATTERN = re.compile(rb'<\?xml[^>]*\?>')
+
+
+class VasprunIndex(object):  # pylint: disable=useless-object-inheritance
+    """
+    Byte offsets of the sections of vasprun.xml.
+
+    Each section is stored as a (start, end) span, with end pointing just past its closing tag. Only the
+    <calculation> elements that have been closed are indexed, so the last ionic step of a truncated file
+    is left out. Its span, up to the end of the file, is kept in `open_calculation`.
+    """
+
+    def __init__(self):
+        self.declaration = b''
+        self.sections = {name: [] for name in TOP_LEVEL_SECTIONS}
+        self.calculations = []
+        self.open_calculation = None
+
+    @property
+    def num_calculations(self):
+        return len(self.calculations)
+
+    def get_calculation_sections(self, name):
+        """Return the (calculation, span) pairs of a section, for the calculations that contain it."""
+        return [(calculation, span) for calculation in self.calculations for span in calculation[name]]
+
+
+def build_index(handler, chunk_size=CHUNK_SIZE):
+    """
+    Scan a vasprun.xml, given as a binary handle, for the start and end of its sections.
+
+    The file is read in chunks and only the tags of the indexed sections are matched, which are assumed
+    to be balanced. Text or comments containing these tags are not expected in vasprun.xml.
+    """
+    index = VasprunIndex()
+    # Stack of (name, start, child sections) of the indexed sections that are open.
+    stack = []
+    offset = 0
+    buffer = b''
+    while True:
+        chunk = handler.read(chunk_size)
+        buffer += chunk
+        if not offset:
+            match = DECLARATION_PATTERN.match(buffer.lstrip())
+            if match:
+                index.declaration = match.group(0)
+        # A tag can not contain '<', so all tags before the last one in the buffer are complete.
+        end = buffer.rfind(b'<') if chunk else len(buffer)
+        if end < 0:
+            end = len(buffer)
+        for match in TAG_PATTERN.finditer(buffer, 0, end):
+            if match.group(0).endswith(b'/>'):
+                continue
+            name = match.group(2).decode()
+            if not match.group(1):
+                stack.append((name, offset + match.start(), {section: [] for section in CALCULATION_SECTIONS}))
+                continue
+            while stack and stack[-1][0] != name:
+                stack.pop()
+            if not stack:
+                continue
+            _, start, children = stack.pop()
+            span = (start, offset + match.end())
+            parent = stack[-1][0] if stack else None
+            if parent is None and name == 'calculation':
+                children['calculation'] = [span]
+                index.calculations.append(children)
+            elif parent is None and name in TOP_LEVEL_SECTIONS:
+                index.sections[name].append(span)
+            elif parent == 'calculation' and name in CALCULATION_SECTIONS:
+                stack[-1][2][name].append(span)
+        buffer = buffer[end:]
+        offset += end
+        if not chunk:
+            break
+    if stack and stack[0][0] == 'calculation':
+        index.open_calculation = (stack[0][1], offset)
+    return index
+
+
+def read_span(handler, span, skip=()):
+    """Read the bytes of a span, leaving out the given spans inside it."""
+    start, end = span
+    parts = []
+    for skip_start, skip_end in sorted(skip):
+        handler.seek(start)
+        parts.append(handler.read(skip_start - start))
+        start = skip_end
+    handler.seek(start)
+    parts.append(handler.read(end - start))
+    return b''.join(parts)
+
+
+class IndexedXml(ArrayDecodingMixin, Xml):
+    """
+    Drop-in replacement of parsevasp's Xml, which parses the sections of vasprun.xml on demand.
+
+    The quantities are extracted with parsevasp from small trees that are composed of the sections they
+    need, with the same XML paths as in the full tree. The sections of a <calculation> are wrapped in their
+    own <calculation> element. The eigenvalues, density of states and projections are left out of the
+    trees used for the structures, forces, stress and energies. As parsevasp reads a truncated file in the
+    recovery mode of lxml, there are no total energies if the trailing <calculation> misses them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._index = None
+        self._loaded = set()
+        self._open_calculation_checked = False
+        super(IndexedXml, self).__init__(*args, **kwargs)
+
+    @property
+    def index(self):
+        return self._index
+
+    def _parse(self):
+        """Only build the index, the sections are parsed by the getters."""
+        if self._file_size is None:
+            return
+        with open_source(self._get_source()) as handler:
+            self._index = build_index(handler)
+        self._data['totens'] = {}
+
+    def _get_source(self):
+        return self._file_handler if self._file_handler is not None else self._file_path
+
+    def _load(self, group):
+        """Parse the sections needed for a group of quantities, if not already done."""
+        if self._index is None or group in self._loaded or 'all' in self._loaded:
+            return
+        if group == 'all':
+            # Not covered by the index, parse the whole file as parsevasp does.
+            # The total energies are still taken from the index, such that they do not depend on the order of the getters.
+            totens = self._data['totens']
+            if self._file_handler is not None:
+                self._file_handler.seek(0)
+            super(IndexedXml, self)._parse()
+            self._data['totens'] = totens
+            self._loaded.add(group)
+            return
+        if 'header' not in self._loaded:
+            tree = self._read_tree(HEADER_SECTIONS)
+            self._version = self._fetch_versionw(tree)
+            self._parameters = self._get_parameters(tree)
+            self._lattice['species'] = self._fetch_speciesw(tree)
+            self._lattice['kpoints'] = self._fetch_kpointsw(tree)
+            self._lattice['kpointsw'] = self._fetch_kpointsww(tree)
+            self._lattice['kpointdiv'] = self._fetch_kpointdivw(tree)
+            self._loaded.add('header')
+        if group == 'steps':
+            # The first and last ionic step, which is all parsevasp returns for the initial and last status.
+            calculations = self._index.calculations
+            if len(calculations) > 1:
+                calculations = [calculations[0], calculations[-1]]
+            tree = self._read_tree(('structure',), calculations)
+            self._lattice['unitcell'], self._lattice['positions'], self._data['forces'], self._data['stress'] = (self._fetch_upfsw(
+                tree, extract_all=self._extract_all))
+        elif group == 'trajectory':
+            # All ionic steps, or only the selected ones if there is a step selection.
+            calculations = self._index.calculations
+            if self._step_selection is None:
+                tree = self._read_tree((), calculations)
+                self._lattice['unitcell'], self._lattice['positions'], self._data['forces'], self._data['stress'] = (
+                    self._fetch_upfsw(tree, extract_all=True))
+            else:
+                steps = self._step_selection.get_steps(len(calculations))
+                tree = self._read_tree((), [calculations[step] for step in steps])
+                self._lattice['unitcell'], self._lattice['positions'], self._data['forces'], self._data['stress'] = (
+                    self._fetch_selected_steps(dict(zip(steps, tree.getroot().findall('calculation'))), len(calculations)))
+        elif group == 'eigenvalues':
+            tree = self._read_tree(HEADER_SECTIONS, sections=self._index.get_calculation_sections('eigenvalues'))
+            self._data['eigenvalues'], self._data['occupancies'] = self._fetch_eigenvaluesw(tree)
+        elif group == 'dos':
+            tree = self._read_tree(HEADER_SECTIONS, sections=self._index.get_calculation_sections('dos'))
+            self._data['dos'], self._data['dos_specific'] = self._fetch_dosw(tree)
+        elif group == 'projectors':
+            tree = self._read_tree(HEADER_SECTIONS, sections=self._index.get_calculation_sections('projected'))
+            self._data['projectors'] = self._fetch_projectorsw(tree)
+        self._loaded.add(group)
+
+    def _load_energies(self, steps):
+        """Parse the total energies of the given ionic steps, counted from 1, one <calculation> at a time."""
+        if self._index is None:
+            return
+        self._check_open_calculation()
+        for step in steps:
+            if self._data['totens'] is None or step in self._data['totens']:
+                continue
+            totens = self._fetch_totensw(self._read_tree((), [self._index.calculations[step - 1]]))
+            if totens is None:
+                # As parsevasp, give up on the energies if one ionic step misses them.
+                self._data['totens'] = None
+                return
+            self._data['totens'][step] = totens[1]
+
+    def _check_open_calculation(self):
+        """Give up on the energies, as parsevasp does, if the trailing <calculation> of a truncated file misses them."""
+        if self._open_calculation_checked:
+            return
+        self._open_calculation_checked = True
+        if not self._xml_truncated or self._index.open_calculation is None:
+            return
+        with open_source(self._get_source()) as handler:
+            content = read_span(handler, self._index.open_calculation)
+        parser = etree.XMLParser(recover=True, huge_tree=True)
+        tree = etree.ElementTree(etree.fromstring(b''.join([self._index.declaration, b'<modeling>', content]), parser=parser))
+        if self._fetch_totensw(tree) is None:
+            self._data['totens'] = None
+
+    def _read_tree(self, names, calculations=(), sections=()):
+        """
+        Compose a tree of the top level sections, the calculations and the sections of calculations.
+
+        :param names: names of the top level sections.
+        :param calculations: the <calculation> elements to include, from the index, without their indexed sections.
+        :param sections: (calculation, span) pairs of sections of calculations, each wrapped in a <calculation>.
+        """
+        parts = [self._index.declaration, b'<modeling>']
+        with open_source(self._get_source()) as handler:
+            for name in names:
+                for span in self._index.sections[name]:
+                    parts.append(read_span(handler, span))
+            for calculation in calculations:
+                skip = [span for name in CALCULATION_SECTIONS for span in calculation[name]]
+                parts.append(read_span(handler, calculation['calculation'][0], skip))
+            for _, span in sections:
+                parts.extend([b'<calculation>', read_span(handler, span), b'</calculation>'])
+        parts.append(b'</modeling>')
+        parser = etree.XMLParser(huge_tree=True)
+        return etree.ElementTree(etree.fromstring(b''.join(parts), parser=parser))
+
+    def get_num_calculations(self):
+        """Return the number of complete ionic steps, without parsing them."""
+        if self._index is None:
+            return 0
+        return self._index.num_calculations
+
+    def get_num_ionic_steps(self):
+        """Return the number of complete ionic steps with total energies, 0 if the energies are missing as for parsevasp."""
+        if self._index is None:
+            return 0
+        self._check_open_calculation()
+        if self._data['totens'] is None:
+            return 0
+        return self._index.num_calculations
+
+    def get_version(self):
+        self._load('header')
+        return super(IndexedXml, self).get_version()
+
+    def get_parameters(self):
+        self._load('header')
+        return super(IndexedXml, self).get_parameters()
+
+    def get_species(self):
+        self._load('header')
+        return super(IndexedXml, self).get_species()
+
+    def get_kpoints(self):
+        self._load('header')
+        return super(IndexedXml, self).get_kpoints()
+
+    def get_kpointsw(self):
+        self._load('header')
+        return super(IndexedXml, self).get_kpointsw()
+
+    def _load_steps(self, status):
+        """Load the ionic steps needed for a status, the trajectory also holds the first and the last step."""
+        if status == 'all' and self._extract_all:
+            self._load('trajectory')
+        elif 'trajectory' not in self._loaded:
+            self._load('steps')
+
+    def get_unitcell(self, status):
+        self._load_steps(status)
+        return super(IndexedXml, self).get_unitcell(status)
+
+    def get_positions(self, status):
+        self._load_steps(status)
+        return super(IndexedXml, self).get_positions(status)
+
+    def get_forces(self, status):
+        self._load_steps(status)
+        return super(IndexedXml, self).get_forces(status)
+
+    def get_stress(self, status):
+        self._load_steps(status)
+        return super(IndexedXml, self).get_stress(status)
+
+    def _get_energies(self, status, etype, nosc):
+        num_steps = self.get_num_calculations()
+        if status == 'initial':
+            self._load_energies(range(1, min(num_steps, 1) + 1))
+        elif status == 'last':
+            self._load_energies(range(num_steps, num_steps + 1) if num_steps else ())
+        else:
+            self._load_energies(range(1, num_steps + 1))
+        if not self._data['totens']:
+            return None
+        return super(IndexedXml, self)._get_energies(status, etype, nosc)
+
+    def get_ragged_energies(self, etype):
+        self._load_energies(range(1, self.get_num_calculations() + 1))
+        return super(IndexedXml, self).get_ragged_energies(etype)
+
+    def get_eigenvalues(self):
+        self._load('eigenvalues')
+        return super(IndexedXml, self).get_eigenvalues()
+
+    def get_occupancies(self):
+        self._load('eigenvalues')
+        return super(IndexedXml, self).get_occupancies()
+
+    def get_dos(self):
+        self._load('dos')
+        return super(IndexedXml, self).get_dos()
+
+    def get_dos_specific(self):
+        self._load('dos')
+        return super(IndexedXml, self).get_dos_specific()
+
+    def get_fermi_level(self):
+        self._load('dos')
+        return super(IndexedXml, self).get_fermi_level()
+
+    def get_fermi_level_specific(self):
+        self._load('dos')
+        return super(IndexedXml, self).get_fermi_level_specific()
+
+    def get_projectors(self):
+        self._load('projectors')
+        return super(IndexedXml, self).get_projectors()
+
+    def get_dielectrics(self):
+        self._load('all')
+        return super(IndexedXml, self).get_dielectrics()
+
+    def get_epsilon(self):
+        self._load('all')
+        return super(IndexedXml, self).get_epsilon()
+
+    def get_epsilon_ion(self):
+        self._load('all')
+        return super(IndexedXml, self).get_epsilon_ion()
+
+    def get_born(self):
+        self._load('all')
+        return super(IndexedXml, self).get_born()
+
+    def get_hessian(self):
+        self._load('all')
+        return super(IndexedXml, self).get_hessian()
+
+    def get_dynmat(self):
+        self._load('all')
+        return super(IndexedXml, self).get_dynmat()
+
+    def get_eigenvalues_specific(self):
+        self._load('all')
+        return super(IndexedXml, self).get_eigenvalues_specific()
+
+    def get_eigenvelocities(self):
+        self._load('all')
+        return super(IndexedXml, self).get_eigenvelocities()
+
+    def get_kpoints_specific(self):
+        self._load('all')
+        return super(IndexedXml, self).get_kpoints_specific()
+
+    def get_kpointsw_specific(self):
+        self._load('all')
+        return super(IndexedXml, self).get_kpointsw_specific()
+
+    def get_dict(self):
+        self._load('all')
+        return super(IndexedXml, self).get_dict()
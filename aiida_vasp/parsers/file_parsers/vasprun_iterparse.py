@@ -0,0 +1,383 @@
+"""
+Streaming vasprun.xml reader.
+
+-----------------------------
+An alternative to building the full lxml tree of vasprun.xml with parsevasp. The file is walked
+with an event driven iterparse. The cells, positions, forces, stress and total energies of each
+<calculation> element are written into preallocated numpy arrays, after which the element is
+released. Only what is not stored per ionic step, like the eigenvalues, the density of states or
+the Born effective charges, is kept in the tree, so the peak memory grows with the size of the
+output arrays and not with the size of the file. Select it with the `vasprun_backend` parser setting.
+With the `trajectory_*` parser settings, only the selected ionic steps are converted and stored.
+"""
+import numpy as np
+from lxml import etree
+
+from parsevasp.vasprun import Xml, _SUPPORTED_TOTAL_ENERGIES
+from aiida_vasp.parsers.file_parsers.vasprun_arrays import STEP_FIELDS, STEP_PATHS, ArrayDecodingMixin, decode_varray, _check_energy_types
+
+# Initial number of electronic steps per ionic step to reserve for the electronic step energies.
+SCSTEPS_PER_CALCULATION = 16
+# The children of a <calculation> that are read into the arrays of TrajectoryArrays.
+STEP_ELEMENTS = ('structure', 'scstep', 'energy', 'time', 'varray[@name="forces"]', 'varray[@name="stress"]')
+
+
+class TrajectoryArrays(object):  # pylint: disable=useless-object-inheritance
+    """
+    Preallocated arrays holding the per ionic step quantities.
+
+    The capacity is set from NSW and doubled if more ionic steps are found. The electronic step energies
+    are stored flattened, together with the number of electronic steps of each ionic step. With a
+    StepSelection, the energies are still stored for all ionic steps, while the unit cells, positions, forces
+    and stress are only stored for the steps given by the selection, together with their step numbers. As the
+    last ionic step is only known at the end of the file, the elements of the last unselected step are kept
+    until the next one is read, which are converted by `trim` if it turns out to be the last.
+    """
+
+    def __init__(self, num_atoms, capacity, selection=None):
+        capacity = max(capacity, 1)
+        self.selection = selection
+        self.num_steps = 0
+        self.num_stored = 0
+        stored_capacity = capacity if selection is None else len(selection.get_steps(capacity)) + 1
+        shapes = {'cells': (3, 3), 'positions': (num_atoms, 3), 'forces': (num_atoms, 3), 'stress': (3, 3)}
+        self.arrays = {field: np.empty((stored_capacity,) + shapes[field]) for field in STEP_FIELDS}
+        self.stored = {field: np.zeros(stored_capacity, dtype=bool) for field in STEP_FIELDS}
+        self.step_numbers = np.empty(stored_capacity, dtype=int)
+        self.final_energies = {etype: np.empty(capacity) for etype in _SUPPORTED_TOTAL_ENERGIES}
+        self.electronic_steps = np.empty(capacity, dtype=int)
+        self.num_scsteps = 0
+        self.scstep_energies = {etype: np.empty(capacity * SCSTEPS_PER_CALCULATION) for etype in _SUPPORTED_TOTAL_ENERGIES}
+        self._pending = None
+
+    @property
+    def cells(self):
+        return self.arrays['cells']
+
+    @property
+    def positions(self):
+        return self.arrays['positions']
+
+    @property
+    def forces(self):
+        return self.arrays['forces']
+
+    @property
+    def stress(self):
+        return self.arrays['stress']
+
+    def add_calculation(self, calculation):
+        """Read the quantities of a <calculation> element into the next ionic step, return False if it is incomplete."""
+        step = self.num_steps
+        if step == self.final_energies['energy_extrapolated'].shape[0]:
+            self._grow_steps()
+        fields = STEP_FIELDS if self.selection is None else self.selection.get_fields(step)
+        try:
+            varrays = {field: calculation.find(path) for field, path in STEP_PATHS.items()}
+            if any(varray is None for varray in varrays.values()):
+                # Only happens for the last calculation of a truncated file.
+                return False
+            scsteps = {
+                etype: calculation.findall('scstep/energy/i[@name="{}"]'.format(key)) for etype, key in _SUPPORTED_TOTAL_ENERGIES.items()
+            }
+            final_energies = {
+                etype: float(calculation.find('energy/i[@name="{}"]'.format(key)).text) for etype, key in _SUPPORTED_TOTAL_ENERGIES.items()
+            }
+            slot = self._store(step, varrays, fields) if fields else None
+        except (AttributeError, ValueError):
+            return False
+
+        # Keep what is not yet stored, in case this is the last ionic step.
+        missing = {field: varrays[field] for field in STEP_FIELDS if field not in fields}
+        self._pending = (step, slot, missing) if missing else None
+        for etype, energy in final_energies.items():
+            self.final_energies[etype][step] = energy
+        num_scsteps = len(scsteps['energy_extrapolated'])
+        while self.num_scsteps + num_scsteps > self.scstep_energies['energy_extrapolated'].shape[0]:
+            self._grow_scsteps()
+        for etype, entries in scsteps.items():
+            self.scstep_energies[etype][self.num_scsteps:self.num_scsteps + num_scsteps] = np.fromstring(' '.join(
+                [entry.text for entry in entries]), sep=' ')
+        self.electronic_steps[step] = num_scsteps
+        self.num_scsteps += num_scsteps
+        self.num_steps += 1
+        return True
+
+    def _store(self, step, varrays, fields, slot=None):
+        """Read the fields of an ionic step into a slot of the arrays, by default the next one, and return the slot."""
+        if slot is None:
+            slot = self.num_stored
+            if slot == self.step_numbers.shape[0]:
+                self._grow_stored()
+            for field in STEP_FIELDS:
+                self.stored[field][slot] = False
+        for field in fields:
+            _read_varray(varrays[field], self.arrays[field][slot])
+            self.stored[field][slot] = True
+        self.step_numbers[slot] = step
+        self.num_stored = max(self.num_stored, slot + 1)
+        return slot
+
+    def get_steps(self, field):
+        """Return dict of ionic step, counted from 1 as in parsevasp, -> array for the ionic steps of a field that are stored."""
+        return {int(step) + 1: values for step, values, stored in zip(self.step_numbers, self.arrays[field], self.stored[field]) if stored}
+
+    def get_energies(self, status, etype, nosc):
+        """Return the total energies in the format of parsevasp's Xml.get_energies."""
+        offsets = np.concatenate(([0], np.cumsum(self.electronic_steps[:self.num_steps])))
+        if status == 'initial':
+            steps = slice(0, 1)
+        elif status == 'last':
+            steps = slice(self.num_steps - 1, self.num_steps)
+        else:
+            steps = slice(0, self.num_steps)
+        first, last = offsets[steps.start], offsets[steps.stop]
+        energies = {}
+        for item in etype:
+            energies[item + '_final'] = self.final_energies[item][steps].copy()
+            if nosc:
+                energies[item] = self.scstep_energies[item][offsets[steps.start + 1:steps.stop + 1] - 1]
+            else:
+                energies[item] = self.scstep_energies[item][first:last].copy()
+        if nosc:
+            energies['electronic_steps'] = np.ones(steps.stop - steps.start, dtype=int)
+        else:
+            energies['electronic_steps'] = self.electronic_steps[steps].copy()
+        return energies
+
+    def get_ragged_energies(self, etype):
+        """Return the total energies in the ragged layout of ArrayDecodingMixin.get_ragged_energies, without copying them."""
+        offsets = np.zeros(self.num_steps + 1, dtype=int)
+        np.cumsum(self.electronic_steps[:self.num_steps], out=offsets[1:])
+        energies = {}
+        for item in etype:
+            energies[item] = self.scstep_energies[item][:self.num_scsteps]
+            energies[item + '_offsets'] = offsets
+            energies[item + '_final'] = self.final_energies[item][:self.num_steps]
+        return energies
+
+    def trim(self):
+        """
+        Complete the last ionic step and restrict the arrays to the ionic steps that have been read.
+
+        Views are used to avoid copying the trajectory.
+        """
+        if self._pending is not None:
+            step, slot, varrays = self._pending
+            self._pending = None
+            try:
+                self._store(step, varrays, list(varrays), slot)
+            except ValueError:
+                pass
+        num_stored = self.num_stored
+        self.arrays = {field: values[:num_stored] for field, values in self.arrays.items()}
+        self.stored = {field: stored[:num_stored] for field, stored in self.stored.items()}
+        self.step_numbers = self.step_numbers[:num_stored]
+        self.final_energies = {etype: energies[:self.num_steps] for etype, energies in self.final_energies.items()}
+        self.electronic_steps = self.electronic_steps[:self.num_steps]
+        self.scstep_energies = {etype: energies[:self.num_scsteps] for etype, energies in self.scstep_energies.items()}
+
+    def _grow_steps(self):
+        self.final_energies = {etype: _grow(energies) for etype, energies in self.final_energies.items()}
+        self.electronic_steps = _grow(self.electronic_steps)
+
+    def _grow_stored(self):
+        self.arrays = {field: _grow(values) for field, values in self.arrays.items()}
+        self.stored = {field: _grow(stored) for field, stored in self.stored.items()}
+        self.step_numbers = _grow(self.step_numbers)
+
+    def _grow_scsteps(self):
+        self.scstep_energies = {etype: _grow(energies) for etype, energies in self.scstep_energies.items()}
+
+
+class IterparseXml(ArrayDecodingMixin, Xml):
+    """
+    Drop-in replacement of parsevasp's Xml, which streams vasprun.xml instead of building the full tree.
+
+    The quantities that are not stored per ionic step are extracted with parsevasp from a reduced tree,
+    from which the content of the <calculation> elements read into the arrays has been removed. For
+    status `all`, the unit cells, positions, forces and stress are returned as arrays with the ionic
+    steps as the first index, instead of dicts of arrays. With `salvage=True`, a truncated file is read
+    without the recovery mode of lxml, which keeps every closed <calculation> and drops the trailing one.
+    Otherwise, a truncated file is read in the recovery mode, like parsevasp does, and as with parsevasp there
+    are no total energies if the trailing <calculation> misses them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._steps = None
+        self._salvage = kwargs.pop('salvage', False)
+        self._missing_energies = False
+        super(IterparseXml, self).__init__(*args, **kwargs)
+
+    def _parse(self):
+        """Walk the file, reading each <calculation> as soon as it has been closed."""
+        if self._file_size is None:
+            return
+        if self._file_handler is not None:
+            self._file_handler.seek(0)
+            source = self._file_handler
+        else:
+            source = self._file_path
+
+        root = None
+        open_calculation = None
+        # In salvage mode the file is read without the recovery of lxml, so only elements that have been closed are read.
+        recover = self._xml_truncated and not self._salvage
+        try:
+            for event, element in etree.iterparse(source, events=('start', 'end'), recover=recover, huge_tree=True):
+                if root is None:
+                    root = element
+                if element.getparent() is not root:
+                    continue
+                if event == 'start':
+                    if element.tag == 'calculation':
+                        open_calculation = element
+                    continue
+                if element.tag == 'atominfo':
+                    self._lattice['species'] = self._fetch_speciesw(root)
+                elif element.tag == 'calculation':
+                    open_calculation = None
+                    self._add_calculation(element, root)
+        except etree.XMLSyntaxError:
+            self._logger.warning('vasprun.xml is truncated, only the completed ionic steps are read.')
+        if root is None:
+            return
+        if open_calculation is not None:
+            # The trailing <calculation> of a truncated file, which was not closed.
+            self._drop_calculation(open_calculation, root)
+
+        if self._steps is not None:
+            self._steps.trim()
+        tree = etree.ElementTree(root)
+        self._version = self._fetch_versionw(tree)
+        self._parameters = self._get_parameters(tree)
+        self._set_initial_and_final_steps(tree)
+        self._lattice['kpoints'] = self._fetch_kpointsw(tree)
+        self._lattice['kpointsw'] = self._fetch_kpointsww(tree)
+        self._lattice['kpointdiv'] = self._fetch_kpointdivw(tree)
+        self._data['eigenvalues'], self._data['occupancies'] = self._fetch_eigenvaluesw(tree)
+        self._data['eigenvalues_specific'] = self._fetch_eigenvalues_specificw(tree)
+        self._data['eigenvelocities'] = self._fetch_eigenvelocitiesw(tree)
+        self._data['dos'], self._data['dos_specific'] = self._fetch_dosw(tree)
+        self._data['dielectrics'] = self._fetch_dielectricsw(tree)
+        self._data['projectors'] = self._fetch_projectorsw(tree)
+        self._data['hessian'] = self._fetch_hessian(tree)
+        self._data['dynmat'] = self._fetch_dynmatw(tree)
+        self._data['born'] = self._fetch_bornw(tree)
+
+    def _add_calculation(self, calculation, root):
+        """Store the quantities of an ionic step and release them from the tree, an incomplete step is dropped."""
+        if self._steps is None and self._lattice['species'] is not None:
+            nsw = root.find('parameters//i[@name="NSW"]')
+            self._steps = TrajectoryArrays(self._lattice['species'].shape[0], int(nsw.text) if nsw is not None else 1, self._step_selection)
+        if self._steps is None or not self._steps.add_calculation(calculation):
+            self._drop_calculation(calculation, root)
+            return
+        for path in STEP_ELEMENTS:
+            for child in calculation.findall(path):
+                calculation.remove(child)
+        if not len(calculation):  # pylint: disable=len-as-condition
+            root.remove(calculation)
+
+    def _drop_calculation(self, calculation, root):
+        """Remove an incomplete <calculation>, unless salvaging, the energies are then missing if it misses them."""
+        if not self._salvage and not _has_energies(calculation):
+            self._missing_energies = True
+        root.remove(calculation)
+
+    def _set_initial_and_final_steps(self, tree):
+        """Set the unit cells, positions, forces and stress of the first and last ionic step as parsevasp does."""
+        if self._steps is None or not self._steps.num_steps:
+            return
+        steps = self._steps
+        if self._extract_all and self._step_selection is not None:
+            # Only the selected ionic steps are stored, so return them as parsevasp does, in dicts of ionic step -> array.
+            self._lattice['unitcell'] = steps.get_steps('cells')
+            self._lattice['positions'] = steps.get_steps('positions')
+            self._data['forces'] = steps.get_steps('forces')
+            self._data['stress'] = steps.get_steps('stress')
+            return
+        if self._extract_all and steps.num_steps > 1:
+            self._lattice['unitcell'] = steps.cells
+            self._lattice['positions'] = steps.positions
+            self._data['forces'] = steps.forces
+            self._data['stress'] = steps.stress
+            return
+        # Without extract_all, parsevasp takes the cells and positions from the initial and final structures.
+        # For a single ionic step, parsevasp also returns two identical steps.
+        self._lattice['unitcell'] = np.stack(
+            (self._read_structure(tree, 'initialpos', 'crystal/varray[@name="basis"]', steps.cells[0]),
+             self._read_structure(tree, 'finalpos', 'crystal/varray[@name="basis"]', steps.cells[-1])))
+        self._lattice['positions'] = np.stack(
+            (self._read_structure(tree, 'initialpos', 'varray[@name="positions"]', steps.positions[0]),
+             self._read_structure(tree, 'finalpos', 'varray[@name="positions"]', steps.positions[-1])))
+        self._data['forces'] = steps.forces[[0, -1]]
+        self._data['stress'] = steps.stress[[0, -1]]
+
+    @staticmethod
+    def _read_structure(tree, name, path, default):
+        varray = tree.find('structure[@name="{}"]/{}'.format(name, path))
+        if varray is None:
+            return default
+        values = np.empty_like(default)
+        _read_varray(varray, values)
+        return values
+
+    def _get_step(self, steps, status):
+        """Return the array of a given status from an array with the ionic steps as the first index, or a dict as parsevasp."""
+        if steps is None:
+            return None
+        self._check_calc_status(status)
+        if status == 'all':
+            return steps
+        if isinstance(steps, dict):
+            return steps[min(steps) if status == 'initial' else max(steps)]
+        if status == 'initial':
+            return steps[0]
+        return steps[-1]
+
+    def get_unitcell(self, status):
+        return self._get_step(self._lattice['unitcell'], status)
+
+    def get_positions(self, status):
+        return self._get_step(self._lattice['positions'], status)
+
+    def get_forces(self, status):
+        return self._get_step(self._data['forces'], status)
+
+    def get_stress(self, status):
+        return self._get_step(self._data['stress'], status)
+
+    def _get_energies(self, status, etype, nosc):
+        if self._steps is None or not self._steps.num_steps or self._missing_energies:
+            return None
+        self._check_calc_status(status)
+        return self._steps.get_energies(status, etype, nosc)
+
+    def get_ragged_energies(self, etype):
+        _check_energy_types(etype)
+        if self._steps is None or not self._steps.num_steps or self._missing_energies:
+            return None
+        return self._steps.get_ragged_energies(etype)
+
+
+def _has_energies(calculation):
+    """Check whether a <calculation> has the energies of its electronic steps and its final energies, see Xml._fetch_totensw."""
+    return all(
+        calculation.find('.//scstep/energy/i[@name="{0}"]'.format(key)) is not None and
+        calculation.find('./energy/i[@name="{0}"]'.format(key)) is not None for key in _SUPPORTED_TOTAL_ENERGIES.values())
+
+
+def _read_varray(varray, out):
+    """Read a <varray> into the 2D array `out`."""
+    values = decode_varray(varray)
+    if values.shape != out.shape:
+        raise ValueError('Unexpected shape {} of {}.'.format(values.shape, varray.get('name')))
+    out[...] = values
+
+
+def _grow(array):
+    """Return a copy of the array with twice the capacity along the first axis."""
+    grown = np.empty((2 * array.shape[0],) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
@@ -19,6 +19,9 @@ class WavecarParser(BaseFileParser):
         },
     }
 
+    # The quantity is the path or handle of the retrieved file, which is only valid for the current parse.
+    CACHEABLE = False
+
     def __init__(self, *args, **kwargs):
         super(WavecarParser, self).__init__(*args, **kwargs)
         self._wavecar = None
@@ -29,6 +32,9 @@ class WavecarParser(BaseFileParser):
         result = inputs
         result = {}
         wfn = self._data_obj.path
+        if wfn is None:
+            # The node can also be created from the handle of a file that is not on the file system.
+            wfn = self._data_obj.handler
 
         if wfn is None:
             return {'wavecar': None}
@@ -4,13 +4,14 @@ Node composer.
 --------------
 A composer that composes different quantities onto AiiDA data nodes.
 """
+import numpy as np
 
 from aiida_vasp.utils.aiida_utils import get_data_class
 
 NODES_TYPES = {
     'dict': [
         'total_energies', 'maximum_force', 'maximum_stress', 'symmetries', 'magnetization', 'site_magnetization', 'notifications',
-        'band_properties', 'run_status', 'run_stats', 'version'
+        'band_properties', 'run_status', 'run_stats', 'version', 'performance_profile'
     ],
     'array.kpoints': ['kpoints'],
     'structure': ['structure'],
@@ -21,6 +22,54 @@ NODES_TYPES = {
     'array': [],
 }
 
+# The floating point types arrays can be downcast to by a StoragePolicy.
+STORAGE_DTYPES = ('float64', 'float32', 'float16')
+
+
+class StoragePolicy(object):  # pylint: disable=useless-object-inheritance
+    """
+    How the arrays of an output node of type 'array' are stored, see the `storage_policies` parser setting.
+
+    :param dtype: floating point type the float arrays are downcast to, one of STORAGE_DTYPES.
+    :param sparse_threshold: elements with an absolute value below the threshold are set to zero and only the
+        nonzero elements are stored.
+    :param compress: store the arrays in compressed .npz files.
+    """
+
+    def __init__(self, dtype=None, sparse_threshold=None, compress=False):
+        if dtype is not None and dtype not in STORAGE_DTYPES:
+            raise ValueError('The storage dtype has to be one of {}, got {}.'.format(', '.join(STORAGE_DTYPES), dtype))
+        if sparse_threshold is not None and sparse_threshold < 0:
+            raise ValueError('The sparse_threshold can not be negative.')
+        self.dtype = dtype
+        self.sparse_threshold = sparse_threshold
+        self.compress = compress
+
+    @classmethod
+    def from_dict(cls, policy):
+        unknown = set(policy) - {'dtype', 'sparse_threshold', 'compress'}
+        if unknown:
+            raise ValueError('Unknown keys in the storage policy: {}.'.format(', '.join(sorted(unknown))))
+        return cls(**policy)
+
+    @property
+    def node_type(self):
+        """The node type storing the arrays, the plain ArrayData unless the arrays are compressed or sparse."""
+        if self.compress or self.sparse_threshold is not None:
+            return 'vasp.compressed_array'
+        return 'array'
+
+    def apply(self, array):
+        """Return a float array downcast and with the elements below the threshold set to zero, other arrays as they are."""
+        array = np.asarray(array)
+        if array.dtype.kind != 'f':
+            return array
+        if self.dtype is not None:
+            array = array.astype(self.dtype, copy=False)
+        if self.sparse_threshold is not None:
+            array = np.where(np.abs(array) < self.sparse_threshold, array.dtype.type(0), array)
+        return array
+
 
 def get_node_composer_inputs(equivalent_quantity_keys, parsed_quantities, quantity_names_in_node_dict):
     """
@@ -51,6 +100,28 @@ def get_node_composer_inputs_from_file_parser(file_parser, quantity_keys=None):
     return inputs
 
 
+def set_structure_sites(node, positions, symbols, kind_names):
+    """
+    Add the kinds and sites of a structure in bulk.
+
+    Instead of appending the atoms one by one, which compares each new kind with the existing ones,
+    a kind is created once per kind name and the sites are then added with ``append_site``, which
+    checks that the kind of each site exists.
+
+    :param positions: array of the cartesian positions, with shape (N, 3).
+    :param symbols: the element symbol of each site.
+    :param kind_names: the kind name of each site.
+    """
+    from aiida.orm.nodes.data.structure import Kind, Site  # pylint: disable=import-outside-toplevel
+    positions = np.asarray(positions, dtype=float)
+    if positions.ndim != 2 or positions.shape[1] != 3 or len(positions) != len(kind_names):
+        raise ValueError('The positions should have shape ({}, 3), got {}.'.format(len(kind_names), positions.shape))
+    for kind_name, symbol in dict(zip(kind_names, symbols)).items():
+        node.append_kind(Kind(symbols=symbol, name=kind_name))
+    for position, kind_name in zip(positions.tolist(), kind_names):
+        node.append_site(Site(kind_name=kind_name, position=position))
+
+
 class NodeComposer:
     """
     Prototype for a generic NodeComposer, that will compose output nodes based on parsed quantities.
@@ -59,16 +130,20 @@ class NodeComposer:
     """
 
     @classmethod
-    def compose(cls, node_type, inputs):
+    def compose(cls, node_type, inputs, storage_policy=None):
         """
         A wrapper for compose_node with a node definition taken from NODES.
 
         :param node_type: str holding the type of the node. Must be one of the keys of NODES_TYPES.
         :param quantities: A list of strings with quantities to be used for composing this node.
+        :param storage_policy: a StoragePolicy for the arrays of a node of type 'array'.
 
         :return: An AiidaData object of a type corresponding to node_type.
         """
 
+        if storage_policy is not None and node_type == 'array':
+            return cls._compose_array_with_policy(inputs, storage_policy)
+
         # Call the correct specialised method for assembling.
         method_name = '_compose_' + node_type.replace('.', '_')
         return getattr(cls, method_name)(node_type, inputs)
@@ -86,6 +161,10 @@ class NodeComposer:
         node = get_data_class(node_type)()
         for key in inputs:
             node.set_cell(inputs[key]['unitcell'])
+            if 'positions' in inputs[key]:
+                # The sites are given as arrays, see VasprunParser.structure.
+                set_structure_sites(node, inputs[key]['positions'], inputs[key]['symbols'], inputs[key]['kind_names'])
+                continue
             for site in inputs[key]['sites']:
                 node.append_atom(position=site['position'], symbols=site['symbol'], name=site['kind_name'])
         return node
@@ -99,6 +178,19 @@ class NodeComposer:
                 node.set_array(key, value)
         return node
 
+    @staticmethod
+    def _compose_array_with_policy(inputs, storage_policy):
+        """Compose an array node, storing the arrays as given by the storage policy."""
+        node = get_data_class(storage_policy.node_type)()
+        for item in inputs:
+            for key, value in inputs[item].items():
+                value = storage_policy.apply(value)
+                if storage_policy.node_type == 'array':
+                    node.set_array(key, value)
+                else:
+                    node.set_array(key, value, compress=storage_policy.compress, sparse=storage_policy.sparse_threshold is not None)
+        return node
+
     @staticmethod
     def _compose_vasp_wavefun(node_type, inputs):
         """Compose a wave function node."""
@@ -136,6 +228,10 @@ class NodeComposer:
             mode = inputs[key]['mode']
             if mode == 'explicit':
                 kpoints = inputs[key].get('points')
+                if isinstance(kpoints, np.ndarray):
+                    # The points and weights are already arrays, see VasprunParser.kpoints.
+                    node.set_kpoints(kpoints, weights=inputs[key].get('weights'), cartesian=inputs[key].get('cartesian', False))
+                    continue
                 cartesian = not kpoints[0].get_direct()
                 kpoint_list = []
                 weights = []
@@ -0,0 +1,143 @@
+"""
+Parser plan.
+
+------------
+A precompiled, immutable description of what to parse: the quantity tables derived from the
+parser definitions, the quantities that can be parsed from the retrieved files and the quantity
+names requested by the parser settings. Setting this up only depends on the file parser set, the
+node settings (the `add_<node>` parser settings) and the names of the retrieved files, so a daemon
+worker that parses many calculations memoizes the plans and only has to look them up. The output
+node definitions composed from the node settings are memoized alongside.
+"""
+import json
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+MAX_PLANS = 256
+
+_PLANS = OrderedDict()
+_OUTPUT_NODES = OrderedDict()
+_LOCK = threading.Lock()
+
+
+class ParserPlan(object):  # pylint: disable=useless-object-inheritance
+    """
+    Immutable result of screening the parser definitions against the retrieved files.
+
+    The tables are exposed as read-only mappings and tuples, as a plan is shared by all
+    parsers that have the same file parser set, parser settings and retrieved file names.
+    """
+
+    def __init__(self, parser_definitions, quantity_items, quantity_keys_to_filenames, equivalent_quantity_keys, missing_filenames,
+                 parsable_quantity_keys, quantity_names_to_parse, missing_critical_files):
+        self._parser_definitions = MappingProxyType(
+            {file_name: MappingProxyType(dict(definition)) for file_name, definition in parser_definitions.items()})
+        self._quantity_items = MappingProxyType({key: MappingProxyType(dict(item)) for key, item in quantity_items.items()})
+        self._quantity_keys_to_filenames = MappingProxyType(dict(quantity_keys_to_filenames))
+        self._equivalent_quantity_keys = MappingProxyType({name: tuple(keys) for name, keys in equivalent_quantity_keys.items()})
+        self._missing_filenames = MappingProxyType(dict(missing_filenames))
+        self._parsable_quantity_keys = tuple(parsable_quantity_keys)
+        self._quantity_names_to_parse = tuple(quantity_names_to_parse)
+        self._missing_critical_files = tuple(missing_critical_files)
+
+    @property
+    def parser_definitions(self):
+        return self._parser_definitions
+
+    @property
+    def quantity_items(self):
+        return self._quantity_items
+
+    @property
+    def quantity_keys_to_filenames(self):
+        return self._quantity_keys_to_filenames
+
+    @property
+    def equivalent_quantity_keys(self):
+        return self._equivalent_quantity_keys
+
+    @property
+    def missing_filenames(self):
+        return self._missing_filenames
+
+    @property
+    def parsable_quantity_keys(self):
+        return self._parsable_quantity_keys
+
+    @property
+    def quantity_names_to_parse(self):
+        return self._quantity_names_to_parse
+
+    @property
+    def missing_critical_files(self):
+        """File names of critical file parsers that have not been retrieved."""
+        return self._missing_critical_files
+
+
+def get_node_settings_key(settings, *extra_keys):
+    """
+    Normalize the parser settings that define the output nodes, the `add_<node>` ones, and the extra_keys.
+
+    The other parser settings, e.g. `parse_cache` or `parser_profile`, do not change what is parsed.
+    """
+    node_settings = {key: value for key, value in settings.items() if key.startswith('add_') or key in extra_keys}
+    return json.dumps(node_settings, sort_keys=True, default=str)
+
+
+def get_plan_key(file_parser_set, settings, retrieved_filenames):
+    """Compose the memoization key of a plan from the file parser set, the node settings and the retrieved file names."""
+    return (file_parser_set, get_node_settings_key(settings), frozenset(retrieved_filenames))
+
+
+def get_parser_plan(key, compile_plan):
+    """
+    Return the memoized plan for the key, calling ``compile_plan`` to create it if it does not exist.
+
+    The least recently used plans are dropped once more than ``MAX_PLANS`` are stored.
+    """
+    return _get_memoized(_PLANS, key, compile_plan)
+
+
+def get_output_nodes_dict(settings, compose_output_nodes_dict):
+    """
+    Return the memoized output node definitions of the parser settings, see ParserSettings.
+
+    They depend on the node settings and on the `storage_policies`. The returned definitions are shared,
+    so they must not be modified.
+    """
+    return _get_memoized(_OUTPUT_NODES, get_node_settings_key(settings, 'storage_policies'), compose_output_nodes_dict)
+
+
+def _get_memoized(memo, key, compose):
+    """Return the value of the key in memo, composing it if needed and dropping the least recently used ones."""
+    with _LOCK:
+        value = memo.get(key)
+        if value is not None:
+            memo.move_to_end(key)
+            return value
+    value = compose()
+    with _LOCK:
+        memo[key] = value
+        while len(memo) > MAX_PLANS:
+            memo.popitem(last=False)
+    return value
+
+
+def clear_parser_plans():
+    """
+    Invalidate all memoized plans and output node definitions.
+
+    This is needed when the shared parser definitions are changed at runtime, e.g. by modifying
+    ``FILE_PARSER_SETS``, ``NODES`` or the ``PARSABLE_ITEMS`` of a file parser class. Definitions added to a single
+    parser with ``add_parser_definition`` or ``add_parsable_quantity`` invalidate its plan automatically.
+    """
+    with _LOCK:
+        _PLANS.clear()
+        _OUTPUT_NODES.clear()
+
+
+def get_number_of_parser_plans():
+    """Return the number of memoized plans."""
+    with _LOCK:
+        return len(_PLANS)
@@ -0,0 +1,96 @@
+"""
+Parser profiling.
+
+-----------------
+Helpers to record where the time and memory is spent while parsing. The VaspParser
+collects the records into a ``parser_profile`` output when ``parser_profile`` is set in
+the parser settings.
+"""
+import time
+from contextlib import contextmanager
+
+from aiida_vasp.parsers.file_access import get_source_size
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on all platforms, in which case memory is not recorded.
+    resource = None
+
+
+def get_peak_rss():
+    """Return the peak resident set size of this process in kB or None if it is not available."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextmanager
+def timed(record, key):
+    """Store the wall time spent inside the context in ``record[key]``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[key] = time.perf_counter() - start
+
+
+class ParserProfile(object):  # pylint: disable=useless-object-inheritance
+    """
+    Container of the parser profile.
+
+    Holds one entry per file parser with the construction time, the time spent in each
+    quantity, the size of the file and the increase of the peak resident set size of the
+    process while the file was parsed. Also the time spent composing each output node is
+    recorded. Note that the peak RSS is a process wide quantity, so when files are parsed
+    concurrently the deltas can not be attributed to a single file.
+    """
+
+    def __init__(self):
+        self._file_parsers = []
+        self._node_composers = {}
+        self._start = time.perf_counter()
+
+    @staticmethod
+    def record_file_parser(file_name, file_parser, construction_time, peak_rss_before):
+        """Build the profile entry of a file parser after all of its quantities have been parsed."""
+        peak_rss_after = get_peak_rss()
+        peak_rss_delta = None
+        if peak_rss_before is not None and peak_rss_after is not None:
+            peak_rss_delta = peak_rss_after - peak_rss_before
+        return {
+            'file_name': file_name,
+            'parser_class': file_parser.__class__.__name__,
+            'construction_time': construction_time,
+            'quantity_times': dict(file_parser.quantity_times),
+            'file_size': get_source_size(getattr(file_parser.data_obj, 'path', None) or getattr(file_parser.data_obj, 'handler', None)),
+            'peak_rss_delta': peak_rss_delta,
+        }
+
+    def add_file_parser(self, entry):
+        self._file_parsers.append(entry)
+
+    @contextmanager
+    def compose(self, link_name):
+        """Time the composition of the node with the given link name."""
+        with timed(self._node_composers, link_name):
+            yield
+
+    def get_dict(self):
+        """Return the profile as a dictionary that can be stored in a Dict node."""
+        return {
+            # Sort, as the file parsers might have finished in any order when parsing concurrently.
+            'file_parsers': sorted(self._file_parsers, key=lambda entry: entry['file_name']),
+            'node_composers': self._node_composers,
+            'total_time': time.perf_counter() - self._start,
+        }
+
+    def log(self, logger):
+        """Write a summary of the profile to the logger."""
+        for entry in self._file_parsers:
+            slowest = sorted(entry['quantity_times'].items(), key=lambda item: item[1], reverse=True)
+            logger.info('Parsing {file_name} with {parser_class}: construction {construction_time:.3f} s, '
+                        'file size {file_size} bytes, peak RSS delta {peak_rss_delta} kB, quantities: {quantities}'.format(
+                            quantities=', '.join('{} {:.3f} s'.format(key, value) for key, value in slowest), **entry))
+        for link_name, compose_time in self._node_composers.items():
+            logger.info('Composing {} took {:.3f} s'.format(link_name, compose_time))
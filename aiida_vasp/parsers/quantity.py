@@ -4,6 +4,23 @@ Parser quantity configuration.
 ------------------------------
 Contains the representation of quantities that users want to parse.
 """
+from aiida_vasp.parsers.plan import ParserPlan
+
+SHOW_SCREENING_STEPS = False
+
+
+def _show(var, var_name):
+    """Print an intermediate result of the screening, enabled by SHOW_SCREENING_STEPS."""
+    print('---%s ---' % var_name)
+    if isinstance(var, dict):
+        for key, value in var.items():
+            print(key, value)
+    elif isinstance(var, list):
+        for value in var:
+            print(value)
+    else:
+        print(var)
+    print('---%s ---' % var_name)
 
 
 class ParsableQuantities(object):  # pylint: disable=useless-object-inheritance
@@ -25,6 +42,12 @@ class ParsableQuantities(object):  # pylint: disable=useless-object-inheritance
         self._quantity_items = None
         self._waiting_quantity_items = {}
 
+        self._parser_definitions = None
+        self._file_sizes = None
+        self._requested_candidates = None
+        self._scheduled_quantity_keys = None
+        self._prerequisite_keys = {}
+
     @property
     def quantity_keys_to_parse(self):
         """List of quantity keys to parse after screening"""
@@ -52,47 +75,71 @@ class ParsableQuantities(object):  # pylint: disable=useless-object-inheritance
         """Put parsable quantity in the waiting list"""
         self._waiting_quantity_items[quantity_key] = quantity_dict
 
-    def setup(self, retrieved_filenames=None, parser_definitions=None, quantity_names_to_parse=None):
-        """Set the parsable_quantities dictionary based on parsable_items obtained from the FileParsers."""
-
-        def _show(var, var_name):
-            print('---%s ---' % var_name)
-            if isinstance(var, dict):
-                for key, value in var.items():
-                    print(key, value)
-            elif isinstance(var, list):
-                for value in var:
-                    print(value)
-            else:
-                print(var)
-            print('---%s ---' % var_name)
+    def setup(self, retrieved_filenames=None, parser_definitions=None, quantity_names_to_parse=None, file_sizes=None, plan=None):
+        """
+        Set the parsable_quantities dictionary based on parsable_items obtained from the FileParsers.
+
+        The screening of the parser definitions against the retrieved files is done in ``compile_plan``,
+        unless a precompiled ``plan`` is given. The ``quantity_names_to_parse`` override the ones of the plan.
+        One quantity key is then selected for each requested quantity name, see ``_select_quantity_keys``. The
+        optional ``file_sizes`` (file name -> size in bytes) are used to estimate the cost of the alternatives.
+        The selected quantity keys and their prerequisites are ordered such that prerequisites are always parsed
+        first.
+        """
+        if plan is None:
+            plan = self.compile_plan(retrieved_filenames, parser_definitions, quantity_names_to_parse)
+
+        self._parser_definitions = plan.parser_definitions
+        self._file_sizes = file_sizes if file_sizes is not None else {}
+        self._quantity_items = plan.quantity_items
+        self._quantity_keys_to_filenames = plan.quantity_keys_to_filenames
+        self._equiv_quantity_keys = plan.equivalent_quantity_keys
+        self._missing_filenames = plan.missing_filenames
+
+        if quantity_names_to_parse is None:
+            quantity_names_to_parse = plan.quantity_names_to_parse
+        self._quantity_keys_to_parse = self._select_quantity_keys(plan.parsable_quantity_keys, quantity_names_to_parse, retrieved_filenames)
+        if SHOW_SCREENING_STEPS:
+            _show(quantity_names_to_parse, 'quantity_names_to_parse')
+            _show(self._quantity_keys_to_parse, 'self._quantity_keys_to_parse')
 
-        show_screening_steps = False
+    def compile_plan(self, retrieved_filenames, parser_definitions, quantity_names_to_parse):
+        """
+        Screen the parser definitions against the retrieved files.
 
+        :return: an immutable ParserPlan, which only depends on the arguments and the added parsable quantities.
+        """
         self._quantity_items, self._quantity_keys_to_filenames = self._get_quantity_items_from_definitions(parser_definitions)
-        if show_screening_steps:
+        if SHOW_SCREENING_STEPS:
             _show(self._quantity_items, 'self._quantity_items')
             _show(self._quantity_keys_to_filenames, 'self._quantity_keys_to_filenames')
 
         self._equiv_quantity_keys = self._create_containers_of_equiv_quantity_keys()
-        if show_screening_steps:
+        if SHOW_SCREENING_STEPS:
             _show(self._equiv_quantity_keys, 'self._equiv_quantity_keys')
 
         self._missing_filenames = self._identify_missing_filenames(retrieved_filenames, parser_definitions.keys())
-        if show_screening_steps:
+        if SHOW_SCREENING_STEPS:
             _show(retrieved_filenames, 'retrieved_filenames')
             _show(parser_definitions.keys(), 'parser_definitions.keys()')
             _show(self._missing_filenames, 'self._missing_filenames')
 
         parsable_quantity_keys = self._get_parsable_quantity_keys()
-        if show_screening_steps:
+        if SHOW_SCREENING_STEPS:
             _show(parsable_quantity_keys, 'parsable_quantity_keys')
 
-        self._quantity_keys_to_parse = self._get_quantity_keys_to_parse(parsable_quantity_keys, quantity_names_to_parse,
-                                                                        retrieved_filenames)
-        if show_screening_steps:
-            _show(quantity_names_to_parse, 'quantity_names_to_parse')
-            _show(self._quantity_keys_to_parse, 'self._quantity_keys_to_parse')
+        missing_critical_files = [
+            file_name for file_name, definition in parser_definitions.items()
+            if definition['is_critical'] and file_name not in retrieved_filenames
+        ]
+        return ParserPlan(parser_definitions=parser_definitions,
+                          quantity_items=self._quantity_items,
+                          quantity_keys_to_filenames=self._quantity_keys_to_filenames,
+                          equivalent_quantity_keys=self._equiv_quantity_keys,
+                          missing_filenames=self._missing_filenames,
+                          parsable_quantity_keys=parsable_quantity_keys,
+                          quantity_names_to_parse=quantity_names_to_parse or [],
+                          missing_critical_files=missing_critical_files)
 
     def _get_quantity_items_from_definitions(self, parser_definitions):
         """
@@ -184,32 +231,163 @@ class ParsableQuantities(object):  # pylint: disable=useless-object-inheritance
         _parsable_quantity_keys = []
         for quantity_key, quantity_dict in self._quantity_items.items():
             is_parsable = True
-            if 'prerequisites' in quantity_dict:
-                for prereq in quantity_dict['prerequisites']:
-                    if prereq not in self._quantity_items or prereq in self._missing_filenames:
-                        is_parsable = False
+            for prereq in quantity_dict.get('prerequisites', []):
+                if not self._get_prerequisite_candidates(prereq):
+                    is_parsable = False
             if is_parsable and quantity_key not in self._missing_filenames:
                 _parsable_quantity_keys.append(quantity_key)
         return _parsable_quantity_keys
 
-    def _get_quantity_keys_to_parse(self, parsable_quantity_keys, quantity_names_to_parse, retrieve_filenames):
-        """Collect quantity_names_to_parse"""
-        _quantity_keys_to_parse = []
+    def _select_quantity_keys(self, parsable_quantity_keys, quantity_names_to_parse, retrieve_filenames):
+        """
+        Select one quantity key for each of the requested quantity names.
+
+        The quantity names without alternatives are selected first, which determines the files that
+        have to be parsed in any case. For the remaining quantity names the cheapest candidate is chosen,
+        where the cost is the size of the files that would additionally have to be parsed (including
+        prerequisites), weighted by the PARSE_COST of their file parsers. Ties are broken by the order
+        of the equivalent quantity keys. Candidates marked with `'fallback': True` are only chosen if no
+        other candidate is parsable. The candidates that are not selected are kept as fallbacks.
+
+        :return: list of the selected quantity keys and their prerequisites in topological order.
+        """
+        self._requested_candidates = {}
+        self._prerequisite_keys = {}
         for quantity_name in quantity_names_to_parse:
             if quantity_name in self._equiv_quantity_keys:
-                is_parsable = False
-                for quantity_key in self._equiv_quantity_keys[quantity_name]:
-                    if quantity_key in parsable_quantity_keys:
-                        _quantity_keys_to_parse.append(quantity_key)
-                        is_parsable = True
-                if not is_parsable:
+                candidates = [key for key in self._equiv_quantity_keys[quantity_name] if key in parsable_quantity_keys]
+                if not candidates:
                     self._issue_warning(retrieve_filenames, quantity_name)
+                    continue
+                self._requested_candidates[quantity_name] = candidates
             else:
                 self._vasp_parser_logger.warning('{quantity} has been requested, '
                                                  'however its parser has not been implemented. '
                                                  'Please check the docstrings in aiida_vasp.parsers.vasp.py '
                                                  'for valid input.'.format(quantity=quantity_name))
-        return _quantity_keys_to_parse
+
+        selected = []
+        for candidates in self._requested_candidates.values():
+            if len(candidates) == 1:
+                self._add_with_prerequisites(candidates[0], selected)
+        for candidates in self._requested_candidates.values():
+            if len(candidates) > 1:
+                required_files = {self._quantity_keys_to_filenames[key] for key in selected}
+                ranks = [(self._quantity_items[key].get('fallback', False), self._get_cost(key, required_files), index, key)
+                         for index, key in enumerate(candidates)]
+                quantity_key = min(ranks)[-1]
+                self._add_with_prerequisites(quantity_key, selected)
+
+        self._scheduled_quantity_keys = set(selected)
+        return [key for level in self.get_parse_levels(selected) for key in level]
+
+    def _add_with_prerequisites(self, quantity_key, selected):
+        """Add a quantity key after its prerequisites to the list of selected quantity keys."""
+        for prerequisite in self._get_prerequisite_keys(quantity_key, selected):
+            if prerequisite not in selected:
+                self._add_with_prerequisites(prerequisite, selected)
+        if quantity_key not in selected:
+            selected.append(quantity_key)
+
+    def _get_prerequisite_candidates(self, prerequisite):
+        """Return the quantity keys that can provide a prerequisite, which is either a quantity key or name."""
+        candidates = [prerequisite] if prerequisite in self._quantity_items else []
+        candidates += [key for key in self._equiv_quantity_keys.get(prerequisite, []) if key not in candidates]
+        return [key for key in candidates if key not in self._missing_filenames]
+
+    def _get_prerequisite_keys(self, quantity_key, selected=None):
+        """
+        Resolve the prerequisites of a quantity key to quantity keys.
+
+        A prerequisite that is already resolved is kept. Otherwise a candidate that is already selected
+        is preferred, followed by the first available candidate.
+        """
+        if quantity_key in self._prerequisite_keys:
+            return self._prerequisite_keys[quantity_key]
+        prerequisite_keys = []
+        for prerequisite in self._quantity_items[quantity_key].get('prerequisites', []):
+            candidates = self._get_prerequisite_candidates(prerequisite)
+            if not candidates:
+                continue
+            chosen = [key for key in candidates if selected is not None and key in selected]
+            prerequisite_keys.append((chosen or candidates)[0])
+        if selected is not None:
+            self._prerequisite_keys[quantity_key] = prerequisite_keys
+        return prerequisite_keys
+
+    def _get_cost(self, quantity_key, required_files, visited=None):
+        """Estimate the cost of parsing a quantity key in addition to the files that are already required."""
+        if visited is None:
+            visited = set()
+        visited.add(quantity_key)
+        file_name = self._quantity_keys_to_filenames[quantity_key]
+        cost = 0.0
+        if file_name not in required_files:
+            parser_class = self._parser_definitions[file_name]['parser_class']
+            cost = getattr(parser_class, 'PARSE_COST', 1.0) * self._file_sizes.get(file_name, 0)
+            required_files = required_files | {file_name}
+        for prerequisite in self._get_prerequisite_keys(quantity_key):
+            if prerequisite not in visited:
+                cost += self._get_cost(prerequisite, required_files, visited)
+        return cost
+
+    def get_parse_levels(self, quantity_keys):
+        """
+        Split the quantity keys into levels.
+
+        The quantity keys of a level only depend on quantity keys of earlier levels (or on quantities
+        that are not part of ``quantity_keys``, which are assumed to be parsed already). The order of the
+        quantity keys is kept within each level.
+        """
+        depths = {}
+
+        def _depth(quantity_key):
+            if quantity_key in depths:
+                if depths[quantity_key] is None:
+                    raise RuntimeError('The prerequisites of the quantity {quantity} are circular.'.format(quantity=quantity_key))
+                return depths[quantity_key]
+            depths[quantity_key] = None
+            prerequisite_depths = [_depth(key) for key in self._get_prerequisite_keys(quantity_key) if key in quantity_keys]
+            depths[quantity_key] = max(prerequisite_depths, default=-1) + 1
+            return depths[quantity_key]
+
+        for quantity_key in quantity_keys:
+            _depth(quantity_key)
+        if not depths:
+            return []
+        return [[key for key in quantity_keys if depths[key] == depth] for depth in range(max(depths.values()) + 1)]
+
+    def get_inputs(self, quantity_key, parsed_quantities):
+        """Collect the inputs of a quantity key from the already parsed quantities."""
+        inputs = {}
+        for input_name in self._quantity_items[quantity_key].get('inputs', []):
+            if input_name in parsed_quantities:
+                inputs[input_name] = parsed_quantities[input_name]
+                continue
+            for equivalent_key in self._equiv_quantity_keys.get(input_name, []):
+                if equivalent_key in parsed_quantities:
+                    inputs[input_name] = parsed_quantities[equivalent_key]
+                    break
+        return inputs
+
+    def get_fallback_quantity_keys(self, parsed_quantities):
+        """
+        Return the quantity keys to parse for requested quantities that could not be parsed.
+
+        For each requested quantity name where none of the parsed quantity keys yielded a result, the next
+        candidate that has not been scheduled yet is selected. The returned quantity keys (including
+        prerequisites) are in topological order and are marked as scheduled.
+        """
+        selected = []
+        for candidates in self._requested_candidates.values():
+            if any(key in parsed_quantities for key in candidates):
+                continue
+            remaining = [key for key in candidates if key not in self._scheduled_quantity_keys]
+            if remaining:
+                self._add_with_prerequisites(remaining[0], selected)
+        selected = [key for key in selected if key not in self._scheduled_quantity_keys]
+        self._scheduled_quantity_keys.update(selected)
+        return [key for level in self.get_parse_levels(selected) for key in level]
 
     def _issue_warning(self, retrieve_filenames, quantity_name):
         """
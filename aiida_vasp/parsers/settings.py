@@ -16,6 +16,8 @@ from aiida_vasp.parsers.file_parsers.chgcar import ChgcarParser
 from aiida_vasp.parsers.file_parsers.wavecar import WavecarParser
 from aiida_vasp.parsers.file_parsers.poscar import PoscarParser
 from aiida_vasp.parsers.file_parsers.stream import StreamParser
+from aiida_vasp.parsers.node_composer import StoragePolicy
+from aiida_vasp.parsers.plan import get_output_nodes_dict
 
 FILE_PARSER_SETS = {
     'default': {
@@ -164,6 +166,11 @@ NODES = {
         'type': 'dict',
         'quantities': ['site_magnetization'],
     },
+    'performance_profile': {
+        'link_name': 'performance_profile',
+        'type': 'dict',
+        'quantities': ['performance_profile'],
+    },
 }
 
 
@@ -172,12 +179,17 @@ class ParserDefinitions(object):  # pylint: disable=useless-object-inheritance
 
     def __init__(self, file_parser_set='default'):
         self._parser_definitions = {}
+        self._file_parser_set = file_parser_set
         self._init_parser_definitions(file_parser_set)
 
     @property
     def parser_definitions(self):
         return self._parser_definitions
 
+    @property
+    def file_parser_set(self):
+        return self._file_parser_set
+
     def add_parser_definition(self, filename, parser_dict):
         """Add custum parser definition"""
         self._parser_definitions[filename] = parser_dict
@@ -196,6 +208,8 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
 
     :param settings: Dict with the 'parser_settings'.
     :param default_settings: Dict with default settings.
+    :param shared_nodes: use the memoized output node definitions shared by all settings with the same
+        node settings, instead of composing them. They are copied before a node is added.
 
     This provides the following properties to other components of the VaspParser:
 
@@ -205,7 +219,7 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
 
     """
 
-    def __init__(self, settings, default_settings=None):
+    def __init__(self, settings, default_settings=None, shared_nodes=False):
         if settings is None:
             self._settings = {}
         else:
@@ -213,8 +227,11 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
         if default_settings is not None:
             self._update_with(default_settings)
 
-        self._output_nodes_dict = {}
-        self._init_output_nodes_dict()
+        self._shared_nodes = shared_nodes
+        if shared_nodes:
+            self._output_nodes_dict = get_output_nodes_dict(self, self._compose_output_nodes_dict)
+        else:
+            self._output_nodes_dict = self._compose_output_nodes_dict()
 
     @property
     def output_nodes_dict(self):
@@ -237,19 +254,23 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
             # Try to get a node_dict from NODES.
             node_dict = deepcopy(NODES.get(node_name, {}))
 
-        # Check, whether the node_dict contains required keys 'type' and 'quantities'
-        for key in ['type', 'quantities']:
-            if node_dict.get(key) is None:
-                return
+        if not self._is_complete(node_dict):
+            return
 
+        if self._shared_nodes:
+            self._output_nodes_dict = deepcopy(self._output_nodes_dict)
+            self._shared_nodes = False
         self._output_nodes_dict[node_name] = node_dict
 
     def get(self, item, default=None):
         return self._settings.get(item, default)
 
-    def _init_output_nodes_dict(self):
+    def items(self):
+        return self._settings.items()
+
+    def _compose_output_nodes_dict(self):
         """
-        Set the 'nodes' card of a settings object.
+        Compose the 'nodes' card of a settings object.
 
         Nodes can be added by setting:
 
@@ -269,7 +290,7 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
 
                 'add_custom_node': {'type': 'parameter', 'quantities': ['efermi', 'forces'], 'link_name': 'my_custom_node'}
         """
-        self._output_nodes_dict = {}
+        output_nodes_dict = {}
 
         # First, find all the nodes, that should be added.
         for key, value in self._settings.items():
@@ -292,7 +313,18 @@ class ParserSettings(object):  # pylint: disable=useless-object-inheritance
             if 'link_name' not in node_dict:
                 node_dict['link_name'] = node_name
 
-            self.add_output_node(node_name, node_dict)
+            storage_policy = (self._settings.get('storage_policies') or {}).get(node_name)
+            if storage_policy and node_dict.get('type') == 'array':
+                node_dict['storage_policy'] = StoragePolicy.from_dict(storage_policy)
+
+            if self._is_complete(node_dict):
+                output_nodes_dict[node_name] = node_dict
+        return output_nodes_dict
+
+    @staticmethod
+    def _is_complete(node_dict):
+        """Check, whether the node_dict contains the required keys 'type' and 'quantities'."""
+        return all(node_dict.get(key) is not None for key in ['type', 'quantities'])
 
     def _update_with(self, update_dict):
         """Selectively update keys from one Dictionary to another."""
@@ -0,0 +1,71 @@
+"""Test the access to retrieved files through paths and handles."""
+# pylint: disable=unused-import,redefined-outer-name,unused-argument,unused-wildcard-import,wildcard-import
+import io
+import logging
+import os
+
+import numpy as np
+
+from aiida_vasp.utils.fixtures import *
+from aiida_vasp.utils.fixtures.testdata import data_path
+from aiida_vasp.parsers.file_access import RetrievedFiles, open_source, get_source_size
+from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+from aiida_vasp.parsers.triage import FINISHED, triage_run
+
+
+class HandleFolder(object):  # pylint: disable=useless-object-inheritance
+    """A retrieved folder that only gives access to its files through in-memory handles."""
+
+    def __init__(self, folder):
+        self._folder = folder
+
+    def open(self, file_name, mode='rb'):
+        with open(os.path.join(self._folder, file_name), mode) as handler:
+            return io.BytesIO(handler.read())
+
+
+def test_open_source():
+    """Paths and handles are read from their start, also in text mode."""
+    handle = io.BytesIO(b'line 1\nline 2\n')
+    handle.seek(5)
+    with open_source(handle, 'r') as text:
+        assert text.readlines() == ['line 1\n', 'line 2\n']
+    assert not handle.closed
+    assert get_source_size(handle) == 14
+    assert get_source_size(data_path('basic_run', 'OUTCAR')) == os.path.getsize(data_path('basic_run', 'OUTCAR'))
+
+
+def test_retrieved_files_handles():
+    """Files that are not on the file system are given as handles and only copied when a path is requested."""
+    folder = data_path('basic_run')
+    retrieved_content = {file_name: {'path': '', 'status': 'permanent'} for file_name in os.listdir(folder)}
+    files = RetrievedFiles(HandleFolder(folder), retrieved_content, logging.getLogger(__name__))
+    source = files.get_source('OUTCAR')
+    assert not isinstance(source, str)
+    assert files.get_source('OUTCAR') is source
+    assert files.get_source('WAVECAR_missing') is None
+
+    sources = {file_name: files.get_source(file_name) for file_name in ['vasprun.xml', 'OUTCAR', 'vasp_output']}
+    assert triage_run(sources).status == FINISHED
+
+    path = files.get_path('OUTCAR')
+    assert files.get_path('OUTCAR') == path
+    with open(path, 'rb') as handler, open(data_path('basic_run', 'OUTCAR'), 'rb') as reference:
+        assert handler.read() == reference.read()
+    files.close()
+    assert not os.path.exists(path)
+
+
+def test_file_parsers_with_handler(fresh_aiida_env):
+    """The file parsers give the same quantities when they read from a handle."""
+    for parser_cls, file_name, quantity in [(VasprunParser, 'vasprun.xml', 'energies'), (OutcarParser, 'OUTCAR', 'run_stats')]:
+        from_path = parser_cls(file_path=data_path('basic_run', file_name)).get_quantity(quantity)
+        with open(data_path('basic_run', file_name), 'rb') as handler:
+            from_handler = parser_cls(file_handler=handler).get_quantity(quantity)
+        assert from_path.keys() == from_handler.keys()
+        for key, value in from_path.items():
+            if isinstance(value, np.ndarray):
+                assert np.allclose(value, from_handler[key])
+            else:
+                assert value == from_handler[key]
@@ -0,0 +1,102 @@
+"""Test the parse result cache."""
+# pylint: disable=unused-import,redefined-outer-name,unused-argument,unused-wildcard-import,wildcard-import,protected-access
+import os
+
+import numpy as np
+
+from aiida_vasp.parsers.cache import ParseCache, get_parse_cache, hash_file, is_cacheable
+from aiida_vasp.parsers.file_parsers.vasprun import VasprunParser
+from aiida_vasp.parsers.file_parsers.outcar import OutcarParser
+from aiida_vasp.parsers.settings import ParserSettings
+from aiida_vasp.utils.fixtures.testdata import data_path
+
+
+def test_get_parse_cache(tmp_path):
+    """Test that the cache is only enabled when requested."""
+    assert get_parse_cache(ParserSettings({})) is None
+    cache = get_parse_cache(ParserSettings({'parse_cache': {'directory': str(tmp_path), 'max_size': 1}}))
+    assert cache.directory == str(tmp_path)
+
+
+def test_cache_key():
+    """Test that the key depends on the file content, file parser, quantity and relevant settings."""
+    file_hash = hash_file(data_path('basic', 'vasprun.xml'))
+    settings = ParserSettings({'energy_type': ['energy_free']})
+    key = ParseCache.get_key(file_hash, VasprunParser, 'energies', settings)
+    assert key == ParseCache.get_key(file_hash, VasprunParser, 'energies', ParserSettings({'energy_type': ['energy_free']}))
+    # Adding nodes or enabling the cache does not change the key
+    assert key == ParseCache.get_key(file_hash, VasprunParser, 'energies',
+                                     ParserSettings({
+                                         'energy_type': ['energy_free'],
+                                         'add_trajectory': True,
+                                         'parse_cache': True
+                                     }))
+    assert key != ParseCache.get_key(file_hash, VasprunParser, 'energies', ParserSettings({'energy_type': ['energy_extrapolated']}))
+    assert key != ParseCache.get_key(file_hash, VasprunParser, 'total_energies', settings)
+    assert key != ParseCache.get_key(file_hash, OutcarParser, 'energies', settings)
+    assert key != ParseCache.get_key(hash_file(data_path('relax', 'vasprun.xml')), VasprunParser, 'energies', settings)
+
+
+def test_cache_key_versions(monkeypatch):
+    """Test that the key changes with the format version of the file parser and the version of parsevasp."""
+    import parsevasp
+    file_hash = hash_file(data_path('basic', 'vasprun.xml'))
+    settings = ParserSettings({})
+    key = ParseCache.get_key(file_hash, VasprunParser, 'energies', settings)
+
+    class ChangedVasprunParser(VasprunParser):
+        FORMAT_VERSION = VasprunParser.FORMAT_VERSION + 1
+
+    # Only the format version differs from VasprunParser in the key
+    ChangedVasprunParser.__module__ = VasprunParser.__module__
+    ChangedVasprunParser.__name__ = VasprunParser.__name__
+    assert key != ParseCache.get_key(file_hash, ChangedVasprunParser, 'energies', settings)
+    monkeypatch.setattr(parsevasp, '__version__', parsevasp.__version__ + '.post1')
+    assert key != ParseCache.get_key(file_hash, VasprunParser, 'energies', settings)
+
+
+def test_cache_put_get(tmp_path):
+    """Test storing and fetching entries."""
+    cache = ParseCache(directory=str(tmp_path))
+    assert cache.get('missing') == (False, None)
+    payload = ({'energies': np.arange(3.0), 'steps': 3}, None)
+    assert cache.put('key', payload)
+    hit, cached = cache.get('key')
+    assert hit
+    np.testing.assert_allclose(cached[0]['energies'], payload[0]['energies'])
+    assert cached[0]['steps'] == 3
+    # Also negative results are cached
+    cache.put('none', (None, None))
+    assert cache.get('none') == (True, (None, None))
+
+
+def test_cache_eviction(tmp_path):
+    """Test that the least recently used entries are evicted first."""
+    cache = ParseCache(directory=str(tmp_path), max_size=0.01)
+    for index in range(3):
+        cache.put('key{}'.format(index), np.zeros(512))
+        os.utime(os.path.join(str(tmp_path), 'key{}.pkl'.format(index)), (index, index))
+    # Mark the oldest as recently used
+    cache.get('key0')
+    cache.evict()
+    assert cache.size() <= 0.01 * 1024 * 1024
+    assert cache.get('key0')[0]
+    assert not cache.get('key1')[0]
+
+
+def test_cache_eviction_due(tmp_path):
+    """Test that the cache is only evicted after writing entries and not again within the eviction interval."""
+    cache = ParseCache(directory=str(tmp_path), max_size=0.01)
+    assert not cache.evict_if_due()
+    for index in range(3):
+        cache.put('key{}'.format(index), np.zeros(512))
+    assert cache.evict_if_due()
+    assert cache.size() <= 0.01 * 1024 * 1024
+    cache.put('key3', np.zeros(512))
+    assert not cache.evict_if_due()
+
+
+def test_is_cacheable():
+    """Test that only plain python and numpy payloads are cached."""
+    assert is_cacheable({'a': [1, 2.0, 'b', None], 'c': np.zeros(2), 'd': np.float64(1.0)})
+    assert not is_cacheable({'a': object()})
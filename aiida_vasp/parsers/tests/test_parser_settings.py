@@ -15,3 +15,23 @@ def test_settings_utils():
     assert len(settings.output_nodes_dict) == 1 and 'wavecar' in settings.output_nodes_dict
     settings = ParserSettings(SETTINGS, DEFAULT_OPTIONS)
     assert 'wavecar' in settings.output_nodes_dict
+
+
+def test_storage_policies():
+    settings = ParserSettings({
+        'add_projectors': True,
+        'add_structure': True,
+        'storage_policies': {
+            'projectors': {
+                'dtype': 'float32',
+                'compress': True
+            },
+            'structure': {
+                'dtype': 'float32'
+            }
+        }
+    })
+    policy = settings.output_nodes_dict['projectors']['storage_policy']
+    assert policy.dtype == 'float32' and policy.compress and policy.node_type == 'vasp.compressed_array'
+    # Policies only apply to nodes of type 'array'
+    assert 'storage_policy' not in settings.output_nodes_dict['structure']
@@ -0,0 +1,48 @@
+"""Test the triage of VASP runs."""
+import shutil
+
+from aiida_vasp.parsers.triage import FINISHED, TRUNCATED, CRASHED, triage_run, is_vasprun_closed, has_outcar_timing
+from aiida_vasp.utils.fixtures.testdata import data_path
+
+
+def test_finished():
+    """A run with complete output files is finished."""
+    file_paths = {file_name: data_path('basic_run', file_name) for file_name in ['vasprun.xml', 'OUTCAR', 'vasp_output']}
+    triage = triage_run(file_paths)
+    assert triage.status == FINISHED
+    assert not triage.failed
+
+
+def test_truncated(tmp_path):
+    """Missing closing tags or timing blocks mark the run as truncated."""
+    assert not is_vasprun_closed(data_path('relax-truncated', 'vasprun.xml'))
+    outcar = tmp_path / 'OUTCAR'
+    with open(data_path('basic_run', 'OUTCAR'), 'r') as handler:
+        lines = handler.readlines()
+    outcar.write_text(''.join(lines[:len(lines) // 2]))
+    assert not has_outcar_timing(str(outcar))
+
+    triage = triage_run({'vasprun.xml': data_path('relax-truncated', 'vasprun.xml'), 'OUTCAR': str(outcar)})
+    assert triage.status == TRUNCATED
+    assert triage.truncated_files == ['vasprun.xml', 'OUTCAR']
+    assert triage.run_status['finished'] is False
+    assert 'trajectory' not in triage.get_salvage_quantities()
+    assert 'trajectory' in triage.get_salvage_quantities(salvage_ionic_steps=True)
+    assert triage.get_salvage_run_status({'recovered_ionic_steps': 18})['recovered_ionic_steps'] == 18
+
+
+def test_crashed(tmp_path):
+    """Unrecoverable errors in the standard stream together with truncated output files mark the run as crashed."""
+    vasp_output = tmp_path / 'vasp_output'
+    shutil.copy(data_path('basic_run', 'vasp_output'), str(vasp_output))
+    with open(str(vasp_output), 'a') as handler:
+        handler.write(' BRMIX: very serious problems\n')
+    triage = triage_run({'vasprun.xml': data_path('relax-truncated', 'vasprun.xml'), 'vasp_output': str(vasp_output)})
+    assert triage.status == CRASHED
+    assert triage.errors == ['brmix']
+    assert triage.truncated_files == ['vasprun.xml']
+
+    # With complete output files, the errors are left to the notifications
+    triage = triage_run({'vasprun.xml': data_path('basic_run', 'vasprun.xml'), 'vasp_output': str(vasp_output)})
+    assert triage.status == FINISHED
+    assert not triage.errors
@@ -454,3 +454,254 @@ def test_stream_history(request, calc_with_retrieved):
     assert misc_dict['notifications'][2]['regex'] == 'I AM A WELL DEFINED ERROR'
     for item in misc_dict['notifications']:
         assert item['kind'] != 'WARNING'
+
+
+def test_file_parser_instances(request, calc_with_retrieved):
+    """Test that only one file parser instance is constructed per retrieved file."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'add_bands': True, 'add_kpoints': True, 'add_trajectory': True}}
+
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+
+    node = calc_with_retrieved(file_path, settings_dict)
+
+    parser = ParserFactory('vasp.vasp')(node)
+    parser.parse(retrieved_temporary_folder=file_path)
+    file_names = {
+        parser._parsable_quantities.quantity_keys_to_filenames[key] for key in parser._parsable_quantities.quantity_keys_to_parse
+    }
+    assert parser.file_parser_instances == len(file_names)
+
+
+@pytest.mark.parametrize('parallel_files', [True, 2])
+def test_parallel_files(parallel_files, request, calc_with_retrieved):
+    """Test that parsing the files concurrently gives the same result as parsing them one after another."""
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+    parser_cls = ParserFactory('vasp.vasp')
+
+    results = []
+    exit_codes = []
+    for parallel in [False, parallel_files]:
+        settings_dict = {'parser_settings': {'add_misc': True, 'add_bands': True, 'add_kpoints': True, 'parallel_files': parallel}}
+        node = calc_with_retrieved(file_path, settings_dict)
+        result, calcfunction = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+        results.append(result)
+        exit_codes.append(calcfunction.exit_status)
+
+    assert exit_codes[0] == exit_codes[1]
+    assert set(results[0].keys()) == set(results[1].keys())
+    misc_serial = results[0]['misc'].get_dict()
+    misc_parallel = results[1]['misc'].get_dict()
+    assert misc_serial == misc_parallel
+    np.testing.assert_allclose(results[0]['bands'].get_bands(), results[1]['bands'].get_bands())
+
+
+def test_parser_profile(request, calc_with_retrieved):
+    """Test that the parser profile is attached when requested."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'add_kpoints': True, 'parser_profile': True}}
+
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+
+    node = calc_with_retrieved(file_path, settings_dict)
+
+    parser_cls = ParserFactory('vasp.vasp')
+    result, _ = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+
+    profile = result['parser_profile'].get_dict()
+    file_names = [entry['file_name'] for entry in profile['file_parsers']]
+    assert 'vasprun.xml' in file_names
+    vasprun_entry = profile['file_parsers'][file_names.index('vasprun.xml')]
+    assert vasprun_entry['parser_class'] == 'VasprunParser'
+    assert vasprun_entry['construction_time'] >= 0
+    assert vasprun_entry['file_size'] == os.path.getsize(os.path.join(file_path, 'vasprun.xml'))
+    assert 'kpoints' in vasprun_entry['quantity_times']
+    assert set(profile['node_composers']) == {'misc', 'kpoints'}
+    assert profile['total_time'] > 0
+
+
+def test_parse_cache(request, calc_with_retrieved, tmp_path):
+    """Test that re-parsing the same files is served from the parse cache."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'parse_cache': {'directory': str(tmp_path)}}}
+
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+
+    results = []
+    for _ in range(2):
+        node = calc_with_retrieved(file_path, settings_dict)
+        parser = ParserFactory('vasp.vasp')(node)
+        parser.parse(retrieved_temporary_folder=file_path)
+        results.append((parser.file_parser_instances, parser.outputs['misc'].get_dict()))
+
+    assert results[0][0] > 0
+    # All misc quantities are found in the cache, so no file parser is constructed
+    assert results[1][0] == 0
+    assert results[0][1] == results[1][1]
+
+
+def _setup_parsable_quantities(retrieved_filenames, quantity_names_to_parse, file_sizes=None):
+    """Return ParsableQuantities set up with the default parser definitions."""
+    import logging
+    from aiida_vasp.parsers.quantity import ParsableQuantities
+    from aiida_vasp.parsers.settings import ParserDefinitions
+    quantities = ParsableQuantities(vasp_parser_logger=logging.getLogger(__name__))
+    quantities.setup(retrieved_filenames=retrieved_filenames,
+                     parser_definitions=ParserDefinitions().parser_definitions,
+                     quantity_names_to_parse=quantity_names_to_parse,
+                     file_sizes=file_sizes)
+    return quantities
+
+
+def test_quantity_selection():
+    """Test that one quantity key is selected per quantity name, preferring files that are parsed anyway."""
+    file_sizes = {'vasprun.xml': 1000, 'EIGENVAL': 100, 'CONTCAR': 10, 'OUTCAR': 100}
+    quantities = _setup_parsable_quantities(['vasprun.xml', 'EIGENVAL', 'CONTCAR', 'OUTCAR'], ['version', 'eigenvalues', 'structure'],
+                                            file_sizes)
+    # vasprun.xml has to be parsed for the version, so it is also used for the alternatives
+    assert quantities.quantity_keys_to_parse == ['version', 'eigenvalues', 'structure']
+
+    quantities = _setup_parsable_quantities(['vasprun.xml', 'EIGENVAL', 'CONTCAR', 'OUTCAR'], ['eigenvalues', 'structure'], file_sizes)
+    # Otherwise the cheapest alternatives are chosen
+    assert quantities.quantity_keys_to_parse == ['eigenval-eigenvalues', 'poscar-structure']
+
+
+def test_quantity_prerequisites():
+    """Test that prerequisites are parsed first, once, and passed as inputs."""
+    quantities = _setup_parsable_quantities(['EIGENVAL', 'CONTCAR'], ['kpoints', 'structure'], {'EIGENVAL': 100, 'CONTCAR': 10})
+    assert quantities.quantity_keys_to_parse == ['poscar-structure', 'eigenval-kpoints']
+    assert quantities.get_parse_levels(quantities.quantity_keys_to_parse) == [['poscar-structure'], ['eigenval-kpoints']]
+    assert quantities.get_inputs('eigenval-kpoints', {'poscar-structure': 'structure'}) == {'structure': 'structure'}
+
+
+def test_quantity_fallback():
+    """Test that alternatives are scheduled if the selected quantity key could not be parsed."""
+    quantities = _setup_parsable_quantities(['vasprun.xml', 'EIGENVAL'], ['version', 'eigenvalues'], {'vasprun.xml': 1000, 'EIGENVAL': 100})
+    assert quantities.quantity_keys_to_parse == ['version', 'eigenvalues']
+    assert quantities.get_fallback_quantity_keys({'version': '5.4.4'}) == ['eigenval-eigenvalues']
+    # Every alternative is only tried once
+    assert quantities.get_fallback_quantity_keys({'version': '5.4.4'}) == []
+
+
+def test_quantity_marked_fallback():
+    """Test that the trajectory is only read from OUTCAR if it can not be read from vasprun.xml."""
+    file_sizes = {'vasprun.xml': 1000, 'OUTCAR': 100}
+    # OUTCAR is parsed anyway for the symmetries, but the OUTCAR trajectory is marked as a fallback
+    quantities = _setup_parsable_quantities(['vasprun.xml', 'OUTCAR'], ['symmetries', 'trajectory'], file_sizes)
+    assert 'trajectory' in quantities.quantity_keys_to_parse
+    assert quantities.get_fallback_quantity_keys({'symmetries': {}}) == ['outcar-trajectory']
+
+    quantities = _setup_parsable_quantities(['OUTCAR'], ['trajectory'], file_sizes)
+    assert quantities.quantity_keys_to_parse == ['outcar-trajectory']
+
+
+def test_parser_plan_memoized(request, calc_with_retrieved):
+    """Test that parsers with the same settings and retrieved files share one plan, unless definitions are added."""
+    from aiida_vasp.parsers.plan import clear_parser_plans, get_number_of_parser_plans
+    settings_dict = {'parser_settings': {'add_misc': True}}
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+
+    clear_parser_plans()
+    parsers = []
+    for _ in range(2):
+        node = calc_with_retrieved(file_path, settings_dict)
+        parser = ParserFactory('vasp.vasp')(node)
+        parser.parse(retrieved_temporary_folder=file_path)
+        parsers.append(parser)
+    assert get_number_of_parser_plans() == 1
+    assert parsers[0]._parsable_quantities.quantity_keys_to_filenames is parsers[1]._parsable_quantities.quantity_keys_to_filenames
+
+    # Added definitions are not shared with other parsers
+    node = calc_with_retrieved(file_path, settings_dict)
+    parser = ParserFactory('vasp.vasp')(node)
+    parser.add_parser_definition('_scheduler-stderr.txt', {'parser_class': ExampleFileParser, 'is_critical': False})
+    parser.parse(retrieved_temporary_folder=file_path)
+    assert get_number_of_parser_plans() == 1
+    assert 'quantity1' in parser._parsable_quantities.quantity_keys_to_filenames
+    assert 'quantity1' not in parsers[0]._parsable_quantities.quantity_keys_to_filenames
+
+    clear_parser_plans()
+    assert get_number_of_parser_plans() == 0
+
+
+def test_parser_plan_key(request, calc_with_retrieved):
+    """Test that the plan and the output nodes are shared by parsers that only differ in settings unrelated to the nodes."""
+    from aiida_vasp.parsers.plan import clear_parser_plans, get_number_of_parser_plans
+    file_path = str(request.fspath.join('..') + '../../../test_data/basic_run')
+
+    clear_parser_plans()
+    parsers = []
+    for parser_settings in [{'add_misc': True}, {'add_misc': True, 'parser_profile': True, 'parse_cache': False}]:
+        node = calc_with_retrieved(file_path, {'parser_settings': parser_settings})
+        parser = ParserFactory('vasp.vasp')(node)
+        parser.parse(retrieved_temporary_folder=file_path)
+        parsers.append(parser)
+    assert get_number_of_parser_plans() == 1
+    assert parsers[0]._settings.output_nodes_dict is parsers[1]._settings.output_nodes_dict
+    assert parsers[0]._definitions is None
+
+    node = calc_with_retrieved(file_path, {'parser_settings': {'add_misc': True, 'add_bands': True}})
+    ParserFactory('vasp.vasp')(node).parse(retrieved_temporary_folder=file_path)
+    assert get_number_of_parser_plans() == 2
+    clear_parser_plans()
+
+
+def test_max_parse_memory(request, calc_with_retrieved):
+    """Test that quantities exceeding max_parse_memory are skipped instead of parsed."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'add_trajectory': True, 'add_kpoints': True, 'max_parse_memory': 0.02}}
+    file_path = str(request.fspath.join('..') + '../../../test_data/relax')
+
+    node = calc_with_retrieved(file_path, settings_dict)
+    parser_cls = ParserFactory('vasp.vasp')
+    result, calcfunction = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+
+    # The trajectory is estimated to 41 kB, the kpoints are well below the budget
+    assert 'trajectory' not in result
+    assert 'kpoints' in result
+    assert 'misc' in result
+    assert calcfunction.exit_status == node.process_class.exit_codes.ERROR_QUANTITY_EXCEEDS_MEMORY_BUDGET.status
+
+
+def test_triage_truncated(request, calc_with_retrieved):
+    """Test that only the salvage set is parsed for a truncated run."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'add_trajectory': True, 'add_structure': True}}
+    file_path = str(request.fspath.join('..') + '../../../test_data/relax-truncated')
+
+    node = calc_with_retrieved(file_path, settings_dict)
+    parser_cls = ParserFactory('vasp.vasp')
+    result, calcfunction = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+
+    assert calcfunction.exit_status == node.process_class.exit_codes.ERROR_VASP_OUTPUT_TRUNCATED.status
+    assert set(result.keys()) == {'misc'}
+    assert result['misc'].get_dict()['run_status']['triage'] == 'truncated'
+
+    settings_dict['parser_settings']['triage'] = False
+    node = calc_with_retrieved(file_path, settings_dict)
+    result, calcfunction = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+    assert 'trajectory' in result
+
+
+def test_salvage_ionic_steps(request, calc_with_retrieved):
+    """Test that the completed ionic steps of a truncated run are kept with salvage_ionic_steps."""
+    settings_dict = {'parser_settings': {'add_misc': True, 'add_trajectory': True, 'add_structure': True, 'salvage_ionic_steps': True}}
+    file_path = str(request.fspath.join('..') + '../../../test_data/relax-truncated')
+
+    node = calc_with_retrieved(file_path, settings_dict)
+    parser_cls = ParserFactory('vasp.vasp')
+    result, calcfunction = parser_cls.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=file_path)
+
+    assert calcfunction.exit_status == node.process_class.exit_codes.ERROR_VASP_OUTPUT_TRUNCATED.status
+    assert set(result.keys()) == {'misc', 'trajectory', 'structure'}
+    assert result['trajectory'].get_array('positions').shape[0] == 18
+    run_status = result['misc'].get_dict()['run_status']
+    assert run_status['triage'] == 'truncated'
+    assert run_status['recovered_ionic_steps'] == 18
+
+
+def test_structure_sites(fresh_aiida_env):
+    """Test that the sites of a composed structure are validated."""
+    from aiida_vasp.parsers.node_composer import set_structure_sites
+    structure = get_data_class('structure')(cell=np.eye(3).tolist())
+    set_structure_sites(structure, [[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]], ['Si', 'Si'], ['Si', 'Si'])
+    assert structure.get_kind_names() == ['Si']
+    assert [site.position for site in structure.sites] == [(0.0, 0.0, 0.0), (0.5, 0.5, 0.5)]
+
+    with pytest.raises(ValueError):
+        set_structure_sites(get_data_class('structure')(cell=np.eye(3).tolist()), [0.0, 0.0, 0.0], ['Si'], ['Si'])
@@ -0,0 +1,133 @@
+"""
+Run triage.
+
+-----------
+A cheap check of the state of a VASP run that is done before the full parsing. Only the tail of
+vasprun.xml and OUTCAR and the standard stream are inspected, which classifies the run as finished,
+truncated or crashed. A run only counts as crashed if an output file is also truncated, errors in the
+standard stream of a run with complete output files are left to the notifications. For runs that did
+not finish, the VaspParser only parses a small salvage set of quantities, optionally together with the
+completed ionic steps, and returns the exit code determined here. The files are given as paths or binary handles, see file_access.py.
+"""
+import os
+
+from parsevasp.stream import Stream
+from aiida_vasp.parsers.file_access import open_source
+
+FINISHED = 'finished'
+TRUNCATED = 'truncated'
+CRASHED = 'crashed'
+
+# Quantities of the misc node that are still parsed for runs that did not finish.
+SALVAGE_QUANTITIES = ('notifications', 'run_stats')
+# With the `salvage_ionic_steps` parser setting, also the nodes and quantities of the completed ionic steps
+# are parsed, the run_status of vasprun.xml gives the number of recovered ionic steps.
+SALVAGE_IONIC_NODES = ('structure', 'trajectory', 'energies')
+SALVAGE_IONIC_QUANTITIES = SALVAGE_IONIC_NODES + ('run_status',)
+
+VASPRUN_CLOSING_TAG = b'</modeling>'
+OUTCAR_TIMING_BLOCK = b'General timing and accounting'
+VASPRUN_TAIL_SIZE = 1024
+OUTCAR_TAIL_SIZE = 16 * 1024
+
+
+def read_tail(source, size):
+    """Return the last `size` bytes of a file."""
+    with open_source(source) as handler:
+        handler.seek(0, os.SEEK_END)
+        handler.seek(max(handler.tell() - size, 0))
+        return handler.read()
+
+
+def is_vasprun_closed(source):
+    """Check whether vasprun.xml ends with the closing tag of the root element."""
+    return read_tail(source, VASPRUN_TAIL_SIZE).rstrip().endswith(VASPRUN_CLOSING_TAG)
+
+
+def has_outcar_timing(source):
+    """Check whether the timing block, which VASP writes when it finishes, is at the end of OUTCAR."""
+    return OUTCAR_TIMING_BLOCK in read_tail(source, OUTCAR_TAIL_SIZE)
+
+
+def get_fatal_errors(source, config=None):
+    """Return the short names of the errors in the standard stream that VASP can not recover from."""
+    try:
+        if isinstance(source, str):
+            stream = Stream(file_path=source, config=config)
+        else:
+            with open_source(source, 'r') as file_handler:
+                stream = Stream(file_handler=file_handler, config=config)
+    except SystemExit:
+        return []
+    return [entry.shortname for entry in stream.entries if entry.kind == 'ERROR' and not entry.recover]
+
+
+class Triage(object):  # pylint: disable=useless-object-inheritance
+    """The state of a run, as determined by triage_run."""
+
+    def __init__(self, status=FINISHED, truncated_files=None, errors=None):
+        self.status = status
+        self.truncated_files = truncated_files or []
+        self.errors = errors or []
+
+    @property
+    def failed(self):
+        return self.status != FINISHED
+
+    @property
+    def run_status(self):
+        """The run_status of the misc node of a run that did not finish."""
+        return {'finished': not self.failed, 'electronic_converged': False, 'ionic_converged': False, 'triage': self.status}
+
+    def get_salvage_quantities(self, salvage_ionic_steps=False):
+        """Return the quantities that are parsed for a run that did not finish."""
+        if salvage_ionic_steps:
+            return SALVAGE_QUANTITIES + SALVAGE_IONIC_QUANTITIES
+        return SALVAGE_QUANTITIES
+
+    def get_salvage_run_status(self, parsed_run_status=None):
+        """
+        Return the run_status of a run that did not finish.
+
+        :param parsed_run_status: the run_status parsed from vasprun.xml if the ionic steps were salvaged, which
+            gives the number of recovered ionic steps.
+        """
+        run_status = self.run_status
+        if parsed_run_status is not None:
+            run_status['recovered_ionic_steps'] = parsed_run_status.get('recovered_ionic_steps', 0)
+        return run_status
+
+    def get_exit_code(self, exit_codes):
+        """Return the exit code corresponding to the state of the run or None if it finished."""
+        if self.status == CRASHED:
+            return exit_codes.ERROR_VASP_CRASHED.format(errors=', '.join(self.errors))
+        if self.status == TRUNCATED:
+            return exit_codes.ERROR_VASP_OUTPUT_TRUNCATED.format(files=', '.join(self.truncated_files))
+        return None
+
+
+def triage_run(sources, stream_config=None):
+    """
+    Classify a run as finished, truncated or crashed.
+
+    :param sources: dict of file name -> path or binary handle of the retrieved files. Only vasprun.xml, OUTCAR and
+        vasp_output are inspected, files that are not present are not taken into account.
+    :param stream_config: the configuration of the stream parser, see parsevasp.
+    :return: a Triage instance. A run with truncated files is crashed if the standard stream contains fatal
+        errors and truncated otherwise. If no file is truncated, the run is finished and errors in the standard
+        stream are left to the notifications of the misc node.
+    """
+    truncated_files = []
+    if sources.get('vasprun.xml') is not None and not is_vasprun_closed(sources['vasprun.xml']):
+        truncated_files.append('vasprun.xml')
+    if sources.get('OUTCAR') is not None and not has_outcar_timing(sources['OUTCAR']):
+        truncated_files.append('OUTCAR')
+    if not truncated_files:
+        return Triage()
+
+    errors = []
+    if sources.get('vasp_output') is not None:
+        errors = get_fatal_errors(sources['vasp_output'], config=stream_config)
+    if errors:
+        return Triage(CRASHED, truncated_files, errors)
+    return Triage(TRUNCATED, truncated_files)
@@ -12,11 +12,22 @@ contains several modules:
 """
 #encoding: utf-8
 # pylint: disable=no-member
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from aiida.common.exceptions import NotExistent
 from aiida_vasp.parsers.base import BaseParser
 from aiida_vasp.parsers.quantity import ParsableQuantities
 from aiida_vasp.parsers.settings import ParserSettings, ParserDefinitions
 from aiida_vasp.parsers.node_composer import NodeComposer, get_node_composer_inputs
+from aiida_vasp.parsers.profiling import ParserProfile, get_peak_rss
+from aiida_vasp.parsers.file_access import get_source_size
+from aiida_vasp.parsers.cache import get_parse_cache, hash_file, is_cacheable
+from aiida_vasp.parsers.plan import get_plan_key, get_parser_plan
+from aiida_vasp.parsers.triage import SALVAGE_IONIC_NODES, Triage, triage_run
+
+# The set of file parsers of the parser definitions, see FILE_PARSER_SETS in settings.py.
+FILE_PARSER_SET = 'default'
 
 DEFAULT_OPTIONS = {
     'add_trajectory': False,
@@ -36,6 +47,7 @@ DEFAULT_OPTIONS = {
     'add_forces': False,
     'add_stress': False,
     'add_site_magnetization': False,
+    'add_performance_profile': False,
 }
 
 
@@ -69,6 +81,9 @@ class VaspParser(BaseParser):
         'kpoints':    KpointsData node parsed from IBZKPT.
         'wavecar':    FileData node containing the WAVECAR file.
         'chgcar':     FileData node containing the CHGCAR file.
+        'performance_profile': Dict node with the cpu and wall times of each electronic (LOOP) and ionic (LOOP+)
+                      step, the number of electronic steps of each ionic step, the memory usage and the parallel
+                      setup (MPI ranks, k-point and band groups) parsed from OUTCAR.
 
     * `output_params`: A list of quantities, that should be added to the 'misc' node.
 
@@ -77,6 +92,90 @@ class VaspParser(BaseParser):
         By this option the default set of FileParsers can be chosen. See settings.py
         for available options.
 
+    * `parallel_files`: Bool or int (DEFAULT = False).
+
+        Parse the retrieved files concurrently in a thread pool. If an integer is given, it sets
+        the maximum number of threads. The parsed content and exit code do not depend on this option.
+
+    * `parser_profile`: Bool (DEFAULT = False).
+
+        Record the construction time, the time spent in each quantity, the file size and the increase
+        of the peak memory for each file parser, as well as the time spent composing each node. The
+        profile is written to the logger and attached as the `parser_profile` Dict output.
+
+    * `max_parse_memory`: Number (DEFAULT = None).
+
+        Memory budget in MB for a single quantity of vasprun.xml. The size of the large arrays (trajectory,
+        projectors, dos, eigenvalues, occupancies, hessian and dynmat) is estimated from the header of the file
+        before it is parsed. Quantities exceeding the budget are skipped with a warning, the nodes requiring them
+        are not added and the ERROR_QUANTITY_EXCEEDS_MEMORY_BUDGET exit code is returned. If the trajectory
+        exceeds the budget, only the last ionic step is read, so also e.g. `energies` only cover that step.
+
+    * `vasprun_backend`: String (DEFAULT = 'parsevasp').
+
+        The reader of vasprun.xml. 'parsevasp' builds the full xml tree, while 'iterparse' streams the file,
+        reading each ionic step into preallocated arrays and releasing it, which bounds the memory for long
+        molecular dynamics runs by the size of the parsed arrays, see vasprun_iterparse.py. 'indexed' only records
+        where the sections of the file begin and end and parses the sections needed by each quantity, which is
+        the fastest choice when only e.g. `total_energies`, `maximum_force` and `run_status` are requested from
+        a large file, see vasprun_index.py.
+
+    * `trajectory_start`, `trajectory_stop`, `trajectory_stride`: Integers (DEFAULT = None).
+
+        Only extract the ionic steps range(start, stop, stride) for the `trajectory` quantity, counted from 0.
+        The other ionic steps are not converted while parsing vasprun.xml. The first and the last ionic step
+        are still read for the final structure, forces and stress. The `steps` array of the trajectory node
+        holds the numbers of the extracted ionic steps.
+
+    * `trajectory_fields`: List (DEFAULT = None).
+
+        The fields of the `trajectory` quantity to extract, out of 'cells', 'positions', 'forces' and 'stress',
+        e.g. ['positions'] for the positions only. All are extracted by default.
+
+        If vasprun.xml was not retrieved or its trajectory can not be read, the `trajectory` quantity is read
+        from the ionic steps of OUTCAR instead, with the same selection of ionic steps and fields.
+
+    * `electronic_step_energies_layout`: String (DEFAULT = 'counts').
+
+        How the energies of the electronic steps are stored in the `energies` node when `electronic_step_energies`
+        is set. 'counts' stores the flat energies of each energy type with the number of electronic steps of each
+        ionic step in `electronic_steps`. 'ragged' stores `<etype>` with `<etype>_offsets` of length number of ionic
+        steps + 1 and `<etype>_final`, such that the electronic steps of one ionic step can be read without
+        loading the others, see aiida_vasp.utils.energies.
+
+    * `storage_policies`: Dict (DEFAULT = None).
+
+        How the arrays of output nodes of type 'array' are stored, keyed by node name, e.g.
+        {'projectors': {'dtype': 'float32', 'sparse_threshold': 1e-4, 'compress': True}}. 'dtype' downcasts
+        the float arrays to 'float32' or 'float16'. 'sparse_threshold' sets elements with an absolute value
+        below it to zero and stores only the nonzero elements. 'compress' stores the arrays in compressed
+        .npz files. Sparse or compressed arrays are stored in a CompressedArrayData node, whose get_array
+        returns the dense array, in the downcast dtype. Policies for nodes of other types are ignored.
+
+    * `triage`: Bool (DEFAULT = True).
+
+        Before parsing, check whether vasprun.xml ends with its closing tag, whether OUTCAR ends with the
+        timing block. If the run did not finish, only the salvage set of the misc node (notifications, run_stats
+        and run_status) is parsed and ERROR_VASP_OUTPUT_TRUNCATED is returned, or ERROR_VASP_CRASHED if the
+        standard stream also contains errors VASP can not recover from.
+
+    * `salvage_ionic_steps`: Bool (DEFAULT = False).
+
+        Keep the completed ionic steps of a run that did not finish. A truncated vasprun.xml is then streamed
+        without the recovery mode of lxml, which keeps every closed <calculation> and drops the trailing partial
+        one, see vasprun_iterparse.py. Besides the salvage set of the misc node, the `structure` (the last
+        completed ionic step), `trajectory` and `energies` nodes are added and `run_status` holds the number of
+        `recovered_ionic_steps`, so that a restart can continue from the last completed geometry. The exit code
+        is still ERROR_VASP_OUTPUT_TRUNCATED or ERROR_VASP_CRASHED.
+
+    * `parse_cache`: Bool or dict (DEFAULT = False).
+
+        Cache the parsed quantities on disk, addressed by the content hash of the file, the file parser and
+        its FORMAT_VERSION, the versions of aiida-vasp and parsevasp, the quantity and the settings that
+        influence parsing. Quantities found in the cache are not parsed again. A dict with `directory` and
+        `max_size` (in MB) configures the location and the size limit, above which the least recently used
+        entries are evicted. The eviction is done after a parse that wrote new entries, at most once a minute.
+
     Additional FileParsers can be added to the VaspParser by using
 
         VaspParser.add_file_parser(parser_name, parser_definition_dict),
@@ -84,6 +183,11 @@ class VaspParser(BaseParser):
     where the 'parser_definition_dict' should contain the 'parser_class' and the
     'is_critical' flag. Keep in mind adding an additional FileParser after 'parse_with_retrieved'
     is called, will only have an effect when parsing a second time.
+
+    The screening of the parser definitions against the retrieved files is memoized in a
+    ParserPlan per file parser set, node settings and retrieved file names, see plan.py, as are the
+    output node definitions, so the parser definitions and nodes are not set up again for each parse.
+    A parser with added FileParsers, parsable quantities or custom nodes compiles its own plan instead.
     """
 
     def __init__(self, node):
@@ -98,57 +202,314 @@ class VaspParser(BaseParser):
         if calc_settings:
             parser_settings = calc_settings.get_dict().get('parser_settings')
 
-        self._definitions = ParserDefinitions()
-        self._settings = ParserSettings(parser_settings, default_settings=DEFAULT_OPTIONS)
+        # The parser definitions are only set up when a plan has to be compiled or a definition is added.
+        self._definitions = None
+        self._settings = ParserSettings(parser_settings, default_settings=DEFAULT_OPTIONS, shared_nodes=True)
+        self._plan = None
         self._parsable_quantities = ParsableQuantities(vasp_parser_logger=self.logger)
+        self._file_parsers = {}
+        self._constructed_file_parsers = []
+        self._skipped_quantity_keys = set()
+        self._profile = None
+        self._cache = None
+        self._shared_plan = True
 
     def add_parser_definition(self, filename, parser_dict):
         """Add the definition of a fileParser to self._definitions."""
-        self._definitions.add_parser_definition(filename, parser_dict)
+        self._get_definitions().add_parser_definition(filename, parser_dict)
+        self._shared_plan = False
 
     def add_parsable_quantity(self, quantity_name, quantity_dict):
         """Add a single parsable quantity to the _parsable_quantities."""
         self._parsable_quantities.add_parsable_quantity(quantity_name, quantity_dict)
+        self._shared_plan = False
 
     def add_custom_node(self, node_name, node_dict):
         """Add a custom node to the settings."""
         self._settings.add_output_node(node_name, node_dict)
+        self._shared_plan = False
+
+    @property
+    def file_parser_instances(self):
+        """Number of file parser instances constructed during the last call to parse."""
+        return len(self._constructed_file_parsers)
 
     def parse(self, **kwargs):
         """The function that triggers the parsing of a calculation."""
+        try:
+            return self._parse(**kwargs)
+        finally:
+            self._close_files()
+
+    def _parse(self, **kwargs):
+        """Parse the retrieved files, which are released again by `parse`."""
 
         exit_code = None
+        self._profile = ParserProfile() if self._settings.get('parser_profile', False) else None
+        self._cache = get_parse_cache(self._settings)
         error_code = self._compose_retrieved_content(kwargs)
         if error_code is not None:
             return error_code
 
-        for file_name, value_dict in self._definitions.parser_definitions.items():
-            if file_name not in self._retrieved_content.keys() and value_dict['is_critical']:
-                return self.exit_codes.ERROR_CRITICAL_MISSING_FILE
-
+        plan = self._plan = self._get_parser_plan()
+        if plan.missing_critical_files:
+            return self.exit_codes.ERROR_CRITICAL_MISSING_FILE
+
+        triage = self._triage()
+        salvage_ionic_steps = triage.failed and self._settings.get('salvage_ionic_steps', False)
+        quantity_names_to_parse = None
+        if triage.failed:
+            self.logger.warning('VASP did not finish ({}), only the salvage set of the misc node{} is parsed.'.format(
+                triage.status, ' and the completed ionic steps' if salvage_ionic_steps else ''))
+            salvage_quantities = triage.get_salvage_quantities(salvage_ionic_steps)
+            quantity_names_to_parse = [name for name in plan.quantity_names_to_parse if name in salvage_quantities]
         self._parsable_quantities.setup(retrieved_filenames=self._retrieved_content.keys(),
-                                        parser_definitions=self._definitions.parser_definitions,
-                                        quantity_names_to_parse=self._settings.quantity_names_to_parse)
+                                        quantity_names_to_parse=quantity_names_to_parse,
+                                        file_sizes=self._get_file_sizes(),
+                                        plan=plan)
 
+        self._file_parsers = {}
+        self._constructed_file_parsers = []
+        self._skipped_quantity_keys = set()
         parsed_quantities = {}
-        for quantity_key in self._parsable_quantities.quantity_keys_to_parse:
-            file_name = self._parsable_quantities.quantity_keys_to_filenames[quantity_key]
-            file_parser_cls = self._definitions.parser_definitions[file_name]['parser_class']
-            parser = file_parser_cls(settings=self._settings, exit_codes=self.exit_codes, file_path=self._get_file(file_name))
-            parsed_quantity = parser.get_quantity(quantity_key)
-            if parsed_quantity is not None:
-                parsed_quantities[quantity_key] = parsed_quantity
-            exit_code = parser.exit_code
-
-        for _, node_dict in self._settings.output_nodes_dict.items():
+        quantity_keys_to_parse = self._parsable_quantities.quantity_keys_to_parse
+        while quantity_keys_to_parse:
+            exit_code = self._parse_quantities(quantity_keys_to_parse, parsed_quantities, exit_code)
+            # Try the alternatives of requested quantities that could not be parsed.
+            quantity_keys_to_parse = self._parsable_quantities.get_fallback_quantity_keys(parsed_quantities)
+        self.logger.debug('Constructed {} file parser instances.'.format(self.file_parser_instances))
+        if self._cache is not None:
+            self._cache.evict_if_due()
+        if triage.failed:
+            parsed_run_status = (parsed_quantities.get('run_status') or {}) if salvage_ionic_steps else None
+            parsed_quantities['run_status'] = triage.get_salvage_run_status(parsed_run_status)
+
+        for node_name, node_dict in self._settings.output_nodes_dict.items():
+            if triage.failed and node_name != 'misc' and not (salvage_ionic_steps and node_name in SALVAGE_IONIC_NODES):
+                continue
             equivalent_quantity_keys = self._parsable_quantities.equivalent_quantity_keys
             inputs = get_node_composer_inputs(equivalent_quantity_keys, parsed_quantities, node_dict['quantities'])
-            aiida_node = NodeComposer.compose(node_dict['type'], inputs)
+            if self._requires_skipped_quantity(node_dict, inputs):
+                self.logger.warning('The {} node is not added, as it requires a quantity that exceeds '
+                                    'max_parse_memory.'.format(node_dict['link_name']))
+                continue
+            aiida_node = self._compose_node(node_dict, inputs)
             if aiida_node is None:
                 return self.exit_codes.ERROR_PARSING_FILE_FAILED
             self.out(node_dict['link_name'], aiida_node)
 
+        if self._profile is not None:
+            self._profile.log(self.logger)
+            self.out('parser_profile', NodeComposer.compose('dict', self._profile.get_dict()))
+
+        if triage.failed:
+            return triage.get_exit_code(self.exit_codes)
+
         if exit_code is not None:
             return exit_code
 
         return self.exit_codes.NO_ERROR
+
+    def _triage(self):
+        """Determine the state of the run from the tails of the retrieved files, unless disabled by the `triage` setting."""
+        if not self._settings.get('triage', True):
+            return Triage()
+        sources = {
+            file_name: self._get_file_source(file_name)
+            for file_name in ['vasprun.xml', 'OUTCAR', 'vasp_output']
+            if file_name in self._retrieved_content
+        }
+        return triage_run(sources, stream_config=self._settings.get('stream_config', None))
+
+    def _get_parser_plan(self):
+        """Return the memoized plan, or compile a private one if definitions or quantities have been added to this parser."""
+
+        def _compile_plan():
+            return self._parsable_quantities.compile_plan(retrieved_filenames=self._retrieved_content.keys(),
+                                                          parser_definitions=self._get_definitions().parser_definitions,
+                                                          quantity_names_to_parse=self._settings.quantity_names_to_parse)
+
+        if not self._shared_plan:
+            return _compile_plan()
+        key = get_plan_key(FILE_PARSER_SET, self._settings, self._retrieved_content.keys())
+        return get_parser_plan(key, _compile_plan)
+
+    def _get_definitions(self):
+        """Return the parser definitions of this parser, setting them up on first use."""
+        if self._definitions is None:
+            self._definitions = ParserDefinitions(FILE_PARSER_SET)
+        return self._definitions
+
+    def _requires_skipped_quantity(self, node_dict, inputs):
+        """Check whether a quantity of the node is missing, because it has been skipped due to `max_parse_memory`."""
+        equivalent_quantity_keys = self._parsable_quantities.equivalent_quantity_keys
+        for quantity_name in node_dict['quantities']:
+            if quantity_name in inputs:
+                continue
+            if any(key in self._skipped_quantity_keys for key in equivalent_quantity_keys.get(quantity_name, [quantity_name])):
+                return True
+        return False
+
+    def _get_file_sizes(self):
+        """Return the sizes of the retrieved files that have a file parser, used to select between alternatives."""
+        file_sizes = {}
+        for file_name in self._plan.parser_definitions:
+            if file_name in self._retrieved_content:
+                file_size = get_source_size(self._get_file_source(file_name))
+                if file_size is not None:
+                    file_sizes[file_name] = file_size
+        return file_sizes
+
+    def _parse_quantities(self, quantity_keys, parsed_quantities, exit_code):
+        """
+        Parse the quantity keys, which are ordered such that prerequisites come first.
+
+        The quantity keys are parsed in levels, where each level only depends on the quantities of earlier
+        levels, which are passed as inputs. A file parser instance is shared by all quantities of a file,
+        across the levels, and released when the last quantity of its file has been parsed. Within a level,
+        the files can be parsed concurrently.
+
+        :return: the exit code after parsing the last quantity key.
+        """
+        remaining_quantities = {}
+        for quantity_key in quantity_keys:
+            file_name = self._parsable_quantities.quantity_keys_to_filenames[quantity_key]
+            remaining_quantities[file_name] = remaining_quantities.get(file_name, 0) + 1
+
+        for level in self._parsable_quantities.get_parse_levels(quantity_keys):
+            quantity_keys_by_file = self._group_quantity_keys_by_file(level)
+            file_results = self._parse_files(quantity_keys_by_file, parsed_quantities)
+
+            # Merge the results in the order of the quantities, such that the exit code
+            # precedence does not depend on the order the files were parsed in.
+            for quantity_key in level:
+                file_name = self._parsable_quantities.quantity_keys_to_filenames[quantity_key]
+                parsed_quantity, exit_code = file_results[file_name][quantity_key]
+                if parsed_quantity is not None:
+                    parsed_quantities[quantity_key] = parsed_quantity
+
+            for file_name, file_quantity_keys in quantity_keys_by_file.items():
+                remaining_quantities[file_name] -= len(file_quantity_keys)
+                if remaining_quantities[file_name] == 0:
+                    self._release_file_parser(file_name)
+
+        return exit_code
+
+    def _group_quantity_keys_by_file(self, quantity_keys):
+        """Group the quantity keys by the file they are parsed from, keeping their order."""
+        quantity_keys_by_file = {}
+        for quantity_key in quantity_keys:
+            file_name = self._parsable_quantities.quantity_keys_to_filenames[quantity_key]
+            quantity_keys_by_file.setdefault(file_name, []).append(quantity_key)
+        return quantity_keys_by_file
+
+    def _parse_files(self, quantity_keys_by_file, parsed_quantities):
+        """
+        Parse the quantities of each file.
+
+        The files do not share any state, so if `parallel_files` is set in the parser settings
+        they are parsed concurrently in a thread pool. Either `True` (one thread per file) or the
+        maximum number of threads can be given.
+
+        :return: dict of file name -> {quantity_key: (parsed quantity, exit code after parsing it)}
+        """
+        # Resolve the file sources here, as the repository should only be accessed from the main thread.
+        for file_name in quantity_keys_by_file:
+            if file_name not in self._file_parsers:
+                self._file_parsers[file_name] = {'source': self._get_file_source(file_name), 'parser': None, 'exit_code': None}
+        inputs = {
+            quantity_key: self._parsable_quantities.get_inputs(quantity_key, parsed_quantities)
+            for quantity_keys in quantity_keys_by_file.values() for quantity_key in quantity_keys
+        }
+
+        parallel_files = self._settings.get('parallel_files', False)
+        if not parallel_files or len(quantity_keys_by_file) < 2:
+            return {
+                file_name: self._parse_file_quantities(file_name, quantity_keys, inputs)
+                for file_name, quantity_keys in quantity_keys_by_file.items()
+            }
+
+        max_workers = len(quantity_keys_by_file) if parallel_files is True else int(parallel_files)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                file_name: executor.submit(self._parse_file_quantities, file_name, quantity_keys, inputs)
+                for file_name, quantity_keys in quantity_keys_by_file.items()
+            }
+            return {file_name: future.result() for file_name, future in futures.items()}
+
+    def _parse_file_quantities(self, file_name, quantity_keys, inputs):
+        """
+        Parse the given quantities from one file.
+
+        A single file parser instance is shared by all quantities of the file, such that e.g.
+        vasprun.xml is only read once. If the parse cache is enabled, quantities found in the cache
+        are taken from there and the file parser is only constructed if at least one quantity is missing.
+        """
+        entry = self._file_parsers[file_name]
+        source = entry['source']
+        file_parser_cls = self._plan.parser_definitions[file_name]['parser_class']
+        cache = self._cache if file_parser_cls.CACHEABLE and source is not None else None
+        if cache is not None and 'file_hash' not in entry:
+            entry['file_hash'] = hash_file(source)
+
+        results = {}
+        for quantity_key in quantity_keys:
+            cache_key = None
+            # Quantities depending on inputs from other files are not cached.
+            if cache is not None and not inputs[quantity_key]:
+                cache_key = cache.get_key(entry['file_hash'], file_parser_cls, quantity_key, self._settings)
+                hit, payload = cache.get(cache_key)
+                if hit:
+                    parsed_quantity, new_exit_code = payload
+                    self._update_exit_code(entry, quantity_key, new_exit_code)
+                    results[quantity_key] = (parsed_quantity, entry['exit_code'])
+                    continue
+
+            parser = self._get_file_parser(file_name, file_parser_cls)
+            parser_exit_code = parser.exit_code
+            parsed_quantity = parser.get_quantity(quantity_key, inputs=inputs[quantity_key])
+            # Only store the exit code if parsing this quantity changed it
+            new_exit_code = parser.exit_code if parser.exit_code != parser_exit_code else None
+            self._update_exit_code(entry, quantity_key, new_exit_code)
+            results[quantity_key] = (parsed_quantity, entry['exit_code'])
+            if cache_key is not None and is_cacheable(parsed_quantity):
+                cache.put(cache_key, (parsed_quantity, new_exit_code))
+
+        return results
+
+    def _update_exit_code(self, entry, quantity_key, new_exit_code):
+        """Keep the exit code set by parsing a quantity and record the quantities skipped due to `max_parse_memory`."""
+        if new_exit_code is None:
+            return
+        entry['exit_code'] = new_exit_code
+        if new_exit_code.status == self.exit_codes.ERROR_QUANTITY_EXCEEDS_MEMORY_BUDGET.status:
+            self._skipped_quantity_keys.add(quantity_key)
+
+    def _get_file_parser(self, file_name, file_parser_cls):
+        """Return the file parser of a file, constructing it on first use."""
+        entry = self._file_parsers[file_name]
+        if entry['parser'] is None:
+            entry['peak_rss_before'] = get_peak_rss() if self._profile is not None else None
+            start = time.perf_counter()
+            source = entry['source']
+            # Files that are not on the file system are read through their handle instead of being copied.
+            source_kwarg = {'file_path': source} if source is None or isinstance(source, str) else {'file_handler': source}
+            entry['parser'] = file_parser_cls(settings=self._settings, exit_codes=self.exit_codes, **source_kwarg)
+            entry['construction_time'] = time.perf_counter() - start
+            self._constructed_file_parsers.append(file_name)
+        return entry['parser']
+
+    def _release_file_parser(self, file_name):
+        """Release the file parser of a file after its last quantity has been parsed."""
+        entry = self._file_parsers.pop(file_name)
+        if self._profile is not None and entry['parser'] is not None:
+            self._profile.add_file_parser(
+                ParserProfile.record_file_parser(file_name, entry['parser'], entry['construction_time'], entry['peak_rss_before']))
+
+    def _compose_node(self, node_dict, inputs):
+        """Compose an output node, recording the time spent if the parser is profiled."""
+        storage_policy = node_dict.get('storage_policy')
+        if self._profile is None:
+            return NodeComposer.compose(node_dict['type'], inputs, storage_policy=storage_policy)
+        with self._profile.compose(node_dict['link_name']):
+            return NodeComposer.compose(node_dict['type'], inputs, storage_policy=storage_policy)
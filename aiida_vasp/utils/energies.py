@@ -0,0 +1,93 @@
+"""
+Utils for the total energies.
+
+-----------------------------
+Access to the energies of the electronic steps in the `energies` output node, in both layouts written by the
+parser, see the `electronic_step_energies_layout` parser setting. In the 'ragged' layout the electronic steps
+of a single ionic step are read from the repository of the node without loading the other ionic steps.
+"""
+import os
+
+import numpy as np
+
+NPY_HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+
+
+def get_offsets(energies, etype='energy_extrapolated'):
+    """
+    Return the offsets of the ionic steps in the flat array of the energies of the electronic steps.
+
+    :param energies: the `energies` ArrayData node or a dict of its arrays.
+    :return: array of length number of ionic steps + 1, the electronic steps of ionic step i are [offsets[i]:offsets[i + 1]].
+    """
+    names = _get_names(energies)
+    if etype + '_offsets' in names:
+        return _get_array(energies, etype + '_offsets')
+    if 'electronic_steps' in names:
+        counts = _get_array(energies, 'electronic_steps')
+        offsets = np.zeros(len(counts) + 1, dtype=int)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets
+    raise ValueError('The energies do not contain the electronic steps, set the electronic_step_energies parser setting.')
+
+
+def get_electronic_step_energies(energies, ionic_step, etype='energy_extrapolated'):
+    """
+    Return the energies of the electronic steps of one ionic step.
+
+    :param energies: the `energies` ArrayData node or a dict of its arrays.
+    :param ionic_step: the ionic step, counted from 0, negative values count from the last ionic step.
+    """
+    offsets = get_offsets(energies, etype)
+    num_steps = len(offsets) - 1
+    if not -num_steps <= ionic_step < num_steps:
+        raise IndexError('Ionic step {} is out of range for {} ionic steps.'.format(ionic_step, num_steps))
+    ionic_step %= num_steps
+    start, stop = int(offsets[ionic_step]), int(offsets[ionic_step + 1])
+    if isinstance(energies, dict) or etype + '.npy' not in energies.list_object_names():
+        # Arrays stored in compressed .npz files, see the storage_policies parser setting, are read completely.
+        return _get_array(energies, etype)[start:stop]
+    with energies.open(etype + '.npy', mode='rb') as handle:
+        return read_npy_slice(handle, start, stop)
+
+
+def iter_electronic_step_energies(energies, etype='energy_extrapolated'):
+    """Iterate over the energies of the electronic steps of each ionic step, as views of the flat array."""
+    offsets = get_offsets(energies, etype)
+    flat = _get_array(energies, etype)
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        yield flat[start:stop]
+
+
+def read_npy_slice(handle, start, stop):
+    """
+    Read the elements [start:stop] of a one-dimensional array from a binary handle of a .npy file.
+
+    Only the header and the requested elements are read. Other arrays, e.g. Fortran ordered or of a
+    format version without a header reader here, are loaded completely.
+    """
+    version = np.lib.format.read_magic(handle)
+    reader = NPY_HEADER_READERS.get(version)
+    if reader is None:
+        handle.seek(0)
+        return np.load(handle)[start:stop]
+    shape, fortran_order, dtype = reader(handle)
+    if len(shape) != 1 or fortran_order or dtype.hasobject:
+        handle.seek(0)
+        return np.load(handle)[start:stop]
+    start, stop, _ = slice(start, stop).indices(shape[0])
+    count = max(stop - start, 0)
+    handle.seek(start * dtype.itemsize, os.SEEK_CUR)
+    return np.frombuffer(handle.read(count * dtype.itemsize), dtype=dtype, count=count)
+
+
+def _get_names(energies):
+    if isinstance(energies, dict):
+        return list(energies)
+    return energies.get_arraynames()
+
+
+def _get_array(energies, name):
+    if isinstance(energies, dict):
+        return energies[name]
+    return energies.get_array(name)
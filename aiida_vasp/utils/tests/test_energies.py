@@ -0,0 +1,27 @@
+"""Test the accessors of the electronic step energies."""
+import io
+
+import numpy as np
+
+from aiida_vasp.utils.energies import get_electronic_step_energies, get_offsets, read_npy_slice
+
+
+def test_read_npy_slice():
+    """Read slices of a stored array without loading all of it."""
+    array = np.arange(10, dtype=float)
+    handle = io.BytesIO()
+    np.save(handle, array)
+    for start, stop in [(0, 10), (3, 7), (9, 10), (5, 5), (8, 20)]:
+        handle.seek(0)
+        assert np.array_equal(read_npy_slice(handle, start, stop), array[start:stop])
+
+
+def test_layouts():
+    """Both layouts of the energies node give the same electronic steps."""
+    energies = np.array([3.0, 2.0, 1.0, 0.5, 0.4])
+    counts = {'energy_extrapolated': energies, 'electronic_steps': np.array([3, 2])}
+    ragged = {'energy_extrapolated': energies, 'energy_extrapolated_offsets': np.array([0, 3, 5])}
+    assert np.array_equal(get_offsets(counts), get_offsets(ragged))
+    for layout in [counts, ragged]:
+        assert np.array_equal(get_electronic_step_energies(layout, 0), [3.0, 2.0, 1.0])
+        assert np.array_equal(get_electronic_step_energies(layout, -1), [0.5, 0.4])
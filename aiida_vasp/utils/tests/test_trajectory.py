@@ -0,0 +1,44 @@
+"""Test the merging of trajectories."""
+# pylint: disable=unused-import,redefined-outer-name,unused-argument
+import pytest
+import numpy as np
+
+from aiida_vasp.utils.aiida_utils import get_data_class
+from aiida_vasp.utils.fixtures.environment import fresh_aiida_env
+from aiida_vasp.utils.trajectory import merge_trajectory_data, merge_calculation_trajectories
+
+
+@pytest.fixture
+def segments(fresh_aiida_env):
+    """Three trajectories of a restarted run, the second with a selection of its ionic steps."""
+    trajectories = []
+    for steps in [np.arange(5), np.array([0, 2, 3]), np.arange(3)]:
+        trajectory = get_data_class('array.trajectory')()
+        trajectory.set_array('steps', steps)
+        trajectory.set_array('positions', np.random.rand(len(steps), 2, 3))
+        trajectory.set_array('cells', np.tile(np.eye(3), (len(steps), 1, 1)))
+        trajectory.set_attribute('symbols', ['Si', 'Si'])
+        trajectories.append(trajectory)
+    return trajectories
+
+
+def test_merge(segments):
+    """The arrays are concatenated and the steps renumbered over the whole run."""
+    merged = merge_trajectory_data(segments)
+    assert np.array_equal(merged.get_array('steps'), [0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11])
+    assert np.array_equal(merged.get_array('positions'), np.concatenate([segment.get_array('positions') for segment in segments]))
+    assert merged.get_attribute('symbols') == ['Si', 'Si']
+
+
+def test_merge_stride(segments):
+    """The stride is applied to the merged trajectory."""
+    merged = merge_trajectory_data(segments, stride=2)
+    assert np.array_equal(merged.get_array('steps'), [0, 2, 4, 7, 9, 11])
+    assert np.array_equal(merged.get_array('positions')[3], segments[1].get_array('positions')[1])
+
+
+def test_merge_calculations(segments):
+    """The calcfunction accepts the list of calculations or trajectories of a restart workchain."""
+    merged = merge_calculation_trajectories(segments, stride=3)
+    assert merged.is_stored
+    assert np.array_equal(merged.get_array('steps'), [0, 3, 7, 10])
@@ -0,0 +1,119 @@
+"""
+Utils for trajectories.
+
+-----------------------
+Merging the trajectories of a chain of restarted calculations, e.g. a molecular dynamics run that is
+split into several calculations by the walltime, into one TrajectoryData.
+"""
+import numpy as np
+
+from aiida.engine import calcfunction
+from aiida.orm import Int
+
+from aiida_vasp.utils.aiida_utils import get_data_class
+
+
+def get_trajectories(calculations):
+    """
+    Return the trajectories of a list of calculations, e.g. the `calculations` in the context of a BaseRestartWorkChain.
+
+    The items can be calculation or workchain nodes with a `trajectory` output, or TrajectoryData nodes.
+    Calculations without a trajectory, e.g. ones that failed before the first ionic step, are skipped.
+    """
+    trajectory_cls = get_data_class('array.trajectory')
+    trajectories = []
+    for calculation in calculations:
+        if isinstance(calculation, trajectory_cls):
+            trajectories.append(calculation)
+        elif 'trajectory' in calculation.outputs:
+            trajectories.append(calculation.outputs.trajectory)
+    return trajectories
+
+
+def merge_trajectory_data(trajectories, stride=1):
+    """
+    Concatenate trajectories into a new, unstored, TrajectoryData.
+
+    The arrays present in all trajectories are concatenated along the ionic steps, copying one array of one
+    trajectory at a time into the preallocated result. The `steps` of each trajectory are shifted by the number
+    of ionic steps of the ones before, so they number the ionic steps of the whole run.
+
+    :param trajectories: list of TrajectoryData, in the order of the run.
+    :param stride: keep every stride-th ionic step of the merged trajectory, starting with the first.
+    """
+    if not trajectories:
+        raise ValueError('At least one trajectory is needed.')
+    if stride < 1:
+        raise ValueError('The stride has to be at least 1.')
+    symbols = trajectories[0].get_attribute('symbols', None)
+    if any(list(trajectory.get_attribute('symbols', None) or []) != list(symbols or []) for trajectory in trajectories[1:]):
+        raise ValueError('The trajectories have different symbols.')
+    names = [name for name in trajectories[0].get_arraynames() if all(name in trajectory.get_arraynames() for trajectory in trajectories)]
+    names = [name for name in names if name != 'steps']
+    shapes = {}
+    for name in names:
+        shapes[name] = [tuple(trajectory.get_shape(name)) for trajectory in trajectories]
+        if len({shape[1:] for shape in shapes[name]}) != 1:
+            raise ValueError('The shapes of the {} of the trajectories do not match.'.format(name))
+    steps = [_get_steps(trajectory, shapes[names[0]][index][0] if names else 0) for index, trajectory in enumerate(trajectories)]
+
+    num_frames = [len(item) for item in steps]
+    # The first frame of each trajectory that is kept with the stride, counted from the start of the merged trajectory.
+    frame_offsets = np.concatenate(([0], np.cumsum(num_frames)))
+    starts = (-frame_offsets[:-1]) % stride
+    counts = [len(range(start, frames, stride)) for start, frames in zip(starts, num_frames)]
+    positions = np.concatenate(([0], np.cumsum(counts)))
+
+    arrays = {name: None for name in names}
+    arrays['steps'] = np.empty(positions[-1], dtype=int)
+    step_offset = 0
+    for index, trajectory in enumerate(trajectories):
+        for name in names:
+            array = trajectory.get_array(name)
+            if arrays[name] is None:
+                arrays[name] = np.empty((positions[-1],) + shapes[name][0][1:], dtype=array.dtype)
+            arrays[name][positions[index]:positions[index + 1]] = array[starts[index]::stride]
+        arrays['steps'][positions[index]:positions[index + 1]] = steps[index][starts[index]::stride] + step_offset
+        # The steps of a trajectory can be a selection of its ionic steps, the last of which is always included.
+        if num_frames[index]:
+            step_offset += int(steps[index][-1]) + 1
+
+    merged = get_data_class('array.trajectory')()
+    for name, array in arrays.items():
+        merged.set_array(name, array)
+    if symbols is not None:
+        merged.set_attribute('symbols', symbols)
+    return merged
+
+
+@calcfunction
+def merge_trajectories(**kwargs):
+    """
+    Merge trajectories, given as the keyword arguments `trajectory_<index>`, with provenance.
+
+    An optional `stride` Int keeps every stride-th ionic step, see merge_trajectory_data.
+    """
+    stride = kwargs.pop('stride', None)
+    trajectories = [kwargs[key] for key in sorted(kwargs)]
+    return merge_trajectory_data(trajectories, stride=stride.value if stride is not None else 1)
+
+
+def merge_calculation_trajectories(calculations, stride=1):
+    """
+    Merge the trajectories of a chain of calculations with the merge_trajectories calcfunction.
+
+    :param calculations: list of calculations or trajectories, e.g. `self.ctx.calculations` of a BaseRestartWorkChain.
+    :return: the merged TrajectoryData.
+    """
+    trajectories = get_trajectories(calculations)
+    if not trajectories:
+        raise ValueError('None of the calculations has a trajectory.')
+    inputs = {'trajectory_{:06d}'.format(index): trajectory for index, trajectory in enumerate(trajectories)}
+    return merge_trajectories(stride=Int(stride), **inputs)
+
+
+def _get_steps(trajectory, num_frames):
+    """Return the numbers of the ionic steps of a trajectory, counted from 0."""
+    if 'steps' in trajectory.get_arraynames():
+        return trajectory.get_array('steps')
+    return np.arange(num_frames)
@@ -0,0 +1,149 @@
+"""
+Benchmark the decoding of vasprun.xml.
+
+Compares parsevasp's Xml with the vectorized decoding of the 'parsevasp' backend (VectorizedXml) and the
+streaming 'iterparse' backend (IterparseXml) on vasprun.xml files from aiida_vasp/test_data, which are
+scaled up synthetically: the k-points of the eigenvalues and projectors and the rows of the density of
+states are repeated `--scale` times and the ionic steps are repeated `--steps` times. The 'indexed' backend
+(IndexedXml) is timed for indexing the file and reading the final energies, forces and parameters only.
+
+Usage: python ops/benchmark_vasprun.py [--scale 10] [--steps 200] [--repeat 3]
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+import tempfile
+import functools
+
+from lxml import etree
+from parsevasp.vasprun import Xml
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+# pylint: disable=wrong-import-position
+from aiida_vasp.parsers.file_parsers.vasprun_arrays import VectorizedXml, decode_rows
+from aiida_vasp.parsers.file_parsers.vasprun_iterparse import IterparseXml
+from aiida_vasp.parsers.file_parsers.vasprun_index import IndexedXml
+
+BACKENDS = [('parsevasp Xml', Xml), ('VectorizedXml', VectorizedXml), ('IterparseXml', IterparseXml)]
+
+
+def test_data_path(*args):
+    return os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'aiida_vasp', 'test_data', *args))
+
+
+def repeat_children(parent, tag, times):
+    """Repeat the children of a given tag, keeping the order of the other children."""
+    children = parent.findall(tag)
+    if not children:
+        return
+    anchor = children[-1]
+    for _ in range(times - 1):
+        for child in children:
+            duplicate = copy.deepcopy(child)
+            anchor.addnext(duplicate)
+            anchor = duplicate
+
+
+def scale_arrays(root, scale):
+    """Repeat the k-points of the eigenvalues and projectors and the rows of the density of states."""
+    for varray in root.findall('kpoints/varray'):
+        if varray.get('name') in ('kpointlist', 'weights'):
+            repeat_children(varray, 'v', scale)
+    for spin in root.findall('calculation/eigenvalues/array/set/set'):
+        repeat_children(spin, 'set', scale)
+    for spin in root.findall('calculation/projected/array/set/set'):
+        repeat_children(spin, 'set', scale)
+    for rows in root.findall('calculation/dos//set'):
+        if rows.find('r') is not None:
+            repeat_children(rows, 'r', scale)
+
+
+def scale_steps(root, steps):
+    """Repeat the first ionic step, so that the last one still holds the eigenvalues etc."""
+    calculations = root.findall('calculation')
+    anchor = calculations[0]
+    for _ in range(steps - 1):
+        duplicate = copy.deepcopy(calculations[0])
+        for child in duplicate.findall('eigenvalues') + duplicate.findall('projected') + duplicate.findall('dos'):
+            duplicate.remove(child)
+        anchor.addnext(duplicate)
+        anchor = duplicate
+
+
+def write_synthetic(source, destination, scale, steps):
+    tree = etree.parse(source)
+    root = tree.getroot()
+    scale_arrays(root, scale)
+    scale_steps(root, steps)
+    tree.write(destination)
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def get_row_blocks(file_path):
+    """Return the <r> and <v> rows of the largest arrays, with their number of columns."""
+    root = etree.parse(file_path).getroot()
+    blocks = {
+        'eigenvalues': root.findall('calculation/eigenvalues/array//r'),
+        'projectors': root.findall('calculation/projected/array//r'),
+        'dos': root.findall('calculation/dos/partial/array//r'),
+        'forces': root.findall('calculation/varray[@name="forces"]/v'),
+    }
+    return {name: (rows, len(rows[0].text.split())) for name, rows in blocks.items() if rows}
+
+
+def compare_decoding(file_path, repeat):
+    """Time the row by row conversion of parsevasp against decode_rows for each block."""
+    xml = VectorizedXml.__new__(VectorizedXml)
+    for name, (rows, num_columns) in get_row_blocks(file_path).items():
+        # pylint: disable=protected-access
+        row_by_row = best_time(lambda: Xml._convert_array2D_f(xml, rows, num_columns), repeat)  # pylint: disable=cell-var-from-loop
+        vectorized = best_time(lambda: decode_rows(rows, num_columns), repeat)  # pylint: disable=cell-var-from-loop
+        print('  decode {:<12} {:8d} rows {:8.3f} s -> {:8.3f} s  {:5.2f}x'.format(name, len(rows), row_by_row, vectorized,
+                                                                                  row_by_row / vectorized))
+
+
+def read_final_quantities(file_path):
+    """Read what is needed for the total energies, the maximum force and the run status with the indexed backend."""
+    xml = IndexedXml(file_path=file_path, k_before_band=True)
+    xml.get_energies('last', nosc=True)
+    xml.get_forces('last')
+    xml.get_parameters()
+    xml.get_num_calculations()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    arg_parser.add_argument('--scale', type=int, default=10, help='repetitions of the k-points and the dos rows')
+    arg_parser.add_argument('--steps', type=int, default=200, help='number of ionic steps')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='the best of this many runs is reported')
+    arg_parser.add_argument('cases', nargs='*', default=['partial', 'spin', 'relax'], help='test_data folders to use')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        for case in args.cases:
+            file_path = os.path.join(temporary, case + '.xml')
+            write_synthetic(test_data_path(case, 'vasprun.xml'), file_path, args.scale, args.steps)
+            size = os.path.getsize(file_path) / 1024**2
+            print('{} ({:.1f} MB)'.format(case, size))
+            compare_decoding(file_path, args.repeat)
+            timings = [(name, best_time(functools.partial(xml_cls, file_path=file_path, k_before_band=True), args.repeat))
+                       for name, xml_cls in BACKENDS]
+            reference = timings[0][1]
+            for name, timing in timings:
+                print('  parse  {:<15} {:8.3f} s  {:5.2f}x'.format(name, timing, reference / timing))
+            timing = best_time(lambda: read_final_quantities(file_path), args.repeat)  # pylint: disable=cell-var-from-loop
+            print('  final  {:<15} {:8.3f} s  {:5.2f}x'.format('IndexedXml', timing, reference / timing))
+
+
+if __name__ == '__main__':
+    main()